@@ -96,6 +96,9 @@ class RoommeasureGUI(Tk):
         self.cmb_fs      = ttk.Combobox(content, values=srates, width=8)
         btn_tsweep       = ttk.Button(content, text='test sweep',
                                                command=self.test_logsweep)
+        self.btn_abort   = ttk.Button(content, text='abort',
+                                               command=rm.LS.abort_meas)
+        self.btn_abort['state'] = 'disabled'
 
         # - REMOTE JACK SECTION
         lbl_rjack        = ttk.Label(content, text='MANAGE JACK LOUDSPEAKER:',
@@ -127,6 +130,8 @@ class RoommeasureGUI(Tk):
                                                     'bold') )
         lbl_schro        = ttk.Label(content, text='smooth Schroeder')
         self.ent_schro   = ttk.Entry(content,                     width=5)
+        lbl_avgm         = ttk.Label(content, text='spatial average')
+        self.cmb_avgm    = ttk.Combobox(content, values=rm.AVG_METHODS, width=7)
 
         # - RUN SECTION
         btn_selfol       = ttk.Button(content, text='results folder:',
@@ -172,6 +177,7 @@ class RoommeasureGUI(Tk):
         lbl_scard.grid(         row=0,  column=0, sticky=W, pady=10 )
         btn_tsweep.grid(        row=0,  column=1, sticky=W, pady=10 )
         self.chk_validate.grid( row=0,  column=2 )
+        self.btn_abort.grid(    row=0,  column=3, sticky=W )
         lbl_cap.grid(           row=1,  column=0, sticky=E )
         self.cmb_cap.grid(      row=1,  column=1)
         lbl_pbk.grid(           row=1,  column=2, sticky=E )
@@ -201,6 +207,8 @@ class RoommeasureGUI(Tk):
         lbl_plot.grid(          row=5,  column=4, sticky=W )
         lbl_schro.grid(         row=6,  column=4, sticky=E )
         self.ent_schro.grid(    row=6,  column=5, sticky=W )
+        lbl_avgm.grid(          row=7,  column=4, sticky=E )
+        self.cmb_avgm.grid(     row=7,  column=5, sticky=W )
 
         # run
         lbl_timer.grid(         row=8,  column=0, sticky=E, pady=10)
@@ -359,9 +367,16 @@ class RoommeasureGUI(Tk):
             self.var_msg.set('TESTING SWEEP RECORDING ... (please wait)')
             self.btn_go['state'] = 'disabled'
             self.btn_close['state'] = 'disabled'
+            self.btn_abort['state'] = 'normal'
 
             rm.LS.do_meas()
 
+            self.btn_abort['state'] = 'disabled'
+            if rm.LS.measAborted:
+                self.var_msg.set('TEST SWEEP ABORTED')
+                self.btn_close['state'] = 'normal'
+                return
+
             # Checking TIME CLEARANCE:
             if not rm.LS.TimeClearanceOK:
                 self.var_msg.set('POOR TIME CLEARANCE! check sweep length')
@@ -414,9 +429,19 @@ class RoommeasureGUI(Tk):
             # - Includes time clearance test
             rm.LS.checkClearence = True
 
+            # - LF partial results while the sweep is running, so that
+            #   a bad take can be aborted early
+            rm.LS.progressiveLF     = True
+            rm.LS.progress_callback = show_LF_progress
+
             return True
 
 
+        def show_LF_progress(f, mag, fmax):
+            maxdB = max( 20 * rm.np.log10( mag ) )
+            self.var_msg.set(f'LF up to {int(fmax)} Hz: max {round(maxdB,1)} dB')
+
+
         if not configure_LS():
             return
 
@@ -566,6 +591,7 @@ class RoommeasureGUI(Tk):
             takes       =   int(self.cmb_locat.get())
             sweeplength =   int(self.cmb_sweep.get())
             Schro       =   float(self.ent_schro.get())
+            avgMethod   =   self.cmb_avgm.get()
             folder      =   self.ent_folder.get()
 
             rjaddr      =   self.ent_rjaddr.get()
@@ -584,7 +610,8 @@ class RoommeasureGUI(Tk):
                 self.var_msg.set( test_sc )
                 return
 
-            # - measure
+            # - measure (partial LF results are only for the test sweep)
+            rm.LS.progressiveLF = False
             rm.channels     = [c for c in channels]
             rm.numMeas      = takes
             rm.LS.N         = sweeplength
@@ -592,6 +619,12 @@ class RoommeasureGUI(Tk):
             # - smoothing
             rm.Schro         = Schro
 
+            # - spatial average of the mic locations
+            if avgMethod not in rm.AVG_METHODS:
+                self.var_msg.set( f'spatial average: {" | ".join(rm.AVG_METHODS)}' )
+                return
+            rm.avgMethod     = avgMethod
+
             # - output folder
             if folder:
                 rm.folder   = f'{UHOME}/{folder}'
@@ -824,6 +857,8 @@ if __name__ == '__main__':
     app.var_beep.set(1)
     # - Schroeder freq for smoothing result curve:
     app.ent_schro.insert(0, '200')
+    # - Spatial average of the mic locations (see spatial_avg.py):
+    app.cmb_avgm.set('mean')
     # - Output folder
     app.ent_folder.insert(0, 'roommeas/meas')
 
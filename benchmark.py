@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    benchmark.py
+
+    Timing comparisons for the logsweep2TF processing stages.
+    No sound card is needed, captures are synthesized from the prepared sweep.
+
+    Usage:      python3 benchmark.py  [options ... ...]
+
+    -h                  Help
+
+    -xcorr              Time clearance delay estimation:
+                        whole length xcorr vs lag limited FFT estimator.
+
+    -fft                Deconvolution FFT engines:
+                        whole complex float64 vs real FFT float64 / float32.
+
+    -offset             Play/record offset compensation:
+                        roll + FFT per take vs phase ramp on the prepared
+                        spectrum, also checks that both are equivalent.
+
+    -frd                FRD log reduction and smoothing for DUT and REF:
+                        audiotools functions vs the precomputed sparse operator
+                        (its one time build is shown apart).
+
+    -plot               plot_system_response() render time to .png:
+                        every sample vs the min/max envelope per pixel.
+
+    -imports            Cold start time of a new interpreter importing
+                        logsweep2TF and roomEQ, regular vs headless
+                        (DRC_HEADLESS=1) lazy imports. Ignores -e.
+
+    -dut                Full do_meas() pipeline on a synthetic DUT (a room
+                        impulse response plus noise and latency, see
+                        synthetic_dut.py), also checks the measured FRD
+                        against the ground truth.
+
+    -arena              Peak RSS and time per take of a session of several
+                        do_meas() takes on a synthetic DUT, allocating new
+                        arrays vs reusing the buffer arena (useArena).
+                        Every session runs in a new interpreter.
+
+    -progressive        Realtime 'progressive' capture (partial LF results
+                        meanwhile capturing) through a loopback FakeStream,
+                        at the largest N and fs. Checks that the capture has
+                        no ring buffer overruns (exits 1 if so), and the last
+                        partial result against the final FRD.
+
+    -fs=F1,F2,...       Sample rates for -dut and -progressive.
+                        Default 44100,48000,96000,192000
+
+    -dropouts=K         Lost blocks per capture for -dut. Default 0
+
+    -eMIN-MAX           Range of powers of 2 for the sweep length N.
+                        Default 14-22
+
+    -json=file          Appends the -dut and -arena results to the given file as JSON lines,
+                        tagged with the code version, to track regressions.
+
+"""
+
+import os
+import sys
+import json
+import platform
+import subprocess
+from time import time
+from datetime import datetime
+from contextlib import redirect_stdout
+import tracemalloc
+import numpy as np
+
+import logsweep2TF as LS
+import frd_operator
+from synthetic_dut import SyntheticDUT, room_ir, compare_FRD
+from duplex_capture import FakeStream
+
+
+# Machine readable results, as a list of dicts (see -json)
+results = []
+
+# A check failed, the exit status will be 1
+failed = False
+
+
+def synth_capture(delay=100, noise=1e-4):
+    """ A delayed and noisy copy of the LS tapered sweep, as (dut, ref)
+    """
+    x = np.roll(LS.sig_frac * LS.tapsweep, delay)
+    dut = 0.5 * x + noise * np.random.randn(LS.N)
+    ref =       x + noise * np.random.randn(LS.N)
+    return dut, ref
+
+
+def timeit(func, *args, **kwargs):
+    """ Runs func quietly, returns (result, elapsed_seconds)
+    """
+    with open(os.devnull, 'w') as devnull:
+        with redirect_stdout(devnull):
+            t0 = time()
+            res = func(*args, **kwargs)
+            elapsed = time() - t0
+    return res, elapsed
+
+
+def bench_xcorr(exps):
+
+    print( f'\n--- Time clearance delay estimation (fs: {LS.fs} Hz)\n' )
+    print( f'    {"N":>10}  {"full xcorr":>12}  {"lag limited":>12}  '
+           f'{"speed up":>9}  offsets' )
+
+    for e in exps:
+
+        LS.N = 2**e
+        timeit(LS.prepare_sweep)
+        delay = int(LS.N / 16)
+        dut, ref = synth_capture(delay)
+
+        (off1, ok1), t1 = timeit(LS.get_offset_xcorr, LS.sweep, dut, ref)
+        # the first call precomputes the sweep spectrum, the next ones reuse it
+        timeit(LS.get_offset_fft, LS.sweep, dut, ref)
+        (off2, ok2), t2 = timeit(LS.get_offset_fft, LS.sweep, dut, ref)
+
+        match = 'match' if (off1, ok1) == (off2, ok2) else f'DIFFER {off1} {off2}'
+        print( f'    2^{e:<2} {LS.N:>7}  {t1:>10.4f} s  {t2:>10.4f} s  '
+               f'{t1 / t2:>8.1f}x  {match}' )
+
+
+def bench_fft(exps):
+
+    engines = ( ('fft',  False, 'fft float64'),
+                ('rfft', False, 'rfft float64'),
+                ('rfft', True,  'rfft float32') )
+
+    print( f'\n--- Deconvolution FFT engines (fs: {LS.fs} Hz, workers: {LS.fft_workers})' )
+    print( f'    (max dev: max 20 Hz ~ 20 KHz deviation vs the fft float64 engine)\n' )
+    print( f'    {"N":>10}  {"engine":<13}  {"time":>9}  {"peak mem":>9}  max dev' )
+
+    for e in exps:
+
+        LS.N = 2**e
+        timeit(LS.prepare_sweep)
+        dut, ref = synth_capture(delay=0)
+        z = np.column_stack( (dut, ref) ).astype(np.float32)
+
+        ref_dB = None
+        for engine, single, label in engines:
+
+            LS.fft_engine = engine
+            LS.fft_single = single
+            # a first warm up run
+            timeit(LS.deconvolve, z)
+
+            tracemalloc.start()
+            (DUT_TF, _), t = timeit(LS.deconvolve, z)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            # the 20 Hz ~ 20 KHz band bins
+            b1, b2 = int(20 * LS.N / LS.fs), int(20000 * LS.N / LS.fs)
+            dB = 20 * np.log10( np.abs( DUT_TF[b1 : b2] ) )
+            if ref_dB is None:
+                ref_dB = dB
+            dev = np.max( np.abs(dB - ref_dB) )
+
+            print( f'    2^{e:<2} {LS.N:>7}  {label:<13}  {t:>7.4f} s  '
+                   f'{peak / 2**20:>6.1f} MB  {dev:.2e} dB' )
+
+    LS.fft_engine = 'rfft'
+    LS.fft_single = False
+
+
+def bench_offset(exps):
+
+    print( f'\n--- Offset compensation, half spectrum (fs: {LS.fs} Hz)\n' )
+    print( f'    {"N":>10}  {"roll + FFT":>11}  {"phase ramp":>11}  '
+           f'{"speed up":>9}  max rel. deviation' )
+
+    for e in exps:
+
+        LS.N = 2**e
+        timeit(LS.prepare_sweep)
+        offsets = (1, 37, -250, int(LS.N / 8), -int(LS.N / 8))
+
+        def roll_spectrum(offset):
+            """ as it was done before, by shifting the sweep array
+            """
+            lwindo = np.ones(LS.N)
+            lwindo[0:LS.indexf1] = 0.5 * ( 1 - np.cos( np.pi *
+                                   np.arange(0, LS.indexf1) / LS.indexf1 ) )
+            lwindosweep = np.roll(lwindo * LS.sweep, -offset)
+            return LS.S_dac * np.fft.rfft(lwindosweep) * LS.sig_frac
+
+        def ramp_spectrum(offset):
+            return LS.LWINDOSWEEP[ : LS.N//2 + 1 ] * LS.offset_ramp(offset, real=True)
+
+        dev = 0.0
+        t1 = t2 = 0.0
+        for offset in offsets:
+            S1, t = timeit(roll_spectrum, offset)
+            t1 += t
+            S2, t = timeit(ramp_spectrum, offset)
+            t2 += t
+            dev = max( dev, np.max( np.abs(S2 - S1) ) / np.max( np.abs(S1) ) )
+
+        t1 /= len(offsets)
+        t2 /= len(offsets)
+        check = 'OK' if dev < 1e-9 else '(!) NOT EQUIVALENT'
+        print( f'    2^{e:<2} {LS.N:>7}  {t1:>9.4f} s  {t2:>9.4f} s  '
+               f'{t1 / t2:>8.1f}x  {dev:.1e} {check}' )
+
+
+def bench_frd(exps):
+
+    print( f'\n--- FRD from DUT and REF spectra (fs: {LS.fs} Hz, '
+           f'{LS.FRDpoints} points, 1/{LS.Noct} oct)\n' )
+    print( f'    {"N":>10}  {"reference":>10}  {"operator":>10}  '
+           f'{"speed up":>9}  {"build":>8}  max dev' )
+
+    for e in exps:
+
+        LS.N = 2**e
+        meas = LS.Measurement()
+        TFs = np.random.randn(2, LS.N//2 + 1) + 1j * np.random.randn(2, LS.N//2 + 1)
+
+        meas.config.useFRDoperator = False
+        FRDs1, t1 = timeit(meas.fft_to_FRDs, TFs, smooth_Noct=LS.Noct)
+
+        meas.config.useFRDoperator = True
+        frd_operator._operators.clear()
+        _, tb = timeit(meas.frd_operator, LS.Noct)
+        FRDs2, t2 = timeit(meas.fft_to_FRDs, TFs, smooth_Noct=LS.Noct)
+
+        dev = max( [ np.max( np.abs(m2 - m1) / m1 )
+                     for (_, m1), (_, m2) in zip(FRDs1, FRDs2) ] )
+        print( f'    2^{e:<2} {LS.N:>7}  {t1:>8.4f} s  {t2:>8.4f} s  '
+               f'{t1 / t2:>8.1f}x  {tb:>6.2f} s  {dev:.1e}' )
+
+
+def bench_plot(exps):
+
+    import tempfile
+    LS.matplotlib.use('Agg')
+    folder = tempfile.mkdtemp()
+
+    print( f'\n--- plot_system_response render time (fs: {LS.fs} Hz)\n' )
+    print( f'    {"N":>10}  {"all samples":>11}  {"envelope":>9}  speed up' )
+
+    for e in exps:
+
+        LS.N = 2**e
+        timeit(LS.prepare_sweep)
+        dut, ref = synth_capture(delay=100)
+        timeit( LS.process_capture, np.column_stack( (dut, ref) ) )
+
+        times = []
+        for plotEnvelope in (False, True):
+            LS.plotEnvelope = plotEnvelope
+            _, t = timeit(LS.plot_system_response, png_folder=folder)
+            LS.plt.close('all')
+            times.append(t)
+
+        t1, t2 = times
+        print( f'    2^{e:<2} {LS.N:>7}  {t1:>9.3f} s  {t2:>7.3f} s  {t1 / t2:>7.1f}x' )
+
+    LS.plotEnvelope = True
+
+
+def bench_imports(exps, runs=5):
+
+    def cold_start(module, headless):
+        """ best wall time of a new interpreter importing module
+        """
+        env  = dict(os.environ, DRC_HEADLESS=headless)
+        cmd  = [sys.executable, '-c', f'import {module}'] if module else \
+               [sys.executable, '-c', 'pass']
+        best = None
+        for _ in range(runs):
+            t0 = time()
+            res = subprocess.run( cmd, env=env, cwd=os.path.dirname(__file__) or '.',
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE )
+            t = time() - t0
+            if res.returncode:
+                print( f'(!) unable to import {module}: '
+                       f'{res.stderr.decode().strip().splitlines()[-1]}' )
+                return None
+            best = t if best is None else min(best, t)
+        return best
+
+    print( f'\n--- Cold start time (best of {runs} runs, python startup included)\n' )
+    print( f'    {"import":<14}  {"regular":>9}  {"headless":>9}  speed up' )
+
+    for module in ('', 'logsweep2TF', 'roomEQ'):
+        t1 = cold_start(module, '0')
+        t2 = cold_start(module, '1')
+        if t1 is None or t2 is None:
+            continue
+        print( f'    {module or "(python)":<14}  {t1:>7.3f} s  {t2:>7.3f} s  '
+               f'{t1 / t2:>7.1f}x' )
+
+
+def bench_dut(exps, fs_list=(44100, 48000, 96000, 192000), dropouts=0):
+
+    print( f'\n--- do_meas() on a synthetic DUT (rt60 0.3 s, noise -90 dBFS, '
+           f'{dropouts} dropouts)' )
+    print( f'    (dev: FRD deviation 20 Hz ~ 20 KHz from the ground truth)\n' )
+    print( f'    {"fs":>6}  {"N":>10}  {"prepare":>9}  {"process":>9}  '
+           f'{"latency":>7}  {"offset":>7}  {"max dev":>9}  {"rms dev":>9}' )
+
+    fs0 = LS.fs
+
+    for fs in fs_list:
+
+        for e in exps:
+
+            LS.fs, LS.N = fs, 2**e
+            _, tp = timeit(LS.prepare_sweep)
+
+            # both the impulse response and the latency must fit within
+            # the sweep zeros tail (N/4) not to be wrapped around
+            rir = room_ir( fs, rt60=0.3, length=min( int(0.3 * fs), LS.N // 8 ) )
+            dut = SyntheticDUT( fs, rir=rir, latency=min( int(0.005 * fs), LS.N // 16 ),
+                                noise_dB=-90, dut_gain=0.5, dropouts=dropouts )
+
+            # the synthesis time is not accounted as processing
+            tcap = [0.0]
+            def playrec(*args, **kwargs):
+                res, t = timeit(dut.playrec, *args, **kwargs)
+                tcap[0] += t
+                return res
+
+            LS.playrec_func = playrec
+            _, t = timeit(LS.do_meas)
+            LS.playrec_func = None
+            t -= tcap[0]
+
+            meas = LS._meas
+            f, mag = dut.truth_FRD(meas, smooth_Noct=LS.Noct)
+            fmax = min( 20000, 0.9 * LS.f2_frac * fs / 2 )
+            maxdev, rmsdev = compare_FRD( *LS.DUT_FRD, f, mag, fmax=fmax )
+
+            print( f'    {fs:>6}  2^{e:<2} {LS.N:>7}  {tp:>7.4f} s  {t:>7.4f} s  '
+                   f'{dut.latency:>7}  {int(meas.offset):>7}  '
+                   f'{maxdev:>6.3f} dB  {rmsdev:>6.3f} dB' )
+
+            results.append( { 'bench':      'dut',
+                              'N':          LS.N,
+                              'fs':         fs,
+                              'prepare_s':  round(tp, 6),
+                              'process_s':  round(t, 6),
+                              'capture_s':  round(tcap[0], 6),
+                              'latency':    dut.latency,
+                              'offset':     float(meas.offset),
+                              'clearance':  bool(meas.TimeClearanceOK),
+                              'dropouts':   dropouts,
+                              'max_dev_dB': round(maxdev, 4),
+                              'rms_dev_dB': round(rmsdev, 4) } )
+
+    LS.fs = fs0
+
+
+def bench_progressive(exps, fs_list=(44100, 48000, 96000, 192000)):
+
+    global failed
+
+    e, fs = max(exps), max(fs_list)
+
+    print( f'\n--- Realtime progressive capture, loopback FakeStream '
+           f'(fs: {fs} Hz, N: 2^{e})\n' )
+
+    fs0, N0 = LS.fs, LS.N
+    LS.fs, LS.N = fs, 2**e
+    LS.captureMode, LS.progressiveLF = 'stream', True
+    LS.stream_factory = FakeStream
+    _, tp = timeit(LS.prepare_sweep)
+
+    _, t = timeit(LS.do_meas)
+    overruns = [ s for s in LS.stream_status if 'overrun' in s[1] ]
+
+    # the last partial result against the final FRD, within its band
+    f, mag = LS.PROGRESS_FRD
+    final = np.interp( f, *LS.DUT_FRD )
+    dev = np.max( np.abs( 20 * np.log10( mag / final ) )[f >= 50] )
+
+    print( f'    capture + process:      {t:.2f} s ({LS.N / fs:.2f} s sweep)' )
+    print( f'    first partial result:   {LS.time_to_first_result:.2f} s' )
+    print( f'    last partial band:      {int(f[-1])} Hz, '
+           f'max dev from the final FRD (50 Hz ~): {dev:.2f} dB' )
+    print( f'    ring buffer overruns:   {len(overruns)}' )
+
+    if overruns:
+        print( '(!) the progressive capture did not keep up with the sound card' )
+        failed = True
+
+    results.append( { 'bench':              'progressive',
+                      'N':                  LS.N,
+                      'fs':                 fs,
+                      'first_result_s':     round(LS.time_to_first_result, 4),
+                      'overruns':           len(overruns),
+                      'partial_max_dev_dB': round(float(dev), 4) } )
+
+    LS.captureMode, LS.progressiveLF, LS.stream_factory = 'playrec', False, None
+    LS.fs, LS.N = fs0, N0
+
+
+def bench_arena(exps, takes=5, fs=96000):
+
+    # A child interpreter runs a session, then prints its time per take and peak RSS
+    session = (
+        'import os, sys, json\n'
+        'from time import time\n'
+        'from contextlib import redirect_stdout\n'
+        'import logsweep2TF as LS\n'
+        'from synthetic_dut import SyntheticDUT\n'
+        'LS.N, LS.fs, LS.useArena = 2**{e}, {fs}, {arena}\n'
+        'dut = SyntheticDUT(LS.fs, latency=LS.N // 64)\n'
+        'LS.playrec_func = dut.playrec\n'
+        'with open(os.devnull, "w") as devnull, redirect_stdout(devnull):\n'
+        '    LS.prepare_sweep()\n'
+        '    t0 = time()\n'
+        '    for i in range({takes}):\n'
+        '        LS.do_meas()\n'
+        '    t = (time() - t0) / {takes}\n'
+        'print(json.dumps([t, LS.peak_rss_MB()]))\n' )
+
+    def run_session(e, arena):
+        code = session.format(e=e, fs=fs, arena=arena, takes=takes)
+        res  = subprocess.run( [sys.executable, '-c', code],
+                               env=dict(os.environ, DRC_HEADLESS='1'),
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+        if res.returncode:
+            print( f'(!) session failed: '
+                   f'{res.stderr.decode().strip().splitlines()[-1]}' )
+            return None, None
+        return json.loads( res.stdout.decode().strip().splitlines()[-1] )
+
+    print( f'\n--- Session of {takes} takes on a synthetic DUT (fs: {fs} Hz)\n' )
+    print( f'    {"N":>10}  {"new arrays":>21}  {"buffer arena":>21}  RSS saving' )
+
+    for e in exps:
+
+        t1, rss1 = run_session(e, False)
+        t2, rss2 = run_session(e, True)
+        if rss1 is None or rss2 is None:
+            continue
+
+        print( f'    2^{e:<2} {2**e:>7}  {t1:>7.4f} s {rss1:>8.1f} MB  '
+               f'{t2:>7.4f} s {rss2:>8.1f} MB  {rss1 - rss2:>6.1f} MB' )
+
+        results.append( { 'bench':          'arena',
+                          'N':              2**e,
+                          'fs':             fs,
+                          'takes':          takes,
+                          'take_s':         round(t1, 6),
+                          'take_s_arena':   round(t2, 6),
+                          'peak_rss_MB':        rss1,
+                          'peak_rss_MB_arena':  rss2 } )
+
+
+def code_version():
+    """ git describe of this tree, if available
+    """
+    try:
+        res = subprocess.run( ['git', 'describe', '--always', '--dirty'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL )
+        return res.stdout.decode().strip() or 'unknown'
+    except Exception:
+        return 'unknown'
+
+
+def save_results(path):
+    """ Appends the results as JSON lines, tagged with the version and platform
+    """
+    tags = { 'version':  code_version(),
+             'date':     datetime.now().isoformat(timespec='seconds'),
+             'python':   platform.python_version(),
+             'numpy':    np.__version__,
+             'machine':  platform.machine(),
+             'fft_engine':      LS.fft_engine,
+             'useFRDoperator':  LS.useFRDoperator }
+
+    with open(path, 'a') as f:
+        for res in results:
+            f.write( json.dumps( {**tags, **res} ) + '\n' )
+
+    print( f'\n(i) {len(results)} results appended to: {path}' )
+
+
+if __name__ == "__main__":
+
+    exps      = range(14, 23)
+    benches   = []
+    fs_list   = (44100, 48000, 96000, 192000)
+    dropouts  = 0
+    json_path = ''
+
+    for opc in sys.argv[1:]:
+
+        if "-h" in opc.lower():
+            print( __doc__ )
+            sys.exit()
+
+        elif opc == "-xcorr":
+            benches.append(bench_xcorr)
+
+        elif opc == "-fft":
+            benches.append(bench_fft)
+
+        elif opc == "-offset":
+            benches.append(bench_offset)
+
+        elif opc == "-frd":
+            benches.append(bench_frd)
+
+        elif opc == "-plot":
+            benches.append(bench_plot)
+
+        elif opc == "-imports":
+            benches.append(bench_imports)
+
+        elif opc == "-dut":
+            benches.append(bench_dut)
+
+        elif opc == "-arena":
+            benches.append(bench_arena)
+
+        elif opc == "-progressive":
+            benches.append(bench_progressive)
+
+        elif opc[:4] == "-fs=":
+            fs_list = [ int(x) for x in opc[4:].split(',') ]
+
+        elif opc[:10] == "-dropouts=":
+            dropouts = int(opc[10:])
+
+        elif opc[:6] == "-json=":
+            json_path = opc[6:]
+
+        elif opc[:2] == "-e":
+            emin, emax = opc[2:].split('-')
+            exps = range(int(emin), int(emax) + 1)
+
+        else:
+            print( __doc__ )
+            sys.exit()
+
+    if not benches:
+        benches = [bench_xcorr, bench_fft, bench_offset, bench_frd, bench_plot,
+                   bench_imports, bench_dut, bench_arena, bench_progressive]
+
+    for bench in benches:
+        if bench is bench_dut:
+            bench(exps, fs_list, dropouts)
+        elif bench is bench_progressive:
+            bench(exps, fs_list)
+        else:
+            bench(exps)
+
+    if json_path:
+        save_results(json_path)
+
+    if failed:
+        sys.exit(1)
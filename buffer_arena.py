@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Preallocated named buffers to be reused on every measurement take,
+    instead of allocating new N sized arrays every time.
+
+    A buffer is allocated on its first request, then the same array is
+    returned as long as its shape and dtype don't change, so the content
+    left by the previous take is overwritten by the next one.
+
+    Usage in a module:
+
+        from buffer_arena import BufferArena
+        arena = BufferArena()
+
+        z = arena.get('capture', (N, 2), 'float32')
+"""
+
+import sys
+import numpy as np
+
+try:
+    import resource
+except ImportError:         # not available on Windows
+    resource = None
+
+
+class BufferArena(object):
+
+    def __init__(self):
+
+        self._buffers       = {}
+        self.allocations    = 0         # allocated buffers since the beginning
+
+
+    def get(self, name, shape, dtype='float64', init=None):
+        """ The buffer <name>, (re)allocated if shape or dtype differ
+            from the last request.
+
+            init:   an optional function init(buffer) to fill in
+                    a newly allocated buffer.
+        """
+        shape = tuple(shape) if np.iterable(shape) else (shape,)
+        buf = self._buffers.get(name)
+
+        if buf is None or buf.shape != shape or buf.dtype != np.dtype(dtype):
+            buf = self._buffers[name] = np.empty(shape, dtype=dtype)
+            self.allocations += 1
+            if init:
+                init(buf)
+
+        return buf
+
+
+    def clear(self):
+        """ Releases all buffers
+        """
+        self._buffers.clear()
+
+
+    def nbytes(self):
+        return sum( [ buf.nbytes for buf in self._buffers.values() ] )
+
+
+    def stats(self):
+        return ( f'{len(self._buffers)} buffers, '
+                 f'{round(self.nbytes() / 2**20, 1)} MB, '
+                 f'{self.allocations} allocations' )
+
+
+def peak_rss_MB():
+    """ The process peak resident memory in MB, None if not available
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # (i) Linux reports KB, macOS reports bytes
+    if sys.platform == 'darwin':
+        return round(rss / 2**20, 1)
+    return round(rss / 2**10, 1)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    A persistent cache of the sound card facts found by logsweep2TF,
+    so that the slow probes are paid only once per configuration.
+
+    Entries are grouped in sections, e.g. 'probes' for the sound card
+    capability checks, keyed by device names, host API and fs.
+
+    The whole cache is dropped when the system device list changes,
+    e.g. a sound card was plugged or unplugged.
+
+    Usage:      device_cache.py  [ -clear ]
+
+        Prints the cache contents, or clears it.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+UHOME = os.path.expanduser("~")
+
+
+class DeviceCache(object):
+
+    def __init__(self, path=f'{UHOME}/.cache/DRC/devices.json'):
+
+        self.path   = path
+        self._lock  = threading.Lock()
+
+
+    @staticmethod
+    def key(*parts):
+        """ An entry key from its parts, e.g. (capture, playback, hostapi, fs)
+        """
+        return '|'.join( [str(x) for x in parts] )
+
+
+    @staticmethod
+    def signature(devices):
+        """ A short digest of the system device list, a list of dicts
+            as given by sounddevice.query_devices()
+        """
+        items = [ ( d.get('name'), d.get('hostapi'),
+                    d.get('max_input_channels'), d.get('max_output_channels') )
+                  for d in devices ]
+        return hashlib.sha1( json.dumps(items).encode() ).hexdigest()[:16]
+
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+
+    def _save(self, data):
+        """ (i) the file is replaced atomically, not to leave a broken one
+        """
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print( f'(device_cache) unable to save {self.path}: {e}' )
+
+
+    def check_devices(self, devices):
+        """ Drops the cache if the device list differs from the cached one.
+            returns: True if the cache was dropped
+        """
+        sig = self.signature(devices)
+        with self._lock:
+            data = self._load()
+            if data.get('signature') == sig:
+                return False
+            self._save( {'signature': sig} )
+        if data:
+            print( '(device_cache) the sound devices list has changed, '
+                   'cached probes are discarded' )
+        return True
+
+
+    def get(self, section, key):
+        """ The entry dict, or None if not cached
+        """
+        with self._lock:
+            return self._load().get(section, {}).get(key)
+
+
+    def put(self, section, key, **values):
+        """ Stores the values as the entry, dated
+        """
+        values['date'] = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            data = self._load()
+            data.setdefault(section, {})[key] = values
+            self._save(data)
+
+
+    def drop(self, section, key):
+        with self._lock:
+            data = self._load()
+            if data.get(section, {}).pop(key, None) is not None:
+                self._save(data)
+
+
+    def clear(self):
+        with self._lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+
+if __name__ == '__main__':
+
+    cache = DeviceCache()
+
+    if sys.argv[1:] and sys.argv[1] == '-clear':
+        cache.clear()
+        print( f'(device_cache) cleared {cache.path}' )
+        sys.exit()
+
+    elif sys.argv[1:]:
+        print( __doc__ )
+        sys.exit()
+
+    data = cache._load()
+    for section, entries in data.items():
+        if not isinstance(entries, dict):
+            continue
+        print( f'{section}:' )
+        for key, values in entries.items():
+            print( f'    {key}' )
+            for name, value in values.items():
+                print( f'        {name:<12} {value}' )
+    print( f'at {cache.path}' )
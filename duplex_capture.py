@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    A streaming full duplex play/rec, as an alternative to the blocking
+    sounddevice.playrec().
+
+    The stream callback writes every captured block into a preallocated
+    ring buffer, and reports the block status flags (xruns) as they happen.
+    The consumer side collects the completed blocks meanwhile the stream
+    is still running, so processing can begin before the capture ends.
+
+    FakeStream is a sounddevice.Stream look-alike that needs no hardware,
+    it loops back the played signal to the input.
+
+    Usage:      duplex_capture.py
+
+        Runs a demo capture through by a FakeStream, exits 1 if the capture
+        does not match the played signal or the expected status flags.
+"""
+
+import sys
+import queue
+import threading
+from time import sleep
+import numpy as np
+
+
+class RingBuffer(object):
+
+    def __init__(self, frames, channels, dtype='float32'):
+
+        self.data       = np.zeros( (frames, channels), dtype=dtype )
+        self.size       = frames
+        self.written    = 0         # total frames written since the beginning
+
+
+    def write(self, block):
+        """ appends a (frames, channels) block
+        """
+        n = len(block)
+        i = self.written % self.size
+        k = min(n, self.size - i)
+        self.data[i : i+k] = block[:k]
+        if k < n:
+            self.data[ : n-k] = block[k:]
+        self.written += n
+
+
+    def read(self, start, out):
+        """ copies len(out) frames from the absolute frame position <start>
+        """
+        n = len(out)
+        i = start % self.size
+        k = min(n, self.size - i)
+        out[:k] = self.data[i : i+k]
+        if k < n:
+            out[k:] = self.data[ : n-k]
+
+
+class DuplexCapture(object):
+    """ playdata:       the (N, channels) array to be played
+        stream_factory: a sounddevice.Stream alike class or function,
+                        by default sounddevice.Stream
+    """
+
+    def __init__(self, playdata, fs, channels=2, blocksize=1024,
+                       ring_seconds=2.0, stream_factory=None, device=None):
+
+        self.play       = np.asarray(playdata, dtype='float32')
+        self.N          = len(self.play)
+        self.fs         = fs
+        self.channels   = channels
+        self.blocksize  = blocksize
+        self.device     = device
+        self.ring       = RingBuffer( max( int(ring_seconds * fs), 4 * blocksize ),
+                                      channels )
+
+        if stream_factory is None:
+            import sounddevice as sd
+            stream_factory = sd.Stream
+        self.stream_factory = stream_factory
+
+        # A list of (frame_position, flags_string) for blocks having status flags
+        self.status_log = []
+
+        self._played    = 0
+        self._blocks    = queue.Queue()
+        self._abort     = threading.Event()
+        self.aborted    = False
+        self.captured   = 0         # frames collected by run()
+
+
+    def _callback(self, indata, outdata, frames, time, status):
+        """ (i) This runs in the audio thread, keep it light.
+        """
+        i = self._played
+        chunk = self.play[i : i+frames]
+        outdata[ : len(chunk)] = chunk
+        outdata[len(chunk) : ]  = 0
+        self._played += frames
+
+        self.ring.write(indata)
+        self._blocks.put( (i, frames, str(status) if status else '') )
+
+
+    def abort(self):
+        """ Stops a running capture, e.g. from another thread.
+            run() will return the frames captured so far.
+        """
+        self._abort.set()
+
+
+    def run(self, on_block=None, timeout=5.0, out=None):
+        """ Plays and records, returns the captured (N, channels) array.
+
+            on_block:   optional function on_block(z, n) called every time
+                        a new block is completed, where z[:n] are the
+                        frames already captured.
+            out:        an optional (N, channels) float32 array to be reused
+                        for the capture, instead of a new one.
+            timeout:    seconds without any block, e.g. the device stopped,
+                        then the capture ends as if aborted.
+        """
+        if out is None:
+            z = np.zeros( (self.N, self.channels), dtype='float32' )
+        else:
+            z = out
+            z[:] = 0.0
+
+        kwargs = dict( samplerate=self.fs, blocksize=self.blocksize,
+                       channels=self.channels, dtype='float32',
+                       callback=self._callback )
+        if self.device is not None:
+            kwargs['device'] = self.device
+
+        pos = 0
+        with self.stream_factory(**kwargs):
+
+            while pos < self.N:
+
+                if self._abort.is_set():
+                    self.aborted = True
+                    print( f'(duplex_capture) aborted at {round(pos / self.fs, 2)} s' )
+                    break
+
+                try:
+                    start, frames, flags = self._blocks.get(timeout=timeout)
+                except queue.Empty:
+                    self.aborted = True
+                    self.status_log.append( (pos, 'timeout') )
+                    print( f'(duplex_capture) (!) no blocks from the sound card '
+                           f'for {timeout} s, capture stopped at '
+                           f'{round(pos / self.fs, 2)} s' )
+                    break
+
+                if flags:
+                    self.status_log.append( (start, flags) )
+                    print( f'(duplex_capture) {flags} at block '
+                           f'{start // self.blocksize} ({round(start / self.fs, 2)} s)' )
+
+                # the ring was overwritten before we could read it
+                if self.ring.written - start > self.ring.size:
+                    self.status_log.append( (start, 'ring buffer overrun') )
+                    print( f'(duplex_capture) ring buffer overrun at '
+                           f'{round(start / self.fs, 2)} s' )
+
+                n = min(frames, self.N - pos)
+                self.ring.read(start, z[pos : pos+n])
+                pos += n
+                self.captured = pos
+
+                if on_block:
+                    on_block(z, pos)
+
+        return z
+
+
+class FakeFlags(object):
+    """ A sounddevice.CallbackFlags look-alike
+    """
+
+    def __init__(self, input_overflow=False, output_underflow=False):
+        self.input_underflow    = False
+        self.input_overflow     = input_overflow
+        self.output_underflow   = output_underflow
+        self.output_overflow    = False
+        self.priming_output     = False
+
+
+    def __bool__(self):
+        return self.input_overflow or self.output_underflow
+
+
+    def __str__(self):
+        flags = []
+        if self.input_overflow:
+            flags.append('input overflow')
+        if self.output_underflow:
+            flags.append('output underflow')
+        return ', '.join(flags)
+
+
+class FakeStream(object):
+    """ A sounddevice.Stream look-alike for testing without hardware.
+
+        The played signal is looped back to the input, delayed by <latency>
+        frames and scaled by <gain> (a scalar or a per channel tuple).
+        As for a real duplex stream, latency cannot be less than blocksize.
+
+        channels:       a number, or (inputs, outputs) as sounddevice.Stream,
+                        output k being looped back to input k.
+
+        xrun_blocks:    block indexes that will report an input overflow,
+                        these blocks will capture silence (lost samples).
+        speed:          block pacing relative to a real sound card,
+                        e.g. 1.0 is realtime, 10.0 runs ten times faster.
+    """
+
+    def __init__(self, samplerate=48000, blocksize=1024, channels=2,
+                       dtype='float32', callback=None, latency=0, gain=1.0,
+                       xrun_blocks=(), speed=1.0, **kwargs):
+
+        self.samplerate = samplerate
+        self.blocksize  = blocksize
+        self.channels   = channels
+        if isinstance(channels, (tuple, list)):
+            self.ins, self.outs = channels
+        else:
+            self.ins = self.outs = channels
+        self.dtype      = dtype
+        self.callback   = callback
+        self.latency    = max(latency, blocksize)
+        self.gain       = np.asarray(gain, dtype=dtype)
+        self.xrun_blocks= xrun_blocks
+        self.speed      = speed
+        self.active     = False
+        self._thread    = None
+
+
+    def _run(self):
+
+        pending = np.zeros( (self.latency, self.ins), dtype=self.dtype )
+        block   = 0
+        k       = min(self.ins, self.outs)
+
+        while self.active:
+
+            outdata = np.zeros( (self.blocksize, self.outs), dtype=self.dtype )
+            indata  = np.zeros( (self.blocksize, self.ins),  dtype=self.dtype )
+
+            n = min(self.blocksize, len(pending))
+            indata[:n] = pending[:n]
+
+            xrun = block in self.xrun_blocks
+            if xrun:
+                indata[:] = 0
+
+            self.callback( indata, outdata, self.blocksize, None,
+                           FakeFlags(input_overflow=xrun) )
+
+            loop = np.zeros( (self.blocksize, self.ins), dtype=self.dtype )
+            loop[:, :k] = outdata[:, :k]
+            pending = np.concatenate( (pending[n:], loop * self.gain) )
+            block += 1
+
+            sleep( self.blocksize / self.samplerate / self.speed )
+
+
+    def start(self):
+        self.active  = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self.active = False
+        if self._thread:
+            self._thread.join()
+
+
+    def close(self):
+        self.stop()
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1:]:
+        print( __doc__ )
+        sys.exit()
+
+    fs      = 48000
+    latency = 1500
+    x       = np.random.uniform(-.5, .5, size=(fs, 2)).astype('float32')
+    x[-latency:] = 0
+
+    def fake_stream(**kwargs):
+        return FakeStream(latency=latency, xrun_blocks=(10,), speed=10, **kwargs)
+
+    def show_progress(z, n):
+        print( f'    captured {n} / {len(z)} frames', end='\r' )
+        sys.stdout.flush()
+
+    print( f'--- Fake loopback capture of {len(x)} frames, latency {latency}' )
+    cap = DuplexCapture(x, fs, stream_factory=fake_stream)
+    z = cap.run(on_block=show_progress)
+    print()
+
+    blk = 10 * cap.blocksize
+    # (i) the xrun block has captured silence
+    ok = np.array_equal( z[latency : blk], x[ : blk - latency] ) and \
+         np.array_equal( z[blk + cap.blocksize : ],
+                         x[blk + cap.blocksize - latency : -latency] )
+    log_ok = cap.status_log == [ (blk, 'input overflow') ]
+    print( f'    loopback matches the played signal: {ok}' )
+    print( f'    status log: {cap.status_log} ({"as" if log_ok else "NOT as"} expected)' )
+
+    if not (ok and log_ok):
+        sys.exit(1)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    A precomputed sparse operator that maps a linear bins magnitude spectrum
+    straight to the smoothed logspaced FRD, the same as doing
+    tools.logspaced_semispectrum() then smoothSpectrum().
+
+    Both stages are linear on the magnitude, so they are composed into
+    a single (FRDpoints x N/2) sparse matrix:
+
+        R   the linear interpolation from the N/2 bins to the logspaced
+            points, two nonzeros per row.
+
+        S   the smoothing over the logspaced points, probed once column by
+            column from smoothSpectrum(), then kept in the sweep cache.
+
+    Only the bins next to the logspaced points are involved, so the operator
+    takes just these ones from the spectrum, about 2 x FRDpoints instead of N/2.
+
+    The composed operator is checked once against the reference functions,
+    if they differ (e.g. a non linear smoothing) the operator is discarded
+    and the reference functions are used instead.
+"""
+
+import os
+import sys
+import threading
+from time import time
+import numpy as np
+
+import lazyimport
+sparse = lazyimport.load('scipy.sparse')
+
+UHOME = os.path.expanduser("~")
+sys.path.append(UHOME + "/audiotools")
+from smoothSpectrum import smoothSpectrum as smooth
+import tools
+
+
+# Built operators as {(N, fs, FRDpoints, Noct): FRDOperator or None}
+_operators = {}
+_lock = threading.Lock()
+
+
+def reference_FRD(f, mag, FRDpoints, Noct):
+    """ The logspaced FRD by the audiotools functions, mag can be 1-D only
+    """
+    f, mag = tools.logspaced_semispectrum(f, mag, FRDpoints)
+    if Noct:
+        mag = smooth(f, mag, Noct=Noct)
+    return f, mag
+
+
+def get_operator(N, fs, FRDpoints, Noct, cache=None):
+    """ Returns the FRDOperator for the given parameters, built on the first
+        call, or None if it is not equivalent to the reference functions.
+
+        cache:  an optional SweepCache to keep the probed smoothing matrix
+    """
+    key = (N, fs, FRDpoints, Noct)
+
+    with _lock:
+        if key not in _operators:
+            op = FRDOperator(N, fs, FRDpoints, Noct, cache)
+            _operators[key] = op if op.ok else None
+
+    return _operators[key]
+
+
+class FRDOperator(object):
+
+    def __init__(self, N, fs, FRDpoints, Noct, cache=None):
+
+        t0 = time()
+
+        # The linear freqs as used by logsweep2TF.fft_to_FRD()
+        self.flin = np.linspace(0, int(fs/2), int(N/2))
+
+        # The logspaced freqs given by the reference function
+        self.f, _ = tools.logspaced_semispectrum(self.flin, self.flin, FRDpoints)
+
+        R = self._interpolation_matrix()
+
+        if Noct:
+            S = self._smoothing_matrix(N, fs, FRDpoints, Noct, cache)
+            A = (S @ R).tocsr()
+        else:
+            A = R
+
+        # (i) Only the bins next to the logspaced points are involved,
+        #     so the operator is reduced to these columns.
+        self.bins = np.unique(A.indices)
+        self.A    = A[:, self.bins]
+
+        self.build_time = time() - t0
+
+        # Checking against the reference on a random positive spectrum
+        mag = np.random.default_rng(0).uniform(0.1, 1.0, len(self.flin))
+        _, ref = reference_FRD(self.flin, mag, FRDpoints, Noct)
+        _, mymag = self.apply(mag)
+        dev = np.max( np.abs(mymag - ref) ) / np.max( np.abs(ref) )
+        self.ok = dev < 1e-6
+
+        if not self.ok:
+            print( f'(frd_operator) not equivalent to the reference functions '
+                   f'(deviation {dev:.1e}), will not be used' )
+
+
+    def _interpolation_matrix(self):
+        """ The sparse linear interpolation, as numpy.interp does
+        """
+        flin, f = self.flin, self.f
+        n, P = len(flin), len(f)
+
+        j = np.clip( np.searchsorted(flin, f, side='right') - 1, 0, n - 2 )
+        w = np.clip( (f - flin[j]) / (flin[j+1] - flin[j]), 0.0, 1.0 )
+
+        rows = np.repeat( np.arange(P), 2 )
+        cols = np.column_stack( (j, j + 1) ).ravel()
+        vals = np.column_stack( (1 - w, w) ).ravel()
+
+        return sparse.csr_matrix( (vals, (rows, cols)), shape=(P, n) )
+
+
+    def _smoothing_matrix(self, N, fs, FRDpoints, Noct, cache):
+        """ Probes the smoothing of every unit vector over the logspaced freqs,
+            negligible weights are dropped to keep it sparse.
+            (i) the logspaced freqs depend on the N/2 bins grid, so N is keyed.
+        """
+        key = ('FRDsmoothing', N, fs, FRDpoints, Noct)
+
+        if cache:
+            cached = cache.get(key)
+            if cached:
+                return sparse.csr_matrix( ( np.array(cached['data']),
+                                            np.array(cached['indices']),
+                                            np.array(cached['indptr']) ),
+                                          shape=(FRDpoints, FRDpoints) )
+
+        print( f'(frd_operator) probing the 1/{Noct} oct smoothing '
+               f'over {FRDpoints} points (only once) ...' )
+
+        P = len(self.f)
+        S = np.zeros( (P, P) )
+        e = np.zeros(P)
+        for k in range(P):
+            e[k] = 1.0
+            S[:, k] = smooth(self.f, e, Noct=Noct)
+            e[k] = 0.0
+
+        S[ np.abs(S) < 1e-12 * np.max(np.abs(S)) ] = 0.0
+        S = sparse.csr_matrix(S)
+
+        if cache:
+            cache.put( key, data=S.data, indices=S.indices, indptr=S.indptr )
+
+        return S
+
+
+    def apply(self, spectrum):
+        """ spectrum:   a complex or magnitude spectrum, at least N/2 bins.
+
+            returns: f, the smoothed logspaced magnitude
+        """
+        return self.f, self.A @ np.abs( spectrum[self.bins] )
+
+
+    def apply_batch(self, spectra):
+        """ Same as apply() for several spectra in a single sparse product.
+
+            returns: f, a (FRDpoints, k) array of magnitudes
+        """
+        mags = np.column_stack( [ np.abs( X[self.bins] ) for X in spectra ] )
+        return self.f, self.A @ mags
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Headless fast start support.
+
+    When the environment variable DRC_HEADLESS is set (e.g. DRC_HEADLESS=1),
+    the heavy modules (matplotlib, sounddevice, ...) are not imported until
+    they are first used, and matplotlib will use the non interactive 'Agg'
+    backend, so no display is needed.
+
+    Otherwise the modules are imported as usual.
+
+    Usage in a module:
+
+        import lazyimport
+        plt = lazyimport.load('matplotlib.pyplot')
+        sd  = lazyimport.load('sounddevice')
+"""
+
+import os
+import importlib
+
+HEADLESS = os.environ.get('DRC_HEADLESS', '').lower() not in ('', '0', 'no', 'false')
+
+
+def use_agg():
+    """ Non interactive matplotlib backend, it must be set before pyplot
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+class LazyModule(object):
+    """ A module proxy that imports the module on its first attribute access.
+
+        before:     an optional function to run just before the import
+    """
+
+    def __init__(self, name, before=None):
+        self._name      = name
+        self._before    = before
+        self._module    = None
+
+
+    def _load(self):
+        if self._module is None:
+            if self._before:
+                self._before()
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded yet'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def load(name, headless=None):
+    """ Returns the module, or a LazyModule proxy if running headless
+    """
+    if headless is None:
+        headless = HEADLESS
+
+    if not headless:
+        return importlib.import_module(name)
+
+    before = None
+    if name.split('.')[0] == 'matplotlib':
+        before = use_agg
+
+    return LazyModule(name, before)
@@ -39,6 +39,9 @@
                    |        Optional reference loop for
       in  R ---<---         time clearance checkup.
 
+    A multichannel interface can capture several mics at once (-mics=M):
+    the mics on inputs 1 ... M, then the REF loop on input M+1.
+
 
     Usage:      python3 logsweep2TF.py  [options ... ...]
 
@@ -49,16 +52,74 @@
     -dev=cap,pbk,fs     Sund devices and fs to use.
                         Use -h to list the available ones.
 
+    -reprobe            Probes the sound card again, even if its settings
+                        were already proven OK (see device_cache.py).
+
     -eXX                Power of 2 that determines the total lenght N of the
                         test log-sweep. Default 2^18 = 256K samples ~ 4 sec
 
 
+    -avg=K              Plays K back-to-back sweeps in a single capture,
+                        then averages the K measured TFs.
+
+    -mics=M             Captures M mics at once, a TF per mic from the
+                        same sweep (REF loop on input M+1).
+
+    -savewav=path       Saves the raw capture to path.wav, and its parameters
+                        to path.json, in order to be reprocessed later.
+
     -noclearance        Ommit time clearance validation.
 
+    -fullxcorr          Time clearance by the whole length crosscorrelation
+                        (slow). Default is a lag limited FFT estimation.
+
+    -fullfft            Whole complex float64 FFTs as the original code.
+                        Default is real FFTs, DUT and REF in one transform.
+
+    -fft32              Real FFTs in single precision float32.
+
+    -stream             Capture through by a callback stream, reporting
+                        xruns as they happen. Default is a blocking playrec.
+
+    -progressive        Partial LF results while capturing (implies -stream)
+
+    -nocache            Don't use the on disk cache for the prepared sweep.
+
+    -nolatcache         Don't measure nor cache the play/rec latency.
+
+    -nofrdop            FRD log reduction and smoothing by the audiotools
+                        functions, instead of the precomputed sparse operator.
+
     -nosmooth           Don't smooth freq response. Default smooth at 1/24 oct
 
     -auxplots           plot aux graphs (work in progress)
 
+    -profile=file       Appends per stage timing and memory as JSON lines,
+                        same as the environment variable DRC_PROFILE=file
+                        (see profiler.py)
+
+    -fullplot           plot every waveform sample, instead of a min/max
+                        envelope per pixel (slow for long sweeps)
+
+
+    Headless:
+
+        With the environment variable DRC_HEADLESS=1 the plotting and audio
+        modules are only imported when used, e.g. for batch reprocessing.
+
+    As a module:
+
+        The module level functions (prepare_sweep, do_meas, ...) work on the
+        module parameters and globals, e.g. LS.N, LS.DUT_FRD.
+
+        SweepConfig and Measurement objects own their parameters and buffers,
+        so several measurements can be processed concurrently:
+
+            meas = Measurement( SweepConfig(N=2**16) )
+            meas.prepare_sweep()
+            meas.process_capture(z)
+            f, mag = meas.DUT_FRD
+
 """
 #-------------------------------------------------------------------------------
 #-------------------------------- CREDITS: -------------------------------------
@@ -82,47 +143,132 @@
 #---------------------------- IMPORTING MODULES: -------------------------
 import os
 import sys
+import json
+import inspect
+import threading
 from time import time
 
+# (i) If running headless (see lazyimport.py), matplotlib, sounddevice and
+#     scipy.signal are imported later only when needed.
+import lazyimport
+
 # https://matplotlib.org/faq/howto_faq.html#working-with-threads
-import matplotlib
+matplotlib = lazyimport.load('matplotlib')
 # Later we will be able to call matplotlib.use('Agg') to replace the regular
 # display backend (e.g. 'Mac OSX') by the dummy one 'Agg' in order to avoid
 # incompatibility when threading this module, e.g. when using a Tcl/Tk GUI.
-import matplotlib.pyplot as plt
+plt = lazyimport.load('matplotlib.pyplot')
 
-from matplotlib.ticker import EngFormatter
+ticker = lazyimport.load('matplotlib.ticker')
 from numpy import *
-from scipy.signal import correlate as signal_correlate # to differentiate it from numpy
+sp_signal = lazyimport.load('scipy.signal') # to differentiate it from numpy
+from scipy import fft as sfft   # multithreaded FFTs, to differentiate it from numpy
+from scipy.fft import next_fast_len
+# numpy >= 2.0 FFTs can write into a given array (used if useArena)
+_rfft_out = 'out' in inspect.signature(fft.rfft).parameters
+wavfile = lazyimport.load('scipy.io.wavfile')
 
 # scipy.signal.correlate shows a FutureWarning, we do inhibit it:
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 # https://python-sounddevice.readthedocs.io
-import sounddevice as sd
+sd = lazyimport.load('sounddevice')
 
 UHOME = os.path.expanduser("~")
 sys.path.append(UHOME + "/audiotools")
 from smoothSpectrum import smoothSpectrum as smooth
 import tools
 
+from sweep_cache import SweepCache
+from buffer_arena import BufferArena, peak_rss_MB
+from device_cache import DeviceCache
+import profiler
+import frd_operator
+from duplex_capture import DuplexCapture
+
 #-------------------------------------------------------------------------------
 #----------------------------- DEFAULT OPTIONS: --------------------------------
 #-------------------------------------------------------------------------------
 select_card         = False
 selected_card       = ''
 checkClearence      = True
+xcorr_method        = 'fft'     # 'fft': lag limited FFT delay estimator,
+                                # 'full': whole length scipy.signal.correlate
+subsampleOffset     = False     # 'fft' estimator refines a fractional offset
 
 printInfo           = True
 
 do_plot             = True      # recorded, time clearance, freq response plots
 aux_plot            = False     # currently only for the prepared sweep plot
+plotEnvelope        = True      # waveforms reduced to a min/max per pixel
+
+fft_engine          = 'rfft'    # 'fft':  whole complex FFTs float64 (original),
+                                # 'rfft': real FFTs, DUT and REF in one transform
+fft_single          = False     # 'rfft' engine in float32 / complex64
+fft_workers         = -1        # FFT threads, -1 means all CPUs
+
+captureMode         = 'playrec' # 'playrec': blocking sd.playrec,
+                                # 'stream':  callback sd.Stream into a ring buffer
+streamBlocksize     = 1024      # 'stream' capture block size
+stream_factory      = None      # 'stream' capture sd.Stream alike, e.g.
+                                # duplex_capture.FakeStream for testing
+playrec_func        = None      # 'playrec' capture sd.playrec alike, e.g.
+                                # synthetic_dut.SyntheticDUT().playrec
+session_stream      = None      # a session_stream.SessionStream kept open by
+                                # the caller, captures through it instead of
+                                # opening a new stream per take
+
+capturePath         = ''        # if given, path.wav and path.json raw capture
+numSweeps           = 1         # back-to-back sweeps to be averaged
+interleaved         = 1         # output channels playing staggered sweeps in a
+                                # single capture, their responses are separated
+                                # in time (numSweeps does not apply)
+interleaveGap       = 0         # samples between staggered sweeps, 0 means N/4
+numMics             = 1         # mics captured at once on inputs 1..numMics,
+                                # then REF on the next input (see DUT_TFS)
+
+progressiveLF       = False     # LF partial results while capturing ('stream')
+progressEvery       = 8         # blocks between partial results
+progressFmax        = 1000      # Hz, band limit for partial results
+progress_callback   = None      # function(f, mag, fmax) to receive them
+
+useSweepCache       = True      # on disk cache for the prepared sweep arrays
+useFRDoperator      = True      # precomputed sparse log resampling + smoothing
+useDeviceCache      = True      # known good sound card settings are not probed again
+useLatencyCache     = True      # the REF loopback latency is measured once per
+                                # device, fs and blocksize, then applied to the
+                                # takes without checkClearence (see device_cache.py)
+device_cache        = DeviceCache()
+useArena            = False     # reuse preallocated per take buffers ('rfft'),
+                                # results arrays are overwritten by the next take
+sweep_cache         = SweepCache(max_MB=1024)
+
+# Per sweep SNR when averaging several sweeps
+SWEEPS_SNR = []
+
+# Captured blocks with status flags, as [(frame_position, flags), ...]
+stream_status = []
+
+# Seconds the last capture took beyond the played signal length, i.e. the
+# stream setup, start and teardown
+captureOverhead = None
+
+# The running 'stream' capture, so that it can be aborted from another thread
+_capture = None
+measAborted = False
+
+# Partial LF results: the last (freq, mag) and the time to the first one
+PROGRESS_FRD = None
+time_to_first_result = None
 
 #-------------------------------------------------------------------------------
 #----------------------------- DEFAULT PARAMETERS: -----------------------------
 #-------------------------------------------------------------------------------
 sig_frac    = 0.5               # Fraction of full scale applied to play the sweep.
+f_start     = 5.0               # Sweep start freq, beginning of turnon half-Hann
+f1          = 10.0              # End of turnon half-Hann
+f2_frac     = 0.91              # Beginning of turnoff half-Hann, relative to fs/2
 fs          = 48000             # Must ensure that sound driver accepts.
 N           = 2**18             # Lenght of the total sequence, make this
                                 # larger if there is insufficient time clearance
@@ -160,7 +306,7 @@ S_adc = 1.0
 
 
 
-def choose_soundcard():
+def choose_soundcard(force=False):
 
     result = False
 
@@ -171,13 +317,35 @@ def choose_soundcard():
         print()
         print( "    Select capture  device: ", end='' ); i = int(input())
         print( "    Select playback device: ", end='' ); o = int(input())
-        result = test_soundcard(i,o)
+        result = test_soundcard(i, o, force=force)
         tries += 1
 
     return result
 
 
-def test_soundcard(i="default",o="default", fs=fs, ch=2):
+def soundcard_key(i, o, fs, ch=2):
+    """ The device cache key for a capture and playback devices pair,
+        by their names rather than their indexes.
+    """
+    cap = sd.query_devices(i, kind="input" )
+    pbk = sd.query_devices(o, kind="output")
+    hostapi = sd.query_hostapis(cap['hostapi'])['name']
+    return DeviceCache.key(cap['name'], pbk['name'], hostapi, int(fs), ch)
+
+
+def test_soundcard(i="default",o="default", fs=None, ch=2, force=False):
+    """ Sets the given devices, then checks their settings and tries to play
+        and record a second of silence.
+
+        If useDeviceCache, a configuration already proven OK is not probed
+        again, unless <force> or the system device list has changed.
+
+        fs:     by default the current module fs
+
+        returns: 'ok', or the exception found
+    """
+    if fs is None:
+        fs = globals()['fs']
 
     dummy1sec = zeros(int(fs))
 
@@ -191,12 +359,26 @@ def test_soundcard(i="default",o="default", fs=fs, ch=2):
         print( f'(!) Error accesing devices [{i},{o}]: {e}' )
         return e
 
+    key = None
+    if useDeviceCache:
+        try:
+            key = soundcard_key(i, o, fs, ch)
+            device_cache.check_devices( sd.query_devices() )
+            if not force and device_cache.get('probes', key):
+                print( 'Sound device settings are supported (cached probe)' )
+                return 'ok'
+        except Exception as e:
+            print( f'(device_cache) not available: {e}' )
+            key = None
+
     try:
         chk_rec = sd.check_input_settings (i, channels=ch, samplerate=float(fs))
         chk_pb  = sd.check_output_settings(o, channels=ch, samplerate=float(fs))
         print( f'Sound card parameters OK' )
     except Exception as e:
         print( f'(!) Sound card [{i},{o}] ERROR: {e}' )
+        if key:
+            device_cache.drop('probes', key)
         return e
 
     try:
@@ -204,8 +386,17 @@ def test_soundcard(i="default",o="default", fs=fs, ch=2):
         print( 'Sound device settings are supported' )
     except Exception as e:
         print( f'(!) FAILED to playback and recording on selected device: {e}' )
+        if key:
+            device_cache.drop('probes', key)
         return e
 
+    if key:
+        cap = sd.query_devices(i, kind="input" )
+        pbk = sd.query_devices(o, kind="output")
+        device_cache.put( 'probes', key,
+                          in_latency  = cap.get('default_low_input_latency'),
+                          out_latency = pbk.get('default_low_output_latency') )
+
     return 'ok'
 
 
@@ -230,6 +421,38 @@ def do_print_info():
     return
 
 
+def envelope(x, y, ax=None, points=0):
+    """ Min/max envelope decimation of a long waveform to be plotted.
+
+        The waveform is split into <points> bins, usually one per horizontal
+        pixel of the axes <ax>, then each bin is reduced to its min and max
+        values, so peaks and dropouts are preserved.
+
+        returns: x, y   having 2 * points values, or the given ones if
+                        they are short enough or not plotEnvelope.
+    """
+    if not points and ax is not None:
+        points = int( ax.get_window_extent().width )
+
+    n = len(y)
+    if not plotEnvelope or not points or n <= 2 * points:
+        return x, y
+
+    k = n // points                         # samples per bin
+    m = k * points
+    bins = y[:m].reshape(points, k)
+    ymin = bins.min(axis=1)
+    ymax = bins.max(axis=1)
+
+    # the remaining samples go to the last bin
+    if m < n:
+        ymin[-1] = minimum( ymin[-1], y[m:].min() )
+        ymax[-1] = maximum( ymax[-1], y[m:].max() )
+
+    return repeat(x[:m:k], 2), column_stack( (ymin, ymax) ).ravel()
+
+
+@profiler.profiled('plot_FRDs')
 def plot_FRDs( freq, curves, title='Freq. response', png_fname='', figure=100 ):
     """ Plots multi FRD curves
         freq:       The freq vector
@@ -278,6 +501,7 @@ def plot_FRDs( freq, curves, title='Freq. response', png_fname='', figure=100 ):
         plt.savefig(png_fname)
 
 
+@profiler.profiled('plot_system_response')
 def plot_system_response(png_folder=f'{UHOME}'):
     """ plot layout:
 
@@ -302,14 +526,16 @@ def plot_system_response(png_folder=f'{UHOME}'):
     # Safe amplitudes
     for axtmp in (axDUT, axREF):
         for a in (.5, -.5):
-            axtmp.plot(vTimes, full(vTimes.shape,  a), label='',
+            axtmp.plot(vTimes[[0, -1]], [a, a], label='',
                        linestyle='dashed', linewidth=0.5, color='purple')
 
+    # (i) Long waveforms are reduced to their min/max envelope per pixel
+
     # DUT waveform
-    axDUT.plot(vTimes, dut, 'blue', linewidth=0.5, label='DUT')
+    axDUT.plot(*envelope(vTimes, dut, axDUT), 'blue', linewidth=0.5, label='DUT')
 
     # REF waveform
-    axREF.plot(vTimes, ref, 'grey', linewidth=0.5, label='REF')
+    axREF.plot(*envelope(vTimes, ref, axREF), 'grey', linewidth=0.5, label='REF')
 
     axDUT.grid()
     axREF.set_ylim(-1.5, 3.5)               # Sliding the dut and ref Y scales
@@ -320,14 +546,15 @@ def plot_system_response(png_folder=f'{UHOME}'):
     axDUT.set_title('Recorded sweeps')
 
     #--- X cross correlation (Time Clearance)
-    t  = vTimes
-    t -= N/2.0 / fs                         # Centering the X ideal peak at 0 ms
+    # (i) X can be the whole length crosscorrelation or the lag limited one,
+    #     anyway the X ideal peak is centered at 0 ms.
+    t  = (arange(len(X)) - len(X) // 2) / float(fs)
     maxX = max(abs(X))
     ylim = 1000                             # Expected X >~ 1000
     if maxX > ylim:
         ylim += ylim * (maxX // ylim)
     axTCL.set_ylim(-ylim, +ylim)
-    axTCL.plot(t, X, color="black", label='xcorr pb/rec')
+    axTCL.plot(*envelope(t, X, axTCL), color="black", label='xcorr pb/rec')
     axTCL.grid()
     axTCL.legend()
     axTCL.set_xlabel('time (s)')
@@ -371,8 +598,8 @@ def plot_system_response(png_folder=f'{UHOME}'):
     axFRE.set_xlabel('frequency [Hz]')
     axFRE.set_ylabel('dB')
     # nice engineering formatting "1 K"
-    axFRE.xaxis.set_major_formatter( EngFormatter() )
-    axFRE.xaxis.set_minor_formatter( EngFormatter() )
+    axFRE.xaxis.set_major_formatter( ticker.EngFormatter() )
+    axFRE.xaxis.set_minor_formatter( ticker.EngFormatter() )
     # rotate_labels for both major and minor xticks
     for label in axFRE.get_xticklabels(which='both'):
         label.set_rotation(70)
@@ -385,6 +612,7 @@ def plot_system_response(png_folder=f'{UHOME}'):
     print( "--- Plotting sweep system response graphs..." )
 
 
+@profiler.profiled('plot_aux_graphs')
 def plot_aux_graphs(png_folder=f'{UHOME}'):
     """ Aux graphs (currently only for the prepared sweep plot)
     """
@@ -394,9 +622,11 @@ def plot_aux_graphs(png_folder=f'{UHOME}'):
 
     # ---- Sweep
     fig, axSWE = plt.subplots(figsize=(4.5, 2.6))  # in inches
-    axSWE.plot(vTimes, sweep, '--', color='black', linewidth=2,  label='raw sweep')
+    axSWE.plot(*envelope(vTimes, sweep, axSWE), '--', color='black', linewidth=2,
+               label='raw sweep')
     axSWE.grid()
-    axSWE.plot(vTimes, tapsweep, color='blue', linewidth=1, label='tapered sweep')
+    axSWE.plot(*envelope(vTimes, tapsweep, axSWE), color='blue', linewidth=1,
+               label='tapered sweep')
     axSWE.set_ylim(-2.5, 2.5)
     axSWE.set_xlabel('time[s]')
     axSWE.legend()
@@ -405,143 +635,1372 @@ def plot_aux_graphs(png_folder=f'{UHOME}'):
     print( "--- Plotting aux graphs..." )
 
 
-def fft_to_FRD(wholeFFT, smooth_Noct=0):
+#-------------------------------------------------------------------------------
+#-------------------------- SWEEP CONFIG & MEASUREMENT -------------------------
+#-------------------------------------------------------------------------------
+class SweepConfig(object):
+    """ The sweep and analysis parameters of a Measurement.
+
+        Any parameter not given is taken from the current module value,
+        e.g. SweepConfig(N=2**16) is the module configuration but N.
+    """
+
+    fields = ( 'N', 'fs', 'sig_frac', 'f_start', 'f1', 'f2_frac',
+               'S_dac', 'S_adc', 'system_type', 'Po', 'power_amp_gain',
+               'mic_cal', 'mic_preamp_gain', 'Vw', 'electronic_gain',
+               'numSweeps', 'interleaved', 'interleaveGap', 'numMics',
+               'clipWarning', 'checkClearence', 'xcorr_method',
+               'subsampleOffset', 'fft_engine', 'fft_single', 'fft_workers',
+               'FRDpoints', 'Noct', 'useSweepCache', 'useFRDoperator',
+               'useArena' )
+
+    # The parameters needed to reprocess a capture without the sound card
+    capture_fields = ( 'N', 'fs', 'numSweeps', 'interleaved', 'interleaveGap',
+                       'numMics', 'sig_frac', 'f_start', 'f1',
+                       'f2_frac', 'S_dac', 'S_adc', 'system_type',
+                       'power_amp_gain', 'mic_cal', 'mic_preamp_gain', 'Vw',
+                       'electronic_gain' )
+
+
+    def __init__(self, **kwargs):
+
+        module = globals()
+        for name in self.fields:
+            setattr( self, name, kwargs.pop(name, module[name]) )
+
+        if kwargs:
+            raise TypeError( f'unknown sweep parameters: {", ".join(kwargs)}' )
+
+
+    def key(self):
+        """ The parameters that fully determine the prepared sweep arrays,
+            used as the sweep cache key.
+        """
+        return ( self.N, self.fs, self.f_start, self.f1,
+                 round(self.f2_frac * self.fs / 2, 3), self.sig_frac, self.S_dac )
+
+
+    def calibration_factor(self):
+        """ SPL calibration factor CF as per system type, None if unknown type
+        """
+        if self.system_type == 'acoustic':
+            return self.Vw / ( self.power_amp_gain * self.mic_cal *
+                               self.mic_preamp_gain * self.Po )
+        elif self.system_type == 'electronic':
+            return 1 / self.electronic_gain
+        elif self.system_type == 'level-dependent':
+            return 1 / ( self.sig_frac * self.mic_cal *
+                         self.mic_preamp_gain * self.Po )
+        return None
+
+
+    def capture_params(self):
+        return { name: getattr(self, name) for name in self.capture_fields }
+
+
+class Measurement(object):
+    """ A sweep measurement owning its own buffers, so that several ones can
+        be prepared and processed concurrently, e.g. in a worker pool.
+
+        config:     a SweepConfig, by default the current module parameters.
+
+        After prepare_sweep():
+
+            sweep:          A raw sweep.
+            tapsweep:       The sequence to be played: faded sweep + a zeroes tail
+            indexf1:        Index of pre-tapper end freq in tapsweep
+            LWINDOSWEEP:    The deconvolution spectrum (whole FFT, zero offset)
+            Ls:             Sweep time for frequency to increase by factor e
+            prepared_key:   The config.key() the above arrays belong to
+
+        After process_capture(z):
+
+            dut,    ref         Time domain captured waveforms (first sweep)
+            X                   Crosscorrelation used for the time clearance
+            offset              Record/play delay in samples
+            measured_offset     The REF loopback latency, if it was measured
+            TimeClearanceOK     Boolean about the detected time clearance
+            DUT_TF, REF_TF      Freq domain Transfer Functions
+            DUT_FRD, REF_FRD    Freq Response Data tuples (freq, mag)
+            SWEEPS_SNR          Per sweep SNR (dB) if numSweeps > 1
+            DUT_TFS, DUT_FRDS   If config.interleaved, a list of TFs and FRDs
+                                per output channel, or if config.numMics > 1
+                                per mic. DUT_TF and DUT_FRD are the first ones.
+
+        If config.useArena, the per take arrays (the played signal, the capture,
+        the spectra and TFs) are kept in <arena> and reused by the next take,
+        so copy any of them if needed beyond the current take.
+    """
+
+    def __init__(self, config=None):
+
+        self.config         = config if config is not None else SweepConfig()
+
+        self.sweep          = None
+        self.tapsweep       = None
+        self.indexf1        = 0
+        self.LWINDOSWEEP    = None
+        self.Ls             = None
+        self.prepared_key   = None
+
+        self.dut            = None
+        self.ref            = None
+        self.X              = None
+        self.X_from_ref     = False
+        self.offset         = 0
+        self.measured_offset= None
+        self.TimeClearanceOK= True
+        self.DUT_TF         = None
+        self.REF_TF         = None
+        self.DUT_FRD        = None
+        self.REF_FRD        = None
+        self.SWEEPS_SNR     = []
+        self.DUT_TFS        = []
+        self.DUT_FRDS       = []
+
+        # Precomputed sweep spectrum for the lag limited delay estimator
+        self._xcorr_cache   = {}
+
+        # Reusable per take buffers, if config.useArena
+        self.arena          = BufferArena()
+        self._play_key      = None
+
+
+    def fork(self):
+        """ A new Measurement having the same config, and sharing the prepared
+            sweep arrays (read only), e.g. to process a capture in a worker
+            meanwhile this one captures the next take.
+        """
+        meas = Measurement(self.config)
+        for name in ( 'sweep', 'tapsweep', 'indexf1', 'LWINDOSWEEP', 'Ls',
+                      'prepared_key' ):
+            setattr( meas, name, getattr(self, name) )
+        # (i) the fork runs in another thread, so it updates its own copy of
+        #     the cache dict, still sharing the precomputed spectra
+        meas._xcorr_cache = dict(self._xcorr_cache)
+        return meas
+
+
+    def buffer(self, name, shape, dtype=float64, init=None):
+        """ A per take work array, reused from the arena if config.useArena,
+            otherwise a new one. See BufferArena.get()
+        """
+        if self.config.useArena:
+            return self.arena.get(name, shape, dtype, init)
+        buf = empty(shape, dtype=dtype)
+        if init:
+            init(buf)
+        return buf
+
+
+    def frd_operator(self, smooth_Noct=0):
+        """ The precomputed FRD operator for the current config,
+            None if not enabled or not available.
+        """
+        c = self.config
+        if not c.useFRDoperator:
+            return None
+        return frd_operator.get_operator( c.N, c.fs, c.FRDpoints, smooth_Noct,
+                                          cache=sweep_cache if c.useSweepCache else None )
+
+
+    @profiler.profiled('fft_to_FRD')
+    def fft_to_FRD(self, wholeFFT, smooth_Noct=0):
+        """ wholeFFT can be a whole FFT or its positive freqs half spectrum
+        """
+        N, fs = self.config.N, self.config.fs
+
+        # A single sparse mat-vec does both the logspaced reduction and smoothing
+        op = self.frd_operator(smooth_Noct)
+        if op:
+            return op.apply(wholeFFT)
+
+        # Taking the magnitude from the positive freqs fft part
+        mag = abs( wholeFFT[0 : int(N/2)] )
+
+        # Frequencies
+        f = linspace(0, int(fs/2), int(N/2) )
+
+        # reducing the fft linspaced spectrum into a logspaced one
+        f, mag = tools.logspaced_semispectrum(f, mag, self.config.FRDpoints)
+        profiler.lap('reduction')
+
+        # Smoothing
+        if smooth_Noct:
+            mag = smooth(f, mag, Noct=smooth_Noct)
+            profiler.lap('smoothing')
+
+        return (f, mag)
+
+
+    @profiler.profiled('fft_to_FRDs')
+    def fft_to_FRDs(self, FFTs, smooth_Noct=0):
+        """ Same as fft_to_FRD() for several spectra, e.g. (DUT_TF, REF_TF),
+            the FRD operator processes all of them as a single batch.
+
+            returns: a list of (f, mag)
+        """
+        op = self.frd_operator(smooth_Noct)
+        if not op:
+            return [ self.fft_to_FRD(X, smooth_Noct) for X in FFTs ]
+
+        f, mags = op.apply_batch(FFTs)
+        return [ (f, mags[:, i]) for i in range(len(FFTs)) ]
+
+
+    def lf_windowed_sweep(self):
+        """ The sweep having the LF pre-taper, as used for deconvolution
+        """
+        c = self.config
+        indexf1 = self.indexf1
+
+        lwindo = ones(c.N)
+        # LF pre-taper
+        lwindo[0:indexf1] = 0.5 * ( 1 - cos ( pi * arange(0,indexf1) / indexf1 ) )
+        return lwindo * self.sweep
+
+
+    def sweep_spectrum(self):
+        """ The deconvolution spectrum: the LF windowed sweep, FFT transformed
+            and scaled as played by the DAC.
+        """
+        c = self.config
+        lwindosweep = self.lf_windowed_sweep()
+
+        # FFT: from time domain (lcase) to freq domain (UCASE)
+        return c.S_dac * fft.fft(lwindosweep) * c.sig_frac   # sig_frac ~ atten
+
+
+    def offset_ramp(self, offset, real=False, out=None):
+        """ A linear phase ramp to remove the play-record delay from a spectrum.
+
+            Same as shifting the computer sweep array by roll(lwindosweep, -offset)
+            before the FFT, but it also allows sub-sample fractional offsets.
+
+            real:   the ramp for a positive freqs half spectrum (N/2+1)
+            out:    an optional complex array to compute the ramp in place
+        """
+        ### Original code:
+        #%sweep=circshift(sweep,-offset);            # commented out in original code
+        #lwindosweep=circshift(lwindosweep,-offset); # then replaced by this line
+        N = self.config.N
+        if out is not None:
+            # normalized freqs (cycles/sample), computed once per arena buffer
+            f = self.buffer( 'rfftfreq' if real else 'fftfreq',
+                             N//2 + 1 if real else N,
+                             init=lambda buf: copyto( buf, fft.rfftfreq(N) if real
+                                                           else fft.fftfreq(N) ) )
+            multiply(f, 2j * pi * offset, out=out)
+            return exp(out, out=out)
+
+        if real:
+            f = fft.rfftfreq(N)                 # normalized freqs (cycles/sample)
+        else:
+            f = fft.fftfreq(N)
+        return exp( 2j * pi * f * offset )
+
+
+    @profiler.profiled('prepare_sweep')
+    def prepare_sweep(self):
+        """ Prepares the sweep arrays, see the class doc.
+
+            If config.useSweepCache, the arrays are loaded from the on disk
+            sweep_cache when available, otherwise they are computed then
+            stored there.
+        """
+        c = self.config
+        N, fs, f_start = c.N, c.fs, c.f_start
+
+        # A new sweep invalidates the sweep spectrum used for delay estimation
+        self._xcorr_cache.clear()
+
+        # The played tapsweep (len=N) will be compund of
+        # a logsweep (len=N-Npad) plus a zeros tail (len=Npad).
+        Npad = int(N/4.0)
+        Ns   = N - Npad                         # most of array is used for sweep ;-)
+
+        #--- tapered sweep window:
+        # Parameters to define a window to make a tapered sweep version,
+        # fade in until f1 then fade out from f2 on:
+        #   f_start                             # beginning of turnon half-Hann
+        #   f1                                  # end of turnon half-Hann
+        f2          = c.f2_frac * fs / 2        # beginning of turnoff half-Hann
+        f_stop      = fs/2.0                    # end of turnoff half-Hann
+        Ts          = Ns/float(fs)              # sweep duration. Lenght N-Npad samples.
+        Ls          = Ts / log(f_stop/f_start)  # time for frequency to increase by factor e
+
+        indexf1 = int(round(fs * Ls * log(c.f1/f_start) ) + 1) # end of starting taper
+        indexf2 = int(round(fs * Ls * log(f2/f_start) ) + 1)   # beginning of ending taper
+
+        self.Ls             = Ls
+        self.indexf1        = indexf1
+        self.prepared_key   = c.key()
+
+        if c.useSweepCache:
+            cached = sweep_cache.get(self.prepared_key)
+            profiler.lap('cache_lookup')
+            if cached:
+                self.sweep       = cached['sweep']
+                self.tapsweep    = cached['tapsweep']
+                self.LWINDOSWEEP = cached['LWINDOSWEEP']
+                print( f'--- Logsweep loaded from cache ({sweep_cache.stats()})\n' )
+                return
+
+        ts   = linspace(0, Ns/float(fs), Ns)    # sweep's time points array
+
+        print( "--- Calculating logsweep from ", int(f_start), "to", int(f_stop), "Hz" )
+        sweep       = zeros(N)                  # initialize
+        sweep[0:Ns] = sin( 2*pi * f_start * Ls * (exp(ts/Ls) - 1) )
+        #
+        #  /\/\/\/\/\/\/\/\----  this is the LOGSWEEP + Npad, with total lenght N.
+
+        window   = ones(N)
+        # pre-taper
+        window[0:indexf1]  = 0.5 * (1 - cos(pi * arange(0, indexf1)    / indexf1     ) )
+        # post-taper
+        window[indexf2:Ns] = 0.5 * (1 + cos(pi * arange(0, Ns-indexf2) / (Ns-indexf2)) )
+        window[Ns:N]       = 0      # Zeropad end of sweep
+
+        # Here the LOGSWEEP tapered at each end for output to DAC
+        self.sweep    = sweep
+        self.tapsweep = window * sweep
+
+        profiler.lap('synthesis')
+
+        # The deconvolution spectrum, any play/record offset will be applied later
+        self.LWINDOSWEEP = self.sweep_spectrum()
+        profiler.lap('sweep_spectrum')
+
+        # pending to find out the meaning fo this:
+        print( f'f_start * Ls: {str(round(f_start*Ls, 2))}  Ls: {str(round(Ls,2))}')
+
+        if c.useSweepCache:
+            sweep_cache.put( self.prepared_key, sweep=self.sweep,
+                             tapsweep=self.tapsweep, LWINDOSWEEP=self.LWINDOSWEEP )
+            profiler.lap('cache_store')
+            print( f'(i) Logsweep stored in cache ({sweep_cache.stats()})' )
+
+        print( 'Finished sweep generation...\n' )
+
+
+    def play_signal(self):
+        """ The (N * numSweeps, 2) array to be played
+        """
+        c = self.config
+
+        if c.interleaved > 1:
+            return self.play_signal_interleaved()
+
+        if c.useArena:
+            return self.play_signal_arena()
+
+        # Antiphased signals on channels avoids codec midtap modulation.
+        # 'sig_frac' means the applied attenuation
+        stereo = array([c.sig_frac * self.tapsweep, c.sig_frac * -self.tapsweep]) # [ch0, ch1]
+
+        # Synchronous averaging: several back-to-back sweeps in a single capture
+        if c.numSweeps > 1:
+            stereo = tile(stereo, c.numSweeps)
+
+        # (i) .transpose because the player needs an array having a channel per column.
+        return stereo.transpose()
+
+
+    def play_signal_arena(self):
+        """ Same as play_signal(), but rendered only once into the arena
+            while the sweep and numSweeps don't change.
+        """
+        c = self.config
+        N, K = c.N, c.numSweeps
+
+        stereo = self.arena.get('play', (N * K, 2), float64)
+        if self._play_key != (c.key(), K):
+            multiply(self.tapsweep, c.sig_frac, out=stereo[:N, 0])
+            negative(stereo[:N, 0], out=stereo[:N, 1])
+            for k in range(1, K):
+                stereo[k*N : (k+1)*N] = stereo[:N]
+            self._play_key = (c.key(), K)
+
+        return stereo
+
+
+    def capture_length(self):
+        """ The frames to be played and captured
+        """
+        c = self.config
+        if c.interleaved > 1:
+            return c.N + (c.interleaved - 1) * self.interleave_gap()
+        return c.N * c.numSweeps
+
+
+    def capture_channels(self):
+        """ The input channels to be captured: the mics then REF
+        """
+        return self.config.numMics + 1
+
+
+    def capture_buffer(self):
+        """ The arena array to receive the capture, None if not useArena
+        """
+        if not self.config.useArena:
+            return None
+        return self.arena.get( 'capture',
+                               (self.capture_length(), self.capture_channels()),
+                               float32 )
+
+
+    #---------------------------------------------------------------------------
+    # Interleaved sweeps: every output channel plays the same sweep, staggered
+    # by a gap. The deconvolved impulse response from the mic capture shows
+    # every channel response gap samples after the previous one, so they
+    # are separated by time windows.
+    #---------------------------------------------------------------------------
+    def interleave_gap(self):
+        c = self.config
+        return int(c.interleaveGap) if c.interleaveGap else int(c.N/4.0)
+
+
+    def play_signal_interleaved(self):
+        """ The (N + (K-1) * gap, K) array to be played, for K interleaved
+            channels, the k-th output channel delayed by k * gap.
+        """
+        c   = self.config
+        K   = c.interleaved
+        gap = self.interleave_gap()
+
+        playdata = zeros( (self.capture_length(), K) )
+        for k in range(K):
+            playdata[k*gap : k*gap + c.N, k] = c.sig_frac * self.tapsweep
+
+        return playdata
+
+
+    def interleave_windows(self, offset=0):
+        """ The (start, length) of every channel window in the impulse response.
+
+            A window begins some ms before the channel sweep delay (plus offset),
+            then it ends before the harmonic distortion products from the next
+            channel, that come earlier than its linear response.
+        """
+        c   = self.config
+        gap = self.interleave_gap()
+
+        pre  = minimum( int(0.005 * c.fs), gap // 16 )
+        # 2nd harmonic lead time of a log-sweep
+        hd2  = int( self.Ls * log(2) * c.fs )
+        size = maximum( gap - pre - hd2, gap // 2 )
+
+        return [ ( k * gap + int(round(offset)) - pre, size )
+                 for k in range(c.interleaved) ]
+
+
+    def deconvolve_interleaved(self, dut, offset=0, CF=1.0):
+        """ Deconvolves the mic captured signal of interleaved sweeps.
+
+            returns: a list of DUT TFs, one per channel, as positive freqs
+                     half spectra (N/2+1)
+        """
+        c = self.config
+        L = len(dut)
+        M = next_fast_len(L, real=True)
+
+        # The LF windowed sweep spectrum as sweep_spectrum(), but M length
+        key = ('interleaved', M, self.prepared_key)
+        if self._xcorr_cache.get('interleaved_key') != key:
+            self._xcorr_cache['interleaved_SWEEP'] = \
+                    c.S_dac * sfft.rfft(self.lf_windowed_sweep(), M) * c.sig_frac
+            self._xcorr_cache['interleaved_key'] = key
+        SWEEP = self._xcorr_cache['interleaved_SWEEP']
+
+        # The whole impulse response, all channels one after another
+        h = sfft.irfft( c.S_adc * CF * sfft.rfft(dut, M) / SWEEP, M,
+                        workers=c.fft_workers )
+        profiler.lap('impulse_response')
+
+        TFs = []
+        for start, size in self.interleave_windows(offset):
+            hk = zeros(c.N)
+            a, b = maximum(start, 0), minimum(start + size, M)
+            n = minimum(b - a, c.N)
+            hk[:n] = h[a : a + n]
+            # half-Hann fade out over the last 1/8 of the window
+            nf = n // 8
+            hk[n-nf : n] *= 0.5 * ( 1 + cos( pi * arange(nf) / nf ) )
+            TFs.append( sfft.rfft(hk) )
+        profiler.lap('windows')
+
+        return TFs
+
+
+    def process_interleaved(self, z, CF=None, known_offset=None):
+        """ Same as process_capture(), for a capture of interleaved sweeps.
+            The outputs are meant to be all wired to loudspeakers, so no REF
+            signal is available, a known latency can be given.
+        """
+        c = self.config
+
+        if CF is None:
+            CF = c.calibration_factor()
+
+        self.dut = dut = z[:, 0]
+        self.ref = z[:, 1]
+
+        maxdBFS_dut = 20 * log10( max( abs( dut ) ) )
+        warning = 'WARNING (!)' if maxdBFS_dut >= c.clipWarning else ''
+        print( f'--- Interleaved {c.interleaved} channels, gap '
+               f'{round(self.interleave_gap() / c.fs, 3)} s' )
+        print( 'DUT channel max level:', round(maxdBFS_dut, 1), 'dBFS', warning )
+
+        offset = known_offset if known_offset is not None else 0
+        if known_offset is not None:
+            print( f'(i) Applying the known latency: {offset} samples' )
+
+        self.offset             = offset
+        self.measured_offset    = None
+        self.X                  = None
+        self.TimeClearanceOK    = abs(offset) < int(c.N/4.0)
+        self.SWEEPS_SNR         = []
+
+        self.DUT_TFS  = self.deconvolve_interleaved(dut, offset, CF)
+        self.DUT_FRDS = self.fft_to_FRDs(self.DUT_TFS, smooth_Noct=c.Noct)
+        profiler.lap('frd')
+
+        self.DUT_TF,  self.REF_TF  = self.DUT_TFS[0],  None
+        self.DUT_FRD, self.REF_FRD = self.DUT_FRDS[0], None
+
+
+    def get_offset_xcorr(self, dut, ref, sweep=None):
+        """
+        Determines CLEARANCE based on the offset found between recorded and played signals.
+        The offset is estimated by using crosscorrelation within them.
+
+        If the offset exceeds the ending silence (Npad zeros), then information will be lost
+        and CLEARANCE warning appears.
+
+        returns: offset, TimeClearanceOK
+
+        """
+        N, fs = self.config.N, self.config.fs
+        if sweep is None:
+            sweep = self.sweep
+
+        ### Matlab code:
+        # lags = N/2                    % large enough to catch most delays
+        #                                 (!) no usable en Numpy.correlate
+        ## if max(ref) < 0.1*max(dut)   % automatic reference selection
+        ##    X=xcorr(sweep,dut,lags);  % in case reference is low, use data itself
+        ##else
+        ##    X=xcorr(sweep,ref,lags);  % this uses recorded reference
+        ##end
+        ## [~,nmax]=max(abs(X));
+
+        # Correlate with an automatic reference selection:
+        # (i) For offset estimation, it is preferred to take an undisturbed signal.
+        #     The mic captured signal maybe too noisy to be able to be correlated.
+        #     If not enough signal in ref channel, will use the mic channel instead.
+
+        myref = ref
+        if max(ref) < 0.1 * max(dut):  # but if no signal on ref, use data itself
+            myref = dut
+            print('(!) Bad level on REF ch, using DUT ch itself to estimate clearance')
+
+        print( '--- Determining record/play delay using crosscorrelation '
+               '(can take a while ...)' )
+
+        timestamp = time()
+
+        ### (i) scipy.signal.correlate doesn't use the parameter 'lags' as in Matlab
+        #      (numpy.correlate is too slow, will use scipy.signal equivalent)
+
+        # (i) X is kept for plotting later
+        self.X = sp_signal.correlate(sweep, myref, mode="same")
+        offset = int(N/2) - argmax(self.X)
+
+        print( "Computed in " + str( round(time() - timestamp, 1) ) + " s" )
+
+        print( 'Record offset: ' +  str(offset) + ' samples' + \
+              ' (' +  str( round( offset/float(fs), 3) ) + ' s)' )
+        if offset < 0:
+            print( '(i) Negative offset means player lags recorder!' )
+
+        Npad=int(N/4.0)
+        if abs(offset) > Npad:
+            TimeClearanceOK = False
+        else:
+            TimeClearanceOK = True
+
+        return offset, TimeClearanceOK
+
+
+    def get_sweep_rfft(self, sweep, M):
+        """ Returns the M length real FFT of the given sweep.
+            The spectrum is kept in <_xcorr_cache> to be reused by later calls.
+        """
+        cache = self._xcorr_cache
+        if cache.get('sweep') is not sweep or cache.get('M') != M:
+            cache['sweep'] = sweep
+            cache['M']     = M
+            cache['SWEEP'] = fft.rfft(sweep, M)
+        return cache['SWEEP']
+
+
+    def get_offset_fft(self, dut, ref, sweep=None, use_abs=False):
+        """
+        Same as get_offset_xcorr(), but the crosscorrelation is only evaluated
+        for lags within +/- Npad, i.e. the only range that matters for the
+        CLEARANCE verdict.
+
+        The crosscorrelation is computed from a real FFT cross-spectrum, and the
+        sweep spectrum is precomputed once then reused on every measurement.
+
+        use_abs:    the peak is searched in abs(X), so an inverted REF
+                    polarity is found as well
+
+        returns: offset, TimeClearanceOK
+
+        """
+        N, fs = self.config.N, self.config.fs
+        if sweep is None:
+            sweep = self.sweep
+
+        myref = ref
+        if max(ref) < 0.1 * max(dut):  # but if no signal on ref, use data itself
+            myref = dut
+            print('(!) Bad level on REF ch, using DUT ch itself to estimate clearance')
+
+        # (i) so that the REF loopback offset can be found later from X
+        self.X_from_ref = myref is ref
+
+        print( '--- Determining record/play delay using lag limited crosscorrelation' )
+
+        timestamp = time()
+
+        Npad = int(N/4.0)
+
+        # (i) A FFT length M >= N + Npad avoids any circular wrap around
+        #     inside the +/- Npad lags, so X is the same as the linear xcorr.
+        M = next_fast_len(N + Npad, real=True)
+
+        SWEEP = self.get_sweep_rfft(sweep, M)
+        MYREF = fft.rfft(myref, M)
+        x = fft.irfft(SWEEP * conj(MYREF), M)
+
+        # Circular lags ordering to -Npad ... 0 ... +Npad
+        # (i) X is kept for plotting later, here lag limited (2*Npad+1)
+        X = self.X = concatenate( (x[M-Npad:], x[:Npad+1]) )
+        offset, TimeClearanceOK = self.offset_from_xcorr(X, use_abs)
+
+        print( "Computed in " + str( round(time() - timestamp, 3) ) + " s" )
+
+        print( 'Record offset: ' +  str(round(offset, 2)) + ' samples' + \
+              ' (' +  str( round( offset/float(fs), 3) ) + ' s)' )
+        if offset < 0:
+            print( '(i) Negative offset means player lags recorder!' )
+
+        return offset, TimeClearanceOK
+
+
+    def offset_from_xcorr(self, X, use_abs=False):
+        """ The offset at the peak of a lag limited crosscorrelation X
+            from get_offset_fft(), i.e. having the lags -Npad ... +Npad
+
+            returns: offset, TimeClearanceOK
+        """
+        Npad = (len(X) - 1) // 2
+
+        imax = argmax( abs(X) if use_abs else X )
+        offset = Npad - imax
+
+        # Sub-sample refining by a parabola through the peak and its neighbours
+        if self.config.subsampleOffset and 0 < imax < 2 * Npad:
+            y0, y1, y2 = ( abs(X) if use_abs else X )[imax-1 : imax+2]
+            if (y0 - 2 * y1 + y2) != 0:
+                offset -= 0.5 * (y0 - y2) / (y0 - 2 * y1 + y2)
+
+        # (i) A peak found at the window edges means that the true delay
+        #     is beyond the Npad zeros tail.
+        TimeClearanceOK = abs(offset) < Npad
+
+        return offset, TimeClearanceOK
+
+
+    @profiler.profiled('measure_loopback')
+    def measure_loopback(self, dut, ref, X=None):
+        """ The record/play offset found from the REF loopback channel only,
+            regardless of its polarity.
+
+            X:      the crosscorrelation of REF already computed by
+                    get_offset_fft(), if any, to avoid computing it again
+
+            returns: offset, TimeClearanceOK, or None if no signal on REF
+        """
+        if max(abs(ref)) < 0.1 * max(abs(dut)):
+            return None
+        if X is not None:
+            return self.offset_from_xcorr(X, use_abs=True)
+        return self.get_offset_fft(dut, ref, use_abs=True)
+
+
+    def verify_offset(self, dut, ref, offset, lags=32):
+        """ Cheap check of a known record/play offset: the last portion of
+            the sweep (the widest band per sample) is correlated with the REF
+            channel only for lags around the given offset.
+
+            returns: True if the peak is found at offset (+/- 1 sample),
+                     False if not, None if no signal on REF
+        """
+        N   = self.config.N
+        Ns  = N - int(N/4.0)
+        n   = minimum(16384, Ns // 4)
+        a   = Ns - n
+        o   = int(round(offset))
+
+        if max(abs(ref)) < 0.1 * max(abs(dut)):
+            return None
+        if a + o - lags < 0 or Ns + o + lags > len(ref):
+            return False
+
+        seg  = self.tapsweep[a : Ns]
+        rseg = ref[a + o - lags : Ns + o + lags]
+
+        # X[k] = sum( rseg[k:k+n] * seg ), i.e. the lag k - lags around offset
+        M = next_fast_len(len(rseg) + n, real=True)
+        X = sfft.irfft( sfft.rfft(rseg, M) * conj( sfft.rfft(seg, M) ), M )[ : 2*lags + 1]
+        k = argmax( abs(X) )
+
+        # a peak not standing out means the offset is far beyond the lags
+        energy = sqrt( sum(seg**2) * sum(rseg[k : k+n]**2) )
+        if not energy or abs(X[k]) / energy < 0.5:
+            return False
+
+        return abs(k - lags) <= 1
+
+
+    @profiler.profiled('deconvolve')
+    def deconvolve(self, z, offset=0, CF=1.0):
+        """
+        Calculate TFs using Frequency Domain Ratios (*)
+        UCASE used for freq domain variables.
+        All frequency variables are meant to be voltage spectra
+
+            z:          the captured (N, 2) array [DUT, REF], or
+                        (N, numMics + 1) [MIC1, MIC2 ..., REF]
+            offset:     record/play delay in samples, can be fractional
+            CF:         Calibration Factor for DUT
+
+        returns: DUT_TF, REF_TF
+
+            If numMics > 1, DUT_TF is a (numMics, bins) array, a TF per mic.
+
+            fft_engine = 'fft'      whole complex FFTs in float64 (original code)
+
+            fft_engine = 'rfft'     positive freqs half spectra from real FFTs,
+                                    DUT (all mics) and REF are batched in one
+                                    2-D transform.
+                                    If fft_single, computed in float32 / complex64.
+        """
+        c = self.config
+        mics = c.numMics
+
+        # The deconvolution spectrum is computed only once per prepared sweep,
+        # unless the sweep parameters were modified after prepare_sweep().
+        if self.prepared_key != c.key():
+            self.LWINDOSWEEP  = self.sweep_spectrum()
+            self.prepared_key = c.key()
+
+        if c.fft_engine == 'rfft':
+
+            M     = c.N//2 + 1
+            SWEEP = self.LWINDOSWEEP[ : M ]
+            dtype, cdtype = (float32, complex64) if c.fft_single else (float64, complex128)
+
+            # remove play-record delay
+            if offset:
+                if c.useArena:
+                    ramp  = self.offset_ramp( offset, real=True,
+                                              out=self.buffer('ramp', M, complex128) )
+                    SWEEP = multiply(SWEEP, ramp, out=ramp)
+                else:
+                    SWEEP = SWEEP * self.offset_ramp(offset, real=True)
+
+            if c.fft_single:
+                if c.useArena:
+                    SWEEP32 = self.buffer('SWEEP32', M, complex64)
+                    SWEEP32[:] = SWEEP
+                    SWEEP = SWEEP32
+                else:
+                    SWEEP = SWEEP.astype(complex64)
+
+            # FFT: from time domain (lcase) to freq domain (UCASE)
+            # (i) A contiguous row per channel [DUT, REF] (or [MIC1, MIC2 ..., REF])
+            #     to be transformed at once
+            if c.useArena and _rfft_out:
+                zT = self.buffer('zT', (mics + 1, len(z)), dtype)
+                zT[:] = z[:, :mics + 1].T
+                DUTREF = fft.rfft( zT, axis=-1,
+                                   out=self.buffer('DUTREF', (mics + 1, M), cdtype) )
+            else:
+                DUTREF = sfft.rfft( ascontiguousarray(z[:, :mics + 1].T, dtype=dtype),
+                                    axis=-1, workers=c.fft_workers )
+            DUTREF        *= c.S_adc
+            DUTREF[:mics] *= CF                                 # Calibration Factor
+            profiler.lap('fft')
+
+            # The DECONVOLUTION (i.e ~ freq domain division) provides the TF of DUT
+            # (*) Above referred as 'Frequency Domain Ratios'
+            DUTREF /= SWEEP
+            profiler.lap('division')
+
+            if mics > 1:
+                return DUTREF[:mics], DUTREF[mics]
+            return DUTREF[0], DUTREF[1]
+
+        SWEEP = self.LWINDOSWEEP
+        # remove play-record delay
+        if offset:
+            SWEEP = SWEEP * self.offset_ramp(offset)
+
+        # FFT: from time domain (lcase) to freq domain (UCASE)
+        REF         = c.S_adc * fft.fft(z[:, mics])
+        if mics > 1:
+            DUT     = c.S_adc * fft.fft(z[:, :mics].T, axis=-1) * CF
+        else:
+            DUT     = c.S_adc * fft.fft(z[:, 0])      * CF  # Calibration Factor
+        profiler.lap('fft')
+
+        # The DECONVOLUTION (i.e ~ freq domain division) provides the TF of DUT
+        # (*) Above referred as 'Frequency Domain Ratios'
+        DUT_TF, REF_TF = DUT / SWEEP, REF / SWEEP
+        profiler.lap('division')
+
+        return DUT_TF, REF_TF
+
+
+    def average_sweeps(self, z, K, offset=0, CF=1.0):
+        """
+        Synchronous averaging of K back-to-back sweeps captured in z (K*N, 2),
+        or (K*N, numMics + 1)
+
+        Every N length segment is deconvolved with the same prepared sweep
+        spectrum, then the TFs are accumulated as a running complex mean.
+
+        returns: DUT_TF, REF_TF, SNRs
+
+            SNRs:   per repetition DUT SNR (dB) in the 20 Hz ~ 20 KHz band,
+                    i.e. the mean TF power vs the repetition deviation power.
+                    (all mics pooled if numMics > 1)
+        """
+        N, fs = self.config.N, self.config.fs
+
+        DUT_TF = REF_TF = None
+
+        for k in range(K):
+
+            dut_tf, ref_tf = self.deconvolve(z[k*N : (k+1)*N], offset, CF)
+
+            # (i) deconvolve() can reuse its arrays, so the TFs are kept apart
+            if k == 0:
+                DUT_TFs = self.buffer('sweeps_DUT_TF', (K,) + dut_tf.shape, dut_tf.dtype)
+                DUT_TF  = self.buffer('avg_DUT_TF', dut_tf.shape, dut_tf.dtype)
+                REF_TF  = self.buffer('avg_REF_TF', ref_tf.shape, ref_tf.dtype)
+            DUT_TFs[k] = dut_tf
+
+            # running complex mean
+            if k == 0:
+                DUT_TF[:] = dut_tf
+                REF_TF[:] = ref_tf
+            else:
+                DUT_TF += (dut_tf - DUT_TF) / (k + 1)
+                REF_TF += (ref_tf - REF_TF) / (k + 1)
+
+        # 20 Hz ~ 20 KHz band bins
+        b1, b2 = int(20 * N / fs), int( minimum(20000, fs / 2) * N / fs )
+        P = sum( abs( DUT_TF[..., b1:b2] )**2 )
+
+        SNRs = []
+        for k, dut_tf in enumerate(DUT_TFs):
+            noise = sum( abs( dut_tf[..., b1:b2] - DUT_TF[..., b1:b2] )**2 )
+            SNRs.append( float( round( 10 * log10( P / noise ), 1 ) ) if noise else inf )
+            print( f'    sweep #{k+1}  SNR: {SNRs[-1]} dB' )
+
+        return DUT_TF, REF_TF, SNRs
+
+
+    @profiler.profiled('save_capture')
+    def save_capture(self, z, path):
+        """ Saves the raw captured (DUT, REF) array to <path>.wav (float32),
+            and the sweep parameters to <path>.json
+        """
+        wavfile.write( f'{path}.wav', int(self.config.fs), z.astype(float32) )
+        with open(f'{path}.json', 'w') as f:
+            f.write( json.dumps( self.config.capture_params(), indent=4 ) )
+        print( f'(i) Raw capture saved to: {path}.wav' )
+
 
-    # Frequencies
-    f = linspace(0, int(fs/2), int(N/2) )
+    @profiler.profiled('process_capture')
+    def process_capture(self, z, CF=None, known_offset=None, measure_offset=False):
+        """
+        Computes the results from a captured (DUT, REF) array, e.g. from
+        a recorded file. See the class doc for the resulting attributes.
+        If config.numMics > 1, the array columns are (MIC1, MIC2 ..., REF).
 
-    # Taking the magnitude from the positive freqs fft part
-    mag = abs( wholeFFT[0 : int(N/2)] )
+            CF:             Calibration Factor, if None it is computed from the config.
 
-    # reducing the fft linspaced spectrum into a logspaced one
-    f, mag = tools.logspaced_semispectrum(f, mag, FRDpoints)
+            known_offset:   A previously measured record/play latency, applied
+                            if not config.checkClearence after a quick check,
+                            see verify_offset().
 
-    # Smoothing
-    if smooth_Noct:
-        mag = smooth(f, mag, Noct=smooth_Noct)
+            measure_offset: Measures the REF loopback latency, left in
+                            <measured_offset>. Also done if the known_offset
+                            was not confirmed.
+        """
+        c = self.config
 
-    return (f, mag)
+        if c.interleaved > 1:
+            return self.process_interleaved(z, CF, known_offset)
+
+        if CF is None:
+            CF = c.calibration_factor()
+
+        mics = c.numMics
+
+        dut = z[:, 0]       # we use LEFT  CHANNEL as DUT (the first mic)
+        ref = z[:, mics]    # we use RIGHT CHANNEL as REFERENCE (next to the mics)
+        #N = len(dut)   # This seems to be redundant ¿?
+
+        #-------------  Checking time domain RECORDING LEVELS ----------------------
+        print( "--- Checking levels:" )
+        if mics > 1:
+            levels = [ (f'MIC{m+1}', z[:, m]) for m in range(mics) ]
+        else:
+            levels = [ ('DUT', dut) ]
+        levels.append( ('REF', ref) )
+
+        for label, x in levels:
+            maxdBFS = 20 * log10( max( abs( x ) ) )
+            # LSB: Less Significant Bit
+            RMS_LSBs = round(sqrt( 2**30 * sum(x**2) / len(x) ), 2)
+            if maxdBFS >= c.clipWarning:
+                print( f'{label} channel max level:', round(maxdBFS, 1), 'dBFS  WARNING (!)', \
+                      'RMS_LSBs:',  RMS_LSBs )
+            else:
+                print( f'{label} channel max level:', round(maxdBFS, 1), 'dBFS             ', \
+                      'RMS_LSBs:',  RMS_LSBs )
+
+        profiler.lap('levels')
+
+        # From now on, dut and ref are the first sweep waveforms
+        self.dut = dut = dut[:c.N]
+        self.ref = ref = ref[:c.N]
+
+        #---------------------------------------------------------------------------
+        #------------- 3. Determine if time clearance: -----------------------------
+        # Checks if ound card play/rec delay is lower than the zeropad silence
+        # at the signal end. Will use crosscorrelation
+        #---------------------------------------------------------------------------
+        offset = 0              # ideal record/play delay
+        TimeClearanceOK = True
+        self.measured_offset = None
+        if c.checkClearence:
+            if c.xcorr_method == 'fft':
+                offset, TimeClearanceOK = self.get_offset_fft(dut, ref)
+            else:
+                offset, TimeClearanceOK = self.get_offset_xcorr(dut, ref)
+
+        # A known latency avoids the whole crosscorrelation
+        elif known_offset is not None:
+            verified = self.verify_offset(dut, ref, known_offset)
+            if verified is False:
+                print( f'(!) Known latency {known_offset} samples not found, '
+                       f'measuring it again' )
+                measure_offset = True
+            else:
+                offset = known_offset
+                TimeClearanceOK = abs(offset) < int(c.N/4.0)
+                print( f'(i) Applying the known latency: {offset} samples '
+                       f'({"verified" if verified else "unverified, no REF signal"})' )
+
+        if measure_offset:
+            # (i) the time clearance check has already correlated REF
+            X = None
+            if c.checkClearence and c.xcorr_method == 'fft' and self.X_from_ref:
+                X = self.X
+            found = self.measure_loopback(dut, ref, X=X)
+            if found is None:
+                print( '(!) Bad level on REF ch, unable to measure the latency' )
+            else:
+                self.measured_offset = found[0]
+                if not c.checkClearence:
+                    offset, TimeClearanceOK = found
+
+        self.offset          = offset
+        self.TimeClearanceOK = TimeClearanceOK
+        profiler.lap('clearance')
+
+        #---------------------------------------------------------------------------
+        #-------------- 4. Calculate TFs using Frequency Domain Ratios -------------
+        #---------------------------------------------------------------------------
+        self.SWEEPS_SNR = []
+        if c.numSweeps > 1:
+            print( f'--- Averaging {c.numSweeps} sweeps:' )
+            self.DUT_TF, self.REF_TF, self.SWEEPS_SNR = \
+                                    self.average_sweeps(z, c.numSweeps, offset, CF)
+        else:
+            self.DUT_TF, self.REF_TF = self.deconvolve(z, offset, CF)
+        profiler.lap('transfer_functions')
+
+        # The original code Logsweep1quasi.m continues finding the loudspeaker
+        # quasi-anechoic response, by using markers to windowing the recorded
+        # time domain signal.
+        # Here we don't need that, because we use the stationary in-room
+        # loudspeaker response.
+
+        # A TF per mic, all of them rendered in the same FRD batch
+        self.DUT_TFS = []
+        if mics > 1:
+            self.DUT_TFS = list(self.DUT_TF)
+            self.DUT_TF  = self.DUT_TFS[0]
+
+        # ADD ON: getting a smoothed FRD (freq response data) from the measured TFs (fft)
+        FRDS = self.fft_to_FRDs( self.DUT_TFS + [self.REF_TF] if mics > 1 else
+                                 (self.DUT_TF, self.REF_TF),
+                                 smooth_Noct=c.Noct )
+        self.DUT_FRD, self.REF_FRD = FRDS[0], FRDS[-1]
+        self.DUT_FRDS = FRDS[:-1] if mics > 1 else []
+        profiler.lap('frd')
+
+
+def read_capture(path):
+    """ Reads a capture saved by save_capture()
+
+        returns: params, z
+
+            params:     the <path>.json sweep parameters, see SweepConfig
+            z:          the captured (DUT, REF) array
+    """
+    with open(f'{path}.json', 'r') as f:
+        params = json.loads( f.read() )
+    _, z = wavfile.read(f'{path}.wav')
+    return params, z
+
+
+#-------------------------------------------------------------------------------
+#---------------------- MODULE LEVEL MEASUREMENT WRAPPERS ----------------------
+#-------------------------------------------------------------------------------
+# (i) The functions below keep the module globals interface, i.e. the module
+#     parameters can be modified directly (e.g. LS.N) and the results are
+#     published as module globals (e.g. LS.DUT_FRD). They all work on the same
+#     Measurement instance, so they are not intended to be used concurrently.
+
+_meas = None
+
+
+def _module_measurement():
+    """ The Measurement behind the module level functions, updated with
+        the current module parameters.
+    """
+    global _meas
+    if _meas is None:
+        _meas = Measurement()
+    else:
+        _meas.config = SweepConfig()
+    return _meas
+
+
+def _publish(meas, *names):
+    """ Copies the given Measurement attributes to the module globals
+    """
+    globals().update( { name: getattr(meas, name) for name in names } )
+
+
+def fft_to_FRD(wholeFFT, smooth_Noct=0):
+    """ wholeFFT can be a whole FFT or its positive freqs half spectrum
+    """
+    return _module_measurement().fft_to_FRD(wholeFFT, smooth_Noct)
+
+
+def sweep_key():
+    """ The parameters that fully determine the prepared sweep arrays,
+        used as the sweep cache key.
+    """
+    return SweepConfig().key()
+
+
+def offset_ramp(offset, real=False):
+    """ See Measurement.offset_ramp()
+    """
+    return _module_measurement().offset_ramp(offset, real)
 
 
 def prepare_sweep():
     """ prepare globals to work:
-            sweep:      A raw sweep.
-            tapsweep:   The sequence to be played: faded sweep + a zeroes tail
-            indexf1:    Index of pre-tapper end freq in tapsweep
+            sweep, tapsweep, indexf1, LWINDOSWEEP, Ls, prepared_key
+
+        See Measurement.prepare_sweep()
     """
-    global sweep, tapsweep, indexf1
+    meas = _module_measurement()
+    meas.prepare_sweep()
+    _publish(meas, 'sweep', 'tapsweep', 'indexf1', 'LWINDOSWEEP', 'Ls',
+                   'prepared_key')
 
 
-    # The played tapsweep (len=N) will be compund of
-    # a logsweep (len=N-Npad) plus a zeros tail (len=Npad).
-    Npad = int(N/4.0)
-    Ns   = N - Npad                         # most of array is used for sweep ;-)
+def get_offset_xcorr(sweep, dut, ref):
+    """ See Measurement.get_offset_xcorr(), also the global X for plotting later.
 
-    ts   = linspace(0, Ns/float(fs), Ns)    # sweep's time points array
+        returns: offset, TimeClearanceOK
+    """
+    meas = _module_measurement()
+    res = meas.get_offset_xcorr(dut, ref, sweep)
+    _publish(meas, 'X')
+    return res
 
-    #--- tapered sweep window:
-    # Parameters to define a window to make a tapered sweep version,
-    # fade in until f1 then fade out from f2 on:
-    f_start     = 5.0                       # beginning of turnon half-Hann
-    f1          = 10.0                      # end of turnon half-Hann
-    f2          = 0.91 * fs / 2             # beginning of turnoff half-Hann
-    f_stop      = fs/2.0                    # end of turnoff half-Hann
-    Ts          = Ns/float(fs)              # sweep duration. Lenght N-Npad samples.
-    Ls          = Ts / log(f_stop/f_start)  # time for frequency to increase by factor e
 
-    indexf1 = int(round(fs * Ls * log(f1/f_start) ) + 1) # end of starting taper
-    indexf2 = int(round(fs * Ls * log(f2/f_start) ) + 1) # beginning of ending taper
+def get_offset_fft(sweep, dut, ref):
+    """ See Measurement.get_offset_fft(), also the global X for plotting later.
 
-    print( "--- Calculating logsweep from ", int(f_start), "to", int(f_stop), "Hz" )
-    sweep       = zeros(N)                  # initialize
-    sweep[0:Ns] = sin( 2*pi * f_start * Ls * (exp(ts/Ls) - 1) )
-    #
-    #  /\/\/\/\/\/\/\/\----  this is the LOGSWEEP + Npad, with total lenght N.
+        returns: offset, TimeClearanceOK
+    """
+    meas = _module_measurement()
+    res = meas.get_offset_fft(dut, ref, sweep)
+    _publish(meas, 'X')
+    return res
 
-    window   = ones(N)
-    # pre-taper
-    window[0:indexf1]  = 0.5 * (1 - cos(pi * arange(0, indexf1)    / indexf1     ) )
-    # post-taper
-    window[indexf2:Ns] = 0.5 * (1 + cos(pi * arange(0, Ns-indexf2) / (Ns-indexf2)) )
-    window[Ns:N]       = 0      # Zeropad end of sweep
 
-    # Here the LOGSWEEP tapered at each end for output to DAC
-    tapsweep = window * sweep
+def deconvolve(z, offset=0, CF=1.0):
+    """ See Measurement.deconvolve()
 
-    # pending to find out the meaning fo this:
-    print( f'f_start * Ls: {str(round(f_start*Ls, 2))}  Ls: {str(round(Ls,2))}')
+        returns: DUT_TF, REF_TF
+    """
+    meas = _module_measurement()
+    res = meas.deconvolve(z, offset, CF)
+    _publish(meas, 'LWINDOSWEEP', 'prepared_key')
+    return res
 
-    print( 'Finished sweep generation...\n' )
 
+def average_sweeps(z, K, offset=0, CF=1.0):
+    """ See Measurement.average_sweeps()
 
-def get_offset_xcorr(sweep, dut, ref):
+        returns: DUT_TF, REF_TF, SNRs
     """
-    Determines CLEARANCE based on the offset found between recorded and played signals.
-    The offset is estimated by using crosscorrelation within them.
+    meas = _module_measurement()
+    res = meas.average_sweeps(z, K, offset, CF)
+    _publish(meas, 'LWINDOSWEEP', 'prepared_key')
+    return res
 
-    If the offset exceeds the ending silence (Npad zeros), then information will be lost
-    and CLEARANCE warning appears.
 
-    returns: offset, TimeClearanceOK
+def calibration_factor():
+    """ SPL calibration factor CF as per system type, None if unknown type
+    """
+    return SweepConfig().calibration_factor()
+
 
+def capture_params():
+    """ The parameters needed to reprocess a capture without the sound card
     """
+    return SweepConfig().capture_params()
 
-    global X  # global scoped for plotting later
 
-    ### Matlab code:
-    # lags = N/2                    % large enough to catch most delays
-    #                                 (!) no usable en Numpy.correlate
-    ## if max(ref) < 0.1*max(dut)   % automatic reference selection
-    ##    X=xcorr(sweep,dut,lags);  % in case reference is low, use data itself
-    ##else
-    ##    X=xcorr(sweep,ref,lags);  % this uses recorded reference
-    ##end
-    ## [~,nmax]=max(abs(X));
+def save_capture(z, path):
+    """ Saves the raw captured (DUT, REF) array to <path>.wav (float32),
+        and the sweep parameters to <path>.json
+    """
+    _module_measurement().save_capture(z, path)
 
-    # Correlate with an automatic reference selection:
-    # (i) For offset estimation, it is preferred to take an undisturbed signal.
-    #     The mic captured signal maybe too noisy to be able to be correlated.
-    #     If not enough signal in ref channel, will use the mic channel instead.
 
-    myref = ref
-    if max(ref) < 0.1 * max(dut):  # but if no signal on ref, use data itself
-        myref = dut
-        print('(!) Bad level on REF ch, using DUT ch itself to estimate clearance')
+def load_capture(path):
+    """ Loads a capture saved by save_capture(), then updates the module
+        parameters from the <path>.json file.
 
-    print( '--- Determining record/play delay using crosscorrelation '
-           '(can take a while ...)' )
+        returns: z, the captured (DUT, REF) array
+    """
+    params, z = read_capture(path)
+    globals().update(params)
+    return z
 
-    timestamp = time()
 
-    ### (i) scipy.signal.correlate doesn't use the parameter 'lags' as in Matlab
-    #      (numpy.correlate is too slow, will use scipy.signal equivalent)
+def stream_capture(playdata, on_block=None, out=None):
+    """ Full duplex play/rec through by a callback driven stream, the captured
+        blocks are collected from a ring buffer meanwhile the stream runs.
 
-    X = signal_correlate(sweep, myref, mode="same")
-    offset = int(N/2) - argmax(X)
+        playdata:   an array having a channel per column
+        on_block:   optional function on_block(z, n) called on every completed
+                    block, where z[:n] holds the frames captured so far.
+        out:        an optional (frames, channels) float32 array to capture into
 
-    print( "Computed in " + str( round(time() - timestamp, 1) ) + " s" )
+        returns:    the captured array, having a channel per column
 
-    print( 'Record offset: ' +  str(offset) + ' samples' + \
-          ' (' +  str( round( offset/float(fs), 3) ) + ' s)' )
-    if offset < 0:
-        print( '(i) Negative offset means player lags recorder!' )
+        (i) Blocks having status flags (xruns) are annotated in the global
+            <stream_status> as a list of (frame_position, flags)
+    """
+    global stream_status
 
-    Npad=int(N/4.0)
-    if abs(offset) > Npad:
-        TimeClearanceOK = False
-    else:
-        TimeClearanceOK = True
+    global _capture
 
-    return offset, TimeClearanceOK
+    cap = DuplexCapture( playdata, fs, channels=playdata.shape[1],
+                         blocksize=streamBlocksize,
+                         stream_factory=stream_factory )
+    _capture = cap
+    z = cap.run(on_block=on_block, out=out)
+    _capture = None
 
+    stream_status = cap.status_log
+    if stream_status:
+        print( f'(!) {len(stream_status)} captured blocks with status flags, '
+               f'CHECK YOUR SOUND CARD' )
 
-def do_meas():
+    if cap.aborted:
+        return None
+
+    return z
+
+
+def latency_key(mode=None):
+    """ The device cache key for the play/rec latency of the current devices,
+        fs, capture mode and blocksize. None if not available.
+
+        mode:   'playrec', 'stream' or 'progressive', by default as per the
+                module captureMode and progressiveLF
+    """
+    if mode is None:
+        mode = 'progressive' if progressiveLF else captureMode
+    try:
+        device_cache.check_devices( sd.query_devices() )
+        if mode in ('stream', 'progressive', 'session'):
+            mode, blocksize = 'stream', streamBlocksize
+        else:
+            mode, blocksize = 'playrec', sd.default.blocksize
+        return DeviceCache.key( soundcard_key(*sd.default.device, fs),
+                                mode, blocksize )
+    except Exception as e:
+        print( f'(device_cache) not available: {e}' )
+        return None
+
+
+def abort_meas():
+    """ Aborts a running 'stream' capture, e.g. from a GUI thread.
+    """
+    if _capture:
+        _capture.abort()
+
+
+def progressive_LF(CF=1.0, meas=None):
+    """ Returns an on_block function for stream_capture(), that every
+        <progressEvery> blocks deconvolves the portion already captured.
+
+        As the log-sweep covers the low frequencies first, the captured portion
+        provides a band limited FRD up to the frequency already swept.
+        Results are left in PROGRESS_FRD and sent to progress_callback().
+
+        (i) The capture consumer must keep up with the sound card, so the
+            partial results are computed in a thread of their own, skipping
+            a partial result while the previous one is still running.
+            Only the captured portion is transformed, by an FFT of its own
+            length, and only the bins below the band limit are rendered.
+            on_block.join() waits for a running partial result.
+    """
+    global PROGRESS_FRD, time_to_first_result
+
+    if meas is None:
+        meas = _module_measurement()
+    c = meas.config
+
+    PROGRESS_FRD         = None
+    time_to_first_result = None
+    t0 = time()
+    counter = [0]
+    running = [None]
+    partial = {}
+
+    def deconvolve_partial(z, n, fmax):
+
+        global PROGRESS_FRD, time_to_first_result
+
+        # the windowed sweep and the logspaced freqs, once per capture
+        if not partial:
+            partial['sweep'] = c.S_dac * c.sig_frac * meas.lf_windowed_sweep()
+            flin = linspace(0, int(c.fs/2), int(c.N/2))
+            partial['f'], _ = tools.logspaced_semispectrum(flin, flin, c.FRDpoints)
+
+        # (i) only the first sweep if several are played, and the first mic
+        #     Both the capture and the sweep are faded out from where the
+        #     sweep is 1/4 oct above fmax, so that their truncation ripple
+        #     is left out of the band.
+        a = int( c.fs * meas.Ls * log( fmax * 2**(1/4) / f_start ) )
+        a = minimum( maximum(a, 0), n - 1 )
+        fade = 0.5 * ( 1 + cos( pi * arange(n - a) / (n - a) ) )
+        # (i) rendered 1/8 oct beyond fmax, so that the smoothing has
+        #     neighbours at the band edge
+        fext = fmax * 2**(1/8)
+        M = next_fast_len(n, real=True)
+        K = minimum( int(fext * M / c.fs) + 2, M//2 + 1 )
+        dut   = z[:n, 0].astype(float64)
+        sweep = partial['sweep'][:n].copy()
+        dut[a:]   *= fade
+        sweep[a:] *= fade
+        DUT   = sfft.rfft( dut, M )[:K] * c.S_adc * CF
+        SWEEP = sfft.rfft( sweep, M )[:K]
+        with errstate(divide='ignore', invalid='ignore'):
+            mag = abs( DUT / SWEEP )
+
+        f = partial['f'][ partial['f'] <= fext ]
+        mag = interp( f, arange(K) * c.fs / M, mag )
+        if c.Noct:
+            mag = smooth(f, mag, Noct=c.Noct)
+        band = f <= fmax
+        f, mag = f[band], mag[band]
+        PROGRESS_FRD = ( f, mag )
+
+        if time_to_first_result is None:
+            time_to_first_result = time() - t0
+            print( f'(i) First LF result up to {int(fmax)} Hz after '
+                   f'{round(time_to_first_result, 2)} s' )
+
+        if progress_callback:
+            progress_callback(f, mag, fmax)
+
+    def on_block(z, n):
+
+        counter[0] += 1
+        if counter[0] % progressEvery:
+            return
+
+        # the previous partial result is still running
+        if running[0] is not None and running[0].is_alive():
+            return
+
+        # the whole band was already delivered
+        if PROGRESS_FRD is not None and PROGRESS_FRD[0][-1] >= progressFmax / 2**(1/24):
+            return
+
+        # Swept freq by the captured portion, backing off 1/2 oct to leave out
+        # the truncated transition.
+        n = minimum(n, c.N)
+        fswept = f_start * exp( n / float(c.fs) / meas.Ls ) / sqrt(2)
+        fmax   = minimum(fswept, progressFmax)
+        if fmax < 20:
+            return
+
+        running[0] = threading.Thread( target=deconvolve_partial,
+                                       args=(z, n, fmax), daemon=True )
+        running[0].start()
+
+    def join():
+        if running[0] is not None:
+            running[0].join()
+
+    on_block.join = join
+    return on_block
+
+
+@profiler.profiled('do_meas')
+def do_meas(background=False):
     """
     Compute globals about DUT Device-Under-Test and REFerence measurements.
 
         dut,    ref             Time domain captured waveforms
 
-        DUT_TF, REF_TF          Freq domain Transfer Functions (whole complex FFTs)
+        DUT_TF, REF_TF          Freq domain Transfer Functions (whole complex FFTs,
+                                or positive freqs half spectra if fft_engine='rfft')
 
         DUT_FRD, REF_FRD        Freq Response Data rendered over the configured
                                 <FRDpoints> frequency logspaced points.
@@ -549,25 +2008,52 @@ def do_meas():
 
         TimeClearanceOK         Boolean about the detected time clearance
 
+        stream_status           Blocks with xruns, if captureMode = 'stream'
+
+        SWEEPS_SNR              Per sweep SNR (dB) if numSweeps > 1
+
+        measAborted             The 'stream' capture was aborted (or there is
+                                no CF), results were not updated.
+
+        PROGRESS_FRD            If progressiveLF, the last band limited partial
+                                result computed meanwhile capturing.
+
+        DUT_TFS, DUT_FRDS       If interleaved > 1, the TFs and FRDs of every
+                                output channel, or if numMics > 1 of every mic
+                                (see Measurement).
+
+    If <capturePath> is given, the raw capture is also saved to disk,
+    so it can be reprocessed later by reprocess.py
+
+    If <useLatencyCache>, the REF loopback latency is measured and cached
+    for the current devices. Then the takes without checkClearence
+    (e.g. roommeasure) apply the known latency instead of assuming zero.
+
+    If <session_stream> is given, the sweep is played and captured through
+    that already open stream instead of opening a new one (see session_stream.py).
+    <captureOverhead> is the capture time beyond the sweep length.
+
+    If <background>, the capture is not processed here and the above globals
+    are not updated. Instead, it returns a take to be processed later by
+    process_take(), e.g. in a worker thread meanwhile the next capture.
+    Returns None if the capture was aborted.
+
     """
 
-    global dut,    ref
-    global DUT_TF, REF_TF
-    global DUT_FRD, REF_FRD
-    global TimeClearanceOK
+    global measAborted, captureOverhead
+
+    meas = _module_measurement()
+    profiler.info( N=N, fs=fs, numSweeps=numSweeps, fft_engine=fft_engine,
+                   captureMode='progressive' if progressiveLF else captureMode )
 
     #---------------------------------------------------------------------------
     # ---- SPL calibration as per system type
     #---------------------------------------------------------------------------
-    if system_type == 'acoustic':
-        CF = Vw / (power_amp_gain * mic_cal * mic_preamp_gain * Po)
-    elif system_type == 'electronic':
-        CF = 1 / electronic_gain
-    elif system_type == 'level-dependent':
-        CF = 1 / (sig_frac * mic_cal * mic_preamp_gain * Po)
-    else:
+    CF = meas.config.calibration_factor()
+    measAborted = CF is None
+    if CF is None:
         print( "(!) Please check system_type for CF" )
-        return zeros(N)
+        return None if background else zeros(N)
 
     #---------------------------------------------------------------------------
     #---------- 2. data gathering: send out sweep, record system output --------
@@ -575,94 +2061,139 @@ def do_meas():
     print( '--- Starting recording ...' )
     print( '(i) Some sound cards act strangely. Check carefully!' )
 
-    # Antiphased signals on channels avoids codec midtap modulation.
-    # 'sig_frac' means the applied attenuation
-    stereo = array([sig_frac * tapsweep, sig_frac * -tapsweep]) # [ch0, ch1]
+    # Antiphased sweeps [ch0, ch1], having a channel per column,
+    # or staggered sweeps on every output channel if interleaved
+    playdata = meas.play_signal()
+    if interleaved > 1:
+        print( f'(i) Playing staggered sweeps on {interleaved} output channels' )
+    elif numSweeps > 1:
+        print( f'(i) Playing {numSweeps} sweeps to be averaged' )
+    if numMics > 1:
+        print( f'(i) Capturing {numMics} mics, REF on input {numMics + 1}' )
+        if interleaved > 1:
+            print( '(!) interleaved sweeps are processed from the first mic only' )
+
+    # (i) a stream capture has the same channels for input and output,
+    #     and partial results are for a single sweep.
+    mode = captureMode
+    if session_stream is not None:
+        mode = 'session'
+    elif progressiveLF and interleaved == 1:
+        mode = 'progressive'
+    elif interleaved > 1:
+        mode = 'playrec'
+
+    # (i) the stream plays silence on the outputs beyond the played ones
+    capch = meas.capture_channels()
+    if mode in ('stream', 'progressive') and playdata.shape[1] < capch:
+        playdata = column_stack( (playdata,
+                                  zeros( (len(playdata), capch - playdata.shape[1]) )) )
 
     # Setting sound device interface
-    sd.default.samplerate = fs
-    sd.default.channels = 2
-    rec_dev_name = sd.query_devices(sd.default.device[0], kind='input' )['name']
-    pbk_dev_name = sd.query_devices(sd.default.device[1], kind='output')['name']
-    print(f'    in: {rec_dev_name}, out: {pbk_dev_name}, fs: {sd.default.samplerate}')
+    lat_key = None
+    if playrec_func and mode == 'playrec':
+        print(f'    in/out: {getattr(playrec_func, "__qualname__", "playrec_func")}, fs: {fs}')
+    else:
+        sd.default.samplerate = fs
+        sd.default.channels = capch, playdata.shape[1]
+        rec_dev_name = sd.query_devices(sd.default.device[0], kind='input' )['name']
+        pbk_dev_name = sd.query_devices(sd.default.device[1], kind='output')['name']
+        print(f'    in: {rec_dev_name}, out: {pbk_dev_name}, fs: {sd.default.samplerate}')
+        if useLatencyCache:
+            lat_key = latency_key(mode)
 
     # Full duplex Play/Rec
-    # (i) .transpose because the player needs an array having a channel per column.
-    #     'blocking' waits to finish.
-    z = sd.playrec(stereo.transpose(), blocking=True)
-    dut = z[:, 0]   # we use LEFT  CHANNEL as DUT
-    ref = z[:, 1]   # we use RIGHT CHANNEL as REFERENCE
-    #N = len(dut)   # This seems to be redundant ¿?
+    # (i) 'blocking' waits to finish.
+    # (i) if useArena, the capture goes into a reused buffer
+    out = meas.capture_buffer()
+    t0 = time()
+    if mode == 'session':
+        z = session_stream.playrec(playdata, channels=capch, out=out)
+    elif mode == 'progressive':
+        on_block = progressive_LF(CF, meas)
+        z = stream_capture(playdata, on_block=on_block, out=out)
+        on_block.join()
+    elif mode == 'stream':
+        z = stream_capture(playdata, out=out)
+    elif playrec_func:
+        z = playrec_func(playdata, samplerate=fs, channels=capch, blocking=True, out=out)
+    else:
+        z = sd.playrec(playdata, blocking=True, out=out)
+    captureOverhead = time() - t0 - len(playdata) / fs
+    profiler.lap('capture')
+
+    measAborted = z is None
+    if measAborted:
+        print( '(!) Measurement aborted.' )
+        return
     print( 'Finished recording.' )
 
-    #-------------  Checking time domain RECORDING LEVELS ----------------------
-    print( "--- Checking levels:" )
-    maxdBFS_dut = 20 * log10( max( abs( dut ) ) )
-    maxdBFS_ref = 20 * log10( max( abs( ref ) ) )
-    # LSB: Less Significant Bit
-    dut_RMS_LSBs = round(sqrt( 2**30 * sum(dut**2) / N ), 2)
-    ref_RMS_LSBs = round(sqrt( 2**30 * sum(ref**2) / N ), 2)
-
-    if maxdBFS_dut >= clipWarning:
-        print( 'DUT channel max level:', round(maxdBFS_dut, 1), 'dBFS  WARNING (!)', \
-              'RMS_LSBs:',  dut_RMS_LSBs )
-    else:
-        print( 'DUT channel max level:', round(maxdBFS_dut, 1), 'dBFS             ', \
-              'RMS_LSBs:',  dut_RMS_LSBs )
+    if capturePath:
+        meas.save_capture(z, capturePath)
 
-    if maxdBFS_ref >= clipWarning:
-        print( 'REF channel max level:', round(maxdBFS_ref, 1), 'dBFS  WARNING (!)', \
-              'RMS_LSBs:',  ref_RMS_LSBs )
-    else:
-        print( 'REF channel max level:', round(maxdBFS_ref, 1), 'dBFS             ', \
-              'RMS_LSBs:',  ref_RMS_LSBs )
+    # The known device latency, it is measured again on every time clearance check
+    known = None
+    if lat_key:
+        entry = device_cache.get('latencies', lat_key)
+        known = entry['offset'] if entry else None
 
-    #---------------------------------------------------------------------------
-    #------------- 3. Determine if time clearance: -----------------------------
-    # Checks if ound card play/rec delay is lower than the zeropad silence
-    # at the signal end. Will use crosscorrelation
-    #---------------------------------------------------------------------------
-    offset = 0              # ideal record/play delay
-    TimeClearanceOK = True
-    if checkClearence:
-        offset, TimeClearanceOK = get_offset_xcorr(sweep=sweep, dut=dut, ref=ref)
+    # (i) interleaved sweeps have no REF loop to measure the latency
+    take = { 'z':               z,
+             'CF':              CF,
+             'known_offset':    known,
+             'measure_offset':  bool(lat_key) and (known is None or checkClearence)
+                                and interleaved == 1,
+             'lat_key':         lat_key }
 
-    #---------------------------------------------------------------------------
-    #-------------- 4. Calculate TFs using Frequency Domain Ratios (*) ---------
-    #                   UCASE used for freq domain variables.
-    #                   All frequency variables are meant to be voltage spectra
-    #---------------------------------------------------------------------------
-    lwindo = ones(N)
-    # LF pre-taper
-    lwindo[0:indexf1] = 0.5 * ( 1 - cos ( pi * arange(0,indexf1) / indexf1 ) )
-    lwindosweep = lwindo * sweep
-    # remove play-record delay by shifting computer sweep array:
-    #%sweep=circshift(sweep,-offset);            # commented out in original code
-    #lwindosweep=circshift(lwindosweep,-offset); # then replaced by this line
-    lwindosweep = roll(lwindosweep, -offset)
-
-    # FFT: from time domain (lcase) to freq domain (UCASE)
-    LWINDOSWEEP = S_dac * fft.fft(lwindosweep) * sig_frac   # sig_frac ~ atten
-    REF         = S_adc * fft.fft(ref)
-    DUT         = S_adc * fft.fft(dut)         * CF         # Calibration Factor
-
-    # The DECONVOLUTION (i.e ~ freq domain division) provides the TF of DUT
-    # (*) Above referred as 'Frequency Domain Ratios'
-    DUT_TF   = DUT / LWINDOSWEEP
-    REF_TF   = REF / LWINDOSWEEP
-
-    # The original code Logsweep1quasi.m continues finding the loudspeaker
-    # quasi-anechoic response, by using markers to windowing the recorded
-    # time domain signal.
-    # Here we don't need that, because we use the stationary in-room
-    # loudspeaker response.
-
-    # ADD ON: getting a smoothed FRD (freq response data) from the measured TFs (fft)
-    DUT_FRD = fft_to_FRD(DUT_TF, smooth_Noct=Noct)
-    REF_FRD = fft_to_FRD(REF_TF, smooth_Noct=Noct)
-
-    # END
-    # (i)   The results are the above referenced global scoped variables.
+    if background:
+        # (i) the arena capture buffer will receive the next capture
+        if useArena:
+            take['z'] = z.copy()
+        take['meas'] = meas.fork()
+        return take
+
+    process_capture( z, CF, known_offset=take['known_offset'],
+                     measure_offset=take['measure_offset'] )
+
+    if lat_key and meas.measured_offset is not None:
+        device_cache.put( 'latencies', lat_key, offset=float(meas.measured_offset) )
+
+
+@profiler.profiled('process_take')
+def process_take(take):
+    """ Processes a take from do_meas(background=True) on its own Measurement,
+        so it can run concurrently with the next capture. The module globals
+        are not updated.
+
+        returns: the Measurement having the results (see Measurement)
+    """
+    meas = take['meas']
+    meas.process_capture( take['z'], take['CF'], take['known_offset'],
+                          take['measure_offset'] )
+
+    if take['lat_key'] and meas.measured_offset is not None:
+        device_cache.put( 'latencies', take['lat_key'],
+                          offset=float(meas.measured_offset) )
+    return meas
+
+
+def process_capture(z, CF=None, known_offset=None, measure_offset=False):
+    """
+    Computes the do_meas() results from a captured (DUT, REF) array,
+    e.g. from a recorded file. See do_meas() for the resulting globals.
+
+        CF:     Calibration Factor, if None it is computed from the
+                current module parameters.
+
+        known_offset, measure_offset:   see Measurement.process_capture()
+    """
+    meas = _module_measurement()
+    meas.process_capture(z, CF, known_offset, measure_offset)
+
+    # (i)   The results are the do_meas() referenced global scoped variables.
+    _publish( meas, 'dut', 'ref', 'X', 'TimeClearanceOK', 'DUT_TF', 'REF_TF',
+                    'DUT_FRD', 'REF_FRD', 'SWEEPS_SNR', 'LWINDOSWEEP',
+                    'prepared_key', 'DUT_TFS', 'DUT_FRDS' )
 
 
 #-------------------------------------------------------------------------------
@@ -671,7 +2202,8 @@ def do_meas():
 if __name__ == "__main__":
 
     # Reading command line options
-    opcsOK = True
+    opcsOK  = True
+    reprobe = False
     for opc in sys.argv[1:]:
 
         if "-h" in opc.lower():
@@ -687,12 +2219,52 @@ if __name__ == "__main__":
         elif "-nosmoo" in opc.lower():
             Noct = 0
 
+        elif "-avg=" in opc.lower():
+            numSweeps = int(opc.split("=")[1])
+
+        elif "-mics=" in opc.lower():
+            numMics = int(opc.split("=")[1])
+
+        elif "-savewav=" in opc.lower():
+            capturePath = opc.split("=")[1]
+
         elif "-noclear" in opc.lower():
             checkClearence = False
 
+        elif "-fullxcorr" in opc.lower():
+            xcorr_method = 'full'
+
+        elif "-fullfft" in opc.lower():
+            fft_engine = 'fft'
+
+        elif "-fft32" in opc.lower():
+            fft_engine = 'rfft'
+            fft_single = True
+
+        elif "-stream" in opc.lower():
+            captureMode = 'stream'
+
+        elif "-profile=" in opc.lower():
+            profiler.enable( opc.split("=")[1] )
+
+        elif "-progressive" in opc.lower():
+            progressiveLF = True
+
+        elif "-nolatcache" in opc.lower():
+            useLatencyCache = False
+
+        elif "-nocache" in opc.lower():
+            useSweepCache = False
+
+        elif "-nofrdop" in opc.lower():
+            useFRDoperator = False
+
         elif opc.lower() == "-sc":
             select_card = True
 
+        elif "-reprobe" in opc.lower():
+            reprobe = True
+
         elif "-dev" in opc.lower():
             try:
                 selected_card = opc.split("=")[1]
@@ -709,6 +2281,9 @@ if __name__ == "__main__":
         elif "-aux" in opc.lower():
             aux_plot = True
 
+        elif "-fullplot" in opc.lower():
+            plotEnvelope = False
+
         else:
             opcsOK = False
 
@@ -727,11 +2302,11 @@ if __name__ == "__main__":
         if i.isdigit(): i = int(i)
         if o.isdigit(): o = int(o)
         # A sound card failure will end the script.
-        if not test_soundcard(i=i, o=o):
+        if not test_soundcard(i=i, o=o, force=reprobe):
             sys.exit()
 
     if select_card:
-        if not choose_soundcard():
+        if not choose_soundcard(force=reprobe):
             print( "(!) Error using devices to play/rec:" )
             for dev in sd.default.device:
                 print( "    " + sd.query_devices(dev)['name'] )
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Per stage timing and memory instrumentation.
+
+    Enabled by setting the environment variable DRC_PROFILE to a file path,
+    e.g. DRC_PROFILE=~/drc_profile.jsonl, or by calling enable(path).
+
+    Every outermost section (e.g. a do_meas() call) appends a JSON line:
+
+        {"run": "do_meas", "start": "2019-...", "N": 262144, ...
+         "s": 4.61, "peak_MB": 38.2,
+         "stages": [ {"stage": "capture", "t0": 0.0, "s": 4.4, "peak_MB": 6.0},
+                     {"stage": "process_capture/levels", ...}, ... ] }
+
+        s:          wall time in seconds
+        t0:         stage start, in seconds from the run start
+        peak_MB:    peak allocation above the memory in use when the stage
+                    began, as traced by tracemalloc (process wide).
+
+    tracemalloc is started by enable() and stopped by disable() only. As its
+    peak is process wide, peak_MB is recorded for the main thread sections
+    only, it is null for sections running in other threads (e.g. a worker
+    processing a previous take). The main thread peaks still include the
+    allocations made meanwhile by other threads.
+
+    Usage in a module:
+
+        import profiler
+
+        @profiler.profiled('prepare_sweep')     # a section per call
+        def prepare_sweep(): ...
+
+        with profiler.section('capture'):       # a section within a block
+            ...
+
+        profiler.lap('levels')                  # a stage from the previous lap,
+                                                # or the section start, up to here
+
+        profiler.info(N=N, fs=fs)               # annotates the current run
+
+    Usage:      profiler.py  file.jsonl
+
+        Prints a per stage summary from the given file.
+"""
+
+import os
+import sys
+import json
+import threading
+import functools
+import tracemalloc
+from time import perf_counter
+from datetime import datetime
+
+
+_path       = ''
+_local      = threading.local()
+_write_lock = threading.Lock()
+_started_tm = False     # tracemalloc was started here
+
+
+def enable(path):
+    global _path, _started_tm
+    _path = os.path.expanduser(path)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tm = True
+
+
+def disable():
+    global _path, _started_tm
+    _path = ''
+    if _started_tm:
+        tracemalloc.stop()
+        _started_tm = False
+
+
+def enabled():
+    return bool(_path)
+
+
+if os.environ.get('DRC_PROFILE'):
+    enable( os.environ['DRC_PROFILE'] )
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+class section(object):
+    """ A timed section, to be used as a context manager.
+        The outermost section writes the JSON line when it ends.
+    """
+
+    def __init__(self, name, **info):
+        self.name   = name
+        self.info   = info
+        self.active = False
+
+
+    def __enter__(self):
+
+        if not _path:
+            return self
+
+        stack = _stack()
+
+        # (i) the tracemalloc peak is process wide, only the main thread resets it
+        self.traced = threading.current_thread() is threading.main_thread() \
+                      and tracemalloc.is_tracing()
+
+        cur, peak = self._traced_memory()
+        if stack:
+            stack[-1]._fold(peak)
+        if self.traced:
+            tracemalloc.reset_peak()
+
+        self.active     = True
+        self.root       = stack[0] if stack else self
+        self.path       = '/'.join( [s.name for s in stack[1:]] + [self.name] )
+        self.t0         = perf_counter()
+        self.mem0       = cur
+        self.peak       = cur
+        self.lap_t      = self.t0
+        self.lap_mem    = cur
+        self.lap_peak   = cur
+        self.stages     = []
+
+        stack.append(self)
+        return self
+
+
+    def _traced_memory(self):
+        """ (current, peak) as traced, or zeros if this section is not traced
+        """
+        return tracemalloc.get_traced_memory() if self.traced else (0, 0)
+
+
+    def _peak_MB(self, peak, mem0):
+        return round( (peak - mem0) / 2**20, 3 ) if self.traced else None
+
+
+    def _fold(self, peak):
+        """ updates the peaks with the one traced since the last reset
+        """
+        self.peak     = max(self.peak, peak)
+        self.lap_peak = max(self.lap_peak, peak)
+
+
+    def _lap(self, name):
+
+        now = perf_counter()
+        cur, peak = self._traced_memory()
+        self._fold(peak)
+
+        self.root.stages.append( {
+            'stage':    f'{self.path}/{name}' if self is not self.root else name,
+            't0':       round(self.lap_t - self.root.t0, 6),
+            's':        round(now - self.lap_t, 6),
+            'peak_MB':  self._peak_MB(self.lap_peak, self.lap_mem) } )
+
+        if self.traced:
+            tracemalloc.reset_peak()
+        self.lap_t      = now
+        self.lap_mem    = cur
+        self.lap_peak   = cur
+
+
+    def __exit__(self, exc_type, exc, tb):
+
+        if not self.active:
+            return False
+
+        elapsed = perf_counter() - self.t0
+        _, peak = self._traced_memory()
+        self._fold(peak)
+
+        stack = _stack()
+        stack.pop()
+        self.active = False
+
+        peak_MB = self._peak_MB(self.peak, self.mem0)
+
+        if stack:
+            stack[-1]._fold(self.peak)
+            self.root.stages.append( { 'stage':     self.path,
+                                       't0':        round(self.t0 - self.root.t0, 6),
+                                       's':         round(elapsed, 6),
+                                       'peak_MB':   peak_MB } )
+            return False
+
+        record = { 'run':   self.name,
+                   'start': datetime.now().isoformat(timespec='seconds'),
+                   **self.info,
+                   's':         round(elapsed, 6),
+                   'peak_MB':   peak_MB,
+                   'stages':    sorted(self.stages, key=lambda x: x['t0']) }
+        if exc_type:
+            record['error'] = exc_type.__name__
+
+        try:
+            with _write_lock:
+                with open(_path, 'a') as f:
+                    f.write( json.dumps(record, default=str) + '\n' )
+        except Exception as e:
+            print( f'(profiler) unable to write {_path}: {e}' )
+
+        return False
+
+
+def profiled(name):
+    """ Decorator, every call to the function is a section
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def lap(name):
+    """ A stage in the current section, from its previous lap (or its start)
+    """
+    stack = _stack() if _path else None
+    if stack:
+        stack[-1]._lap(name)
+
+
+def info(**kwargs):
+    """ Annotates the current run
+    """
+    stack = _stack() if _path else None
+    if stack:
+        stack[0].info.update(kwargs)
+
+
+def summary(path):
+    """ Per stage mean time and max peak from a JSON lines file
+        returns: {(run, stage): [count, total_s, max_peak_MB]}
+    """
+    res = {}
+    with open(path, 'r') as f:
+        for line in f:
+            rec = json.loads(line)
+            items = [ (rec['run'], '', rec['s'], rec['peak_MB']) ] + \
+                    [ (rec['run'], s['stage'], s['s'], s['peak_MB'])
+                      for s in rec['stages'] ]
+            for run, stage, s, peak in items:
+                acc = res.setdefault( (run, stage), [0, 0.0, None] )
+                acc[0] += 1
+                acc[1] += s
+                if peak is not None:
+                    acc[2] = max(acc[2] or 0.0, peak)
+    return res
+
+
+if __name__ == '__main__':
+
+    if not sys.argv[1:] or sys.argv[1][0] == '-':
+        print( __doc__ )
+        sys.exit()
+
+    res = summary(sys.argv[1])
+    runs = [ run for run, stage in res if not stage ]
+
+    print( f'    {"run / stage":<44} {"calls":>6} {"mean s":>9} {"peak MB":>9}' )
+    for run in runs:
+        for (r, stage), (n, total, peak) in res.items():
+            if r == run:
+                label = run if not stage else f'    {stage}'
+                peak = f'{peak:>9.1f}' if peak is not None else f'{"-":>9}'
+                print( f'    {label:<44} {n:>6} {total / n:>9.4f} {peak}' )
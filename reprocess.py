@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    reprocess.py
+
+    Offline reprocessing of raw captures saved by 'logsweep2TF.py -savewav'
+    or 'roommeasure.py -savewav', so no sound card is needed.
+
+    Every 'xxx.wav' having its 'xxx.json' parameters file found in the given
+    folder will be processed again in parallel, then saved as 'xxx.frd'
+    under the output folder ('xxx_ch1.frd', 'xxx_ch2.frd' ... for captures
+    of interleaved sweeps, 'xxx_mic1.frd' ... for multi mic captures).
+
+    Usage:      python3 reprocess.py  folder  [options ... ...]
+
+    -h                  Help
+
+    -noct=N             Smoothing 1/N oct for the resulting freq response
+                        (default 24)
+
+    -points=N           Logspaced freq points for the output .frd files
+                        (default 1000)
+
+    -clearance          Also checks the time clearance for every capture,
+                        (REF channel must be wired as per logsweep2TF.py)
+
+    -jobs=N             Number of parallel processes (default: all CPUs)
+
+    -out=path           Output folder (default: folder/reprocessed)
+
+"""
+
+import os
+import sys
+import glob
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# No plots nor sound card are needed here (see lazyimport.py)
+os.environ.setdefault('DRC_HEADLESS', '1')
+import logsweep2TF as LS
+import tools
+
+
+def reprocess_one(path, out_folder, Noct, FRDpoints, checkClearence):
+    """ Reprocess the capture <path>.wav, saves <out_folder>/<name>.frd
+
+        returns: a summary dict of the capture
+    """
+    params, z = LS.read_capture(path)
+    config = LS.SweepConfig( Noct=Noct, FRDpoints=FRDpoints,
+                             checkClearence=checkClearence, **params )
+    meas = LS.Measurement(config)
+
+    # The LS module is verbose
+    with open(os.devnull, 'w') as devnull:
+        with redirect_stdout(devnull):
+            meas.prepare_sweep()
+            meas.process_capture(z)
+
+    name = os.path.basename(path)
+
+    # (i) interleaved captures render a FRD per channel, 'name_chK.frd',
+    #     and multi mic captures a FRD per mic, 'name_micK.frd'
+    frds = meas.DUT_FRDS if len(meas.DUT_FRDS) > 1 else [meas.DUT_FRD]
+    suffix = 'mic' if config.numMics > 1 and config.interleaved == 1 else 'ch'
+    for k, (f, mag) in enumerate(frds):
+        magdB = 20 * np.log10( mag )
+        fname = name if len(frds) == 1 else f'{name}_{suffix}{k+1}'
+        tools.saveFRD(  fname   = f'{out_folder}/{fname}.frd',
+                        freq    = f,
+                        mag     = magdB,
+                        fs      = config.fs,
+                        comments= f'reprocess.py {fname} Noct:{Noct}',
+                        verbose = False
+                      )
+
+    return { 'name':        name,
+             'N':           config.N,
+             'fs':          config.fs,
+             'clearance':   meas.TimeClearanceOK,
+             'maxdB':       round( float( np.max(magdB) ), 1 ) }
+
+
+def find_captures(folder):
+    """ The captures having both .wav and .json files, without extension
+    """
+    paths = []
+    for fname in sorted( glob.glob(f'{folder}/*.wav') ):
+        path = fname[:-4]
+        if os.path.isfile(f'{path}.json'):
+            paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+
+    folder          = ''
+    out_folder      = ''
+    Noct            = LS.Noct
+    FRDpoints       = LS.FRDpoints
+    checkClearence  = False
+    jobs            = None
+
+    for opc in sys.argv[1:]:
+
+        if "-h" in opc.lower():
+            print( __doc__ )
+            sys.exit()
+
+        elif "-noct=" in opc.lower():
+            Noct = int(opc.split("=")[1])
+
+        elif "-points=" in opc.lower():
+            FRDpoints = int(opc.split("=")[1])
+
+        elif "-clearance" in opc.lower():
+            checkClearence = True
+
+        elif "-jobs=" in opc.lower():
+            jobs = int(opc.split("=")[1])
+
+        elif "-out=" in opc.lower():
+            out_folder = opc.split("=")[1]
+
+        elif opc[0] != '-':
+            folder = opc
+
+        else:
+            print( __doc__ )
+            sys.exit()
+
+    if not folder:
+        print( __doc__ )
+        sys.exit()
+
+    if not out_folder:
+        out_folder = f'{folder}/reprocessed'
+    os.makedirs(out_folder, exist_ok=True)
+
+    paths = find_captures(folder)
+    if not paths:
+        print( f'(!) No .wav + .json captures found in: {folder}' )
+        sys.exit()
+
+    print( f'--- Reprocessing {len(paths)} captures from: {folder}' )
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+
+        futures = [ pool.submit( reprocess_one, path, out_folder,
+                                 Noct, FRDpoints, checkClearence )
+                    for path in paths ]
+
+        for path, future in zip(paths, futures):
+            try:
+                res = future.result()
+            except Exception as e:
+                print( f'(!) {os.path.basename(path)}: {e}' )
+                continue
+            clearance = '' if not checkClearence else \
+                        ('  clearance OK' if res['clearance'] else '  (!) NO CLEARANCE')
+            print( f'    {res["name"]:<16} N: {res["N"]:<8} fs: {res["fs"]:<6} '
+                   f'max: {res["maxdB"]:>6} dB{clearance}' )
+
+    print( f'(i) FRD files saved to: {out_folder}' )
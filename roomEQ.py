@@ -27,6 +27,12 @@
 
         roomEQ.py response.frd [response2.frd ...]   [ options ]
 
+        roomEQ.py path/session.drc[:item]   [ options ]
+
+            A session file saved by roommeasure.py, every channel average
+            by default, or the given item named as its .frd file
+            counterpart, e.g. session.drc:L_avg_smoothed
+
             -fs=        Output FIR sampling freq (default 48000 Hz)
 
             -e=         Exponent 2^XX for FIR length in taps.
@@ -50,6 +56,15 @@
 
             -noPos      Does not allow positive gains at all
 
+            -profile=   Appends per stage timing and memory as JSON lines
+                        to the given file (see profiler.py)
+
+            -noplot     Does not make the graphs, nor the .png file.
+
+            -headless   Fast start for batch jobs, the plotting modules are
+                        not loaded (implies -noplot). Also by setting the
+                        environment variable DRC_HEADLESS=1
+
 
 
     ABOUT POSITIVE EQ GAIN:
@@ -85,17 +100,23 @@
 import os
 import sys
 import numpy as np
-from scipy import signal
-from scipy.interpolate import interp1d
+
+# '-headless' must be known before importing the plotting modules
+if '-headless' in sys.argv[1:]:
+    os.environ['DRC_HEADLESS'] = '1'
+
+# (i) If running headless (see lazyimport.py), matplotlib is imported later
+#     only when needed.
+import lazyimport
 
 # https://matplotlib.org/faq/howto_faq.html#working-with-threads
-import matplotlib
+matplotlib = lazyimport.load('matplotlib')
 # Later we will be able to call matplotlib.use('Agg') to replace the regular
 # display backend (e.g. 'Mac OSX') by the dummy one 'Agg' in order to avoid
 # incompatibility when threading this module, e.g. when using a Tcl/Tk GUI.
-import matplotlib.pyplot as plt
+plt = lazyimport.load('matplotlib.pyplot')
 
-from matplotlib.ticker import EngFormatter
+ticker = lazyimport.load('matplotlib.ticker')
 
 ### ~/audiotools
 HOME = os.path.expanduser("~")
@@ -104,6 +125,9 @@ import tools
 import pydsd
 from smoothSpectrum import smoothSpectrum as smooth
 
+import profiler
+from session_file import SessionFile
+
 
 ### roomEQ.py DEFAULTS:
 
@@ -136,12 +160,24 @@ wLoct   = 5         # span in octaves for the left side of wL.
 wHoct   = 5         # span in octaves for the right side of wH.
 noPos   = False     # avoids positive gains
 
+# Graphs (not needed when running headless)
+doPlot  = not lazyimport.HEADLESS
 
-def main(FRDname, ax, ref_level=None):
+
+@profiler.profiled('roomEQ')
+def main(FRDname, ax=None, ref_level=None):
+    """ ax: the axes to plot on, None for no graphs
+    """
 
     FRDbasename = os.path.basename(FRDname)
     FRDdirname  = os.path.dirname(FRDname)
 
+    # An item from a session file, e.g. 'path/session.drc:L_avg'
+    if '.drc:' in FRDname:
+        FRDbasename = FRDname.split('.drc:')[-1]
+
+    profiler.info(frd=FRDbasename, m=m, fs=fs)
+
     print( f'--- processing {FRDbasename}')
 
     # Retreiving channel Id for naming files
@@ -154,10 +190,17 @@ def main(FRDname, ax, ref_level=None):
 
     FRDpath = f'{FRDdirname}/{FRDbasename}'
 
-    # Reading the FRD file
-    FR, fs_FRD = tools.readFRD(FRDpath)
-    freq = FR[:, 0]     # >>>> frequencies vector <<<<
-    mag  = FR[:, 1]     # >>>> magnitudes vector  <<<<
+    # Reading the FRD file, or the session file item (linear, memory mapped)
+    if '.drc:' in FRDname:
+        path, item = FRDname.split('.drc:')
+        freq, mag = SessionFile(f'{path}.drc').frd(item)
+        freq = np.array(freq)
+        mag  = 20 * np.log10(mag)
+    else:
+        FR, fs_FRD = tools.readFRD(FRDpath)
+        freq = FR[:, 0]     # >>>> frequencies vector <<<<
+        mag  = FR[:, 1]     # >>>> magnitudes vector  <<<<
+    profiler.lap('read_frd')
 
 
     ############################################################################
@@ -196,6 +239,7 @@ def main(FRDname, ax, ref_level=None):
     mag    -= ref_level   # original curve
     rmag   -= ref_level   # the 1/1 oct version
     target -= ref_level   # the final target to be equalised
+    profiler.lap('target_smoothing')
 
 
     ############################################################################
@@ -232,6 +276,7 @@ def main(FRDname, ax, ref_level=None):
     # Joining hemispheres to have an updated 'eq' curve with limited positive gains
     eq = eqPos + eqNeg
     eq = smooth(freq, eq, Noct=24)
+    profiler.lap('eq')
 
 
     ############################################################################
@@ -278,83 +323,87 @@ def main(FRDname, ax, ref_level=None):
     imp = pydsd.semiblackmanharris(m) * imp[:m]
 
     # From now on, 'imp' has a causal response, a natural one, i.e. minimum phase
+    profiler.lap('fir')
 
 
     ############################################################################
     # 4. MAKE PLOTS
     ############################################################################
-    ax.set_xscale('log')
-    ax.grid(True, which='both', axis='x')
-    ax.grid(True, which='major', axis='y')
-    ax.set_xlim(20, 20000)
-    ax.set_yticks( range(-90, 60, 6) )
-    ax.set_ylim(-30, 18)
+    if ax is not None:
 
-    # auxiliary EQ plots ( -dev )
-    if dev:
+        ax.set_xscale('log')
+        ax.grid(True, which='both', axis='x')
+        ax.grid(True, which='major', axis='y')
+        ax.set_xlim(20, 20000)
+        ax.set_yticks( range(-90, 60, 6) )
+        ax.set_ylim(-30, 18)
 
-        ax.axvline(fSchro, label='Schroeder', color='black', linestyle=':')
+        # auxiliary EQ plots ( -dev )
+        if dev:
 
-        ax.axvline (f0, label='f0 = -' + str(octSch) + ' oct vs Schroeder',
-                        color='orange', linestyle=':', linewidth=1)
+            ax.axvline(fSchro, label='Schroeder', color='black', linestyle=':')
 
-        ax.plot(freq, eqaux,
-                     label='eqaux', linestyle=':', color='purple')
+            ax.axvline (f0, label='f0 = -' + str(octSch) + ' oct vs Schroeder',
+                            color='orange', linestyle=':', linewidth=1)
 
-    # raw response curve:
-    ax.plot(freq, mag,
-                            label='FRD',
-                            color='grey', linestyle=':', linewidth=.5)
+            ax.plot(freq, eqaux,
+                         label='eqaux', linestyle=':', color='purple')
 
-    # target (smoothed) curve:
-    ax.plot(freq, target,
-                            label='FRD schoeder smoothed',
-                            color='blue', linestyle='-')
+        # raw response curve:
+        ax.plot(freq, mag,
+                                label='FRD',
+                                color='grey', linestyle=':', linewidth=.5)
 
-    # the chunk curve used for getting the ref level:
-    if autoRef:
-        ax.plot(freq[ f1_idx : f2_idx], rmag[ f1_idx : f2_idx ],
-                            label='range to estimate ref level',
-                            color='black', linestyle='--', linewidth=2)
+        # target (smoothed) curve:
+        ax.plot(freq, target,
+                                label='FRD schoeder smoothed',
+                                color='blue', linestyle='-')
 
-    # window for positive gains (scaled at level 10 for clarity)
-    if not noPos:
-        ax.plot(freq, w*10, label='positive eq unitary window',
-                            color='grey', linestyle='dotted')
+        # the chunk curve used for getting the ref level:
+        if autoRef:
+            ax.plot(freq[ f1_idx : f2_idx], rmag[ f1_idx : f2_idx ],
+                                label='range to estimate ref level',
+                                color='black', linestyle='--', linewidth=2)
 
-    # computed EQ curve:
-    ax.plot(newFreq, newEq,
-                            label=f'EQ FIR ({int(m/1024)} Ktaps)',
-                            color='green')
+        # window for positive gains (scaled at level 10 for clarity)
+        if not noPos:
+            ax.plot(freq, w*10, label='positive eq unitary window',
+                                color='grey', linestyle='dotted')
 
-    # estimated result curve:
-    if dev:
-        ax.plot(freq, (target + eq),
-                            label='estimated result',
-                            color='green', linewidth=1.5)
+        # computed EQ curve:
+        ax.plot(newFreq, newEq,
+                                label=f'EQ FIR ({int(m/1024)} Ktaps)',
+                                color='green')
 
+        # estimated result curve:
+        if dev:
+            ax.plot(freq, (target + eq),
+                                label='estimated result',
+                                color='green', linewidth=1.5)
 
-    # A text box with resolution info
-    # (these are matplotlib.patch.Patch properties)
-    props = dict(boxstyle='round', facecolor='green', alpha=0.3)
-    ax.text( 4000.0, -15.0,
-             f'FIR {int(m/1024)} Ktaps, freq. resol: {round(fs/m, 1)} Hz',
-             bbox=props)
 
-    # plot title
-    title = f'{FRDbasename}\n(ref. level @ {str(ref_level)} dB --> 0 dB)'
-    ax.set_title(title)
+        # A text box with resolution info
+        # (these are matplotlib.patch.Patch properties)
+        props = dict(boxstyle='round', facecolor='green', alpha=0.3)
+        ax.text( 4000.0, -15.0,
+                 f'FIR {int(m/1024)} Ktaps, freq. resol: {round(fs/m, 1)} Hz',
+                 bbox=props)
 
-    # nice engineering formatting "1 K"
-    ax.xaxis.set_major_formatter( EngFormatter() )
-    ax.xaxis.set_minor_formatter( EngFormatter() )
+        # plot title
+        title = f'{FRDbasename}\n(ref. level @ {str(ref_level)} dB --> 0 dB)'
+        ax.set_title(title)
 
-    # rotate_labels for both major and minor xticks
-    for label in ax.get_xticklabels(which='both'):
-        label.set_rotation(70)
-        label.set_horizontalalignment('center')
+        # nice engineering formatting "1 K"
+        ax.xaxis.set_major_formatter( ticker.EngFormatter() )
+        ax.xaxis.set_minor_formatter( ticker.EngFormatter() )
 
-    ax.legend(loc='lower right')
+        # rotate_labels for both major and minor xticks
+        for label in ax.get_xticklabels(which='both'):
+            label.set_rotation(70)
+            label.set_horizontalalignment('center')
+
+        ax.legend(loc='lower right')
+        profiler.lap('plot')
 
 
     ############################################################################
@@ -372,6 +421,7 @@ def main(FRDname, ax, ref_level=None):
         print( f'(i) Saving roomEQ FIR:' )
         print( f'    {EQpcmname}' )
         tools.savePCM32(imp, EQpcmname)
+        profiler.lap('write_fir')
 
     else:
         print( '(i) Skiping FIR saving' )
@@ -393,6 +443,18 @@ if __name__ == '__main__':
         if opc[0] != '-' and opc[-4:] in ('.frd','.txt'):
             FRDnames.append(opc)
 
+        elif opc[0] != '-' and '.drc:' in opc:
+            FRDnames.append(opc)
+
+        # A whole session file: every channel average
+        elif opc[0] != '-' and opc[-4:] == '.drc':
+            try:
+                chs = SessionFile(opc).channels()
+            except Exception as e:
+                print( f'(!) {e}' )
+                sys.exit()
+            FRDnames += [ f'{opc}:{ch}_avg' for ch in chs ]
+
         elif opc[:4] == '-fs=':
             if opc[4:] in ('44100', '48000', '96000'):
                 fs = int(opc[4:])
@@ -447,6 +509,15 @@ if __name__ == '__main__':
         elif '-nopos' in opc.lower():
             noPos = True
 
+        elif '-profile=' in opc.lower():
+            profiler.enable( opc.split('=')[-1] )
+
+        elif '-noplot' in opc.lower():
+            doPlot = False
+
+        elif '-headless' in opc.lower():
+            doPlot = False
+
         elif '-v' in opc:
             viewFIRs = True
 
@@ -466,40 +537,45 @@ if __name__ == '__main__':
 
 
 
-    # prepare pyplot
-    plt.rcParams.update({'font.size': 8})
+    if not FRDnames:
+        print(__doc__)
+        sys.exit()
+
+    # Processing FRDs without graphs
+    if not doPlot:
+        for FRDname in FRDnames:
+            main(FRDname, None, ref_level)
 
-    # prepare subplots as per the number of given FRD files
-    nrows = len(FRDnames)
-    fig, axs = plt.subplots( nrows=nrows, ncols=1,
-                             figsize=(9, 4.5 * nrows) ) # in inches, wide aspect
+    else:
+        # prepare pyplot
+        plt.rcParams.update({'font.size': 8})
 
-    # Processing FRDs
-    # (if only one, plt.subplots will not return an array of axes)
-    if len(FRDnames) == 1:
-        main(FRDnames[0], axs, ref_level)
+        # prepare subplots as per the number of given FRD files
+        nrows = len(FRDnames)
+        fig, axs = plt.subplots( nrows=nrows, ncols=1,
+                                 figsize=(9, 4.5 * nrows), # in inches, wide aspect
+                                 squeeze=False )
 
-    elif len(FRDnames) > 1:
+        # Processing FRDs
         for i, FRDname in enumerate(FRDnames):
-            main(FRDname, axs[i], ref_level)
+            main(FRDname, axs[i, 0], ref_level)
 
-    else:
-        print(__doc__)
-        sys.exit()
+        # Saving graphs by using the folder beholding the last FRD file name
+        png_folder = os.path.dirname( FRDnames[-1] )
+        if not png_folder:
+            png_folder = os.getcwd()
+        png_path = f'{png_folder}/roomEQ_drc.png'
+        print( f'(i) Saving graph to file: {png_path}' )
+
+        with profiler.section('roomEQ_png', png=png_path):
 
-    # Tightening plot layout
-    plt.tight_layout()
+            # Tightening plot layout
+            plt.tight_layout()
 
-    # Saving graphs by using the folder beholding the last FRD file name
-    png_folder = os.path.dirname( FRDnames[-1] )
-    if not png_folder:
-        png_folder = os.getcwd()
-    png_path = f'{png_folder}/roomEQ_drc.png'
-    print( f'(i) Saving graph to file: {png_path}' )
-    fig.savefig(png_path)
+            fig.savefig(png_path)
 
-    # Display plots
-    plt.show()
+        # Display plots
+        plt.show()
 
     # ...
     if viewFIRs:
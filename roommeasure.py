@@ -29,6 +29,9 @@
     'CH_avg_smoothed.frd'   Average smoothed 1/24 oct below Schroeder freq,
                             then progressively smoothed up to 1/1 oct at Nyquist.
 
+    'session.drc'           All of the above in a single binary file, to be
+                            read by roomEQ.py (see session_file.py)
+
     Usage:
 
         DRC_GUI.py          Launches a Graphical User Interface
@@ -42,15 +45,29 @@
          -m=N               Number of mic locations per channel.
                             (default 2 mic takes)
 
+         -mics=M            A multichannel interface captures M mics at once
+                            (inputs 1 ... M, REF loop on input M+1), so every
+                            sweep provides M mic locations, saved as separate
+                            'CH_N.frd' takes. Not for -interleave.
+
          -e=XX              Power of two 2^XX to set the log-sweep length.
                             (default 2^17 == 128 K samples ~ 2 s at fs 48KHz)
 
+         -avg=K             K back-to-back sweeps averaged in a single capture
+                            at every mic location (default 1)
+
          -c=X               Channel id:  L | R | LR
                             This id will form the avobe .frd filename prefix.
                             'LR' allows the measurements of both channels
                             to be interleaved at a microphone location.
                             (default 'C' will be used as filename prefix)
 
+         -interleave        With several channels (e.g. -c=LR), measures all of
+                            them in a single capture at every location, each
+                            channel playing a staggered sweep on its own sound
+                            card output (L on out 1, R on out 2, ...), so no
+                            REF loop is available. Not for remote JACK.
+
          -schro=XXX         Schroeder freq, influences the smoothing transition
                             for the resulting smoothed freq response file.
                             (default 200 Hz)
@@ -61,6 +78,47 @@
          -folder=path       A folder to store the measured FRD files,
                             relative to your $HOME (default: roommeas/meas)
 
+         -profile=file      Appends per stage timing and memory as JSON lines
+                            to the given file (see profiler.py)
+
+         -arena             Reuses the same preallocated buffers on every
+                            take, instead of allocating new ones, so that
+                            long sweeps don't churn memory (see buffer_arena.py)
+
+         -resume            Continues a broken session at the given -folder,
+                            reloading the takes already measured from its
+                            session store (see session_store.py). The session
+                            -e, -dev fs, -m, -mics and -interleave are restored,
+                            giving other values is an error.
+
+         -nostream          Opens a new sound card stream for every beep and
+                            sweep. By default a single full duplex stream is
+                            kept open for the whole session, playing the
+                            pre-rendered beeps and the sweeps as scheduled
+                            (see session_stream.py).
+
+         -noworker          Processes every take before prompting for the next
+                            location. By default, the analysis, saving and
+                            plotting run in a background thread meanwhile the
+                            mic is moved, and the averages wait for them.
+
+         -spatial=method    How the mic locations are averaged (see spatial_avg.py):
+                            mean | rms | db | trimmed | median  (default mean)
+
+         -trim=x            Fraction of the lowest and of the highest takes
+                            discarded at every freq by -spatial=trimmed (0.1)
+
+         -weights=w0,w1,..  Weights of the mic locations #0, #1, ... in the
+                            average, e.g. to down-weight locations close to the
+                            room boundaries (default 1 for every location)
+
+         -savetf            Also saves the complex TF of every take into
+                            'session.drc' (N/2 complex values per take).
+
+         -savewav           Also saves the raw captures as 'CH_N.wav' plus
+                            'CH_N.json', so they can be reprocessed later
+                            by reprocess.py without the sound card.
+
 
                             USER INTERACTION:
 
@@ -133,8 +191,11 @@
 # standard modules
 import os
 import sys
+import queue
+import threading
 import numpy as np
 from time import sleep
+from datetime import datetime
 
 # logsweep2TF module (logsweep to transfer function)
 try:
@@ -143,22 +204,58 @@ except Exception as e:
     print( f'(!) ERROR loading module \'logsweep2TF.py\': {e}' )
     sys.exit()
 
+import profiler
+from running_stats import RunningStats
+from session_store import SessionStore
+from session_file import write_session
+from spatial_avg import spatial_average, METHODS as AVG_METHODS
+from session_stream import SessionStream, StreamTimeout
+
 # audiotools modules
 UHOME = os.path.expanduser("~")
 sys.path.append(UHOME + "/audiotools")
 import tools
 from smoothSpectrum import smoothSpectrum as smooth
 
-# A list of 148 CSS4 colors to plot measured curves
-from matplotlib import colors as mcolors
-css4_colors = list(mcolors.CSS4_COLORS.values())    # (black is index 7)
+# 148 CSS4 colors to plot measured curves (loaded later if running headless)
+import lazyimport
+mcolors = lazyimport.load('matplotlib.colors')
+
+
+def css4_color(i):
+    """ The i-th of the 148 CSS4 colors (black is index 7)
+    """
+    return list(mcolors.CSS4_COLORS.values())[i % 148]
 
 # Resulting measurements stack (all measured points for every channel)
 curves = {'freq': None, 'L': None, 'R': None}
 
+# Running statistics for every channel, updated on every take
+stats = {}
+
+# The session takes on disk, and those already measured if resumed
+store = None
+done_takes = set()
+
+# Session parameters given on the command line, to be checked when resuming
+cli_given = set()
+
+# The location and, if saveTF, the complex TF of every stacked take
+take_seqs = {}
+take_tfs = {}
+
 # Resulting averaged curves for every channel
 channels_avg= {'L':None, 'R':None}
 
+# The sound card stream kept open for the session (see useStream)
+sstream = None
+
+# Background processing of the captured takes (see useWorker)
+jobs            = queue.Queue()
+worker          = None
+worker_errors   = []
+deferred_plots  = []
+
 
 ################################################################################
 # roommeasure.py DEFAULT parameters
@@ -172,6 +269,17 @@ doBeep              = True      # Do beep warning sound before each measurement
 timer               = 0         # A timer to countdown between measurements,
                                 # without user interaction
 channels            = ['C']     # Channels to interleaving measurements.
+saveWav             = False     # Saving raw captures to be reprocessed later
+saveTF              = False     # Also the complex TFs into session.drc
+interleave          = False     # All channels in a single capture per location
+resume              = False     # Continues a broken session from its store
+useWorker           = True      # Takes are processed in a background thread
+                                # meanwhile the mic is moved to the next location
+useStream           = True      # A single full duplex stream for the session
+avgMethod           = 'mean'    # Spatial average method (see spatial_avg.py)
+avgTrim             = 0.1       # Fraction discarded at every end if 'trimmed'
+locWeights          = []        # Weights of the mic locations #0, #1, ...
+                                # in the average, 1 if not given
 
 # Results:
 folder              = f'{UHOME}/roommeas/meas'
@@ -201,7 +309,8 @@ def print_help_and_exit():
 def read_command_line():
 
     global doBeep, numMeas,  channels, Schro, timer, \
-           jackIP, jackUser, folder
+           jackIP, jackUser, folder, saveWav, interleave, useWorker, \
+           resume, saveTF, avgMethod, avgTrim, locWeights, useStream
 
     # an string of three comma separated numbers 'CAPdev,PBKdev,fs'
     optional_device = ''
@@ -225,8 +334,13 @@ def read_command_line():
                 print( __doc__ )
                 sys.exit()
 
+        elif "-mics=" in opc.lower():
+            LS.numMics = int(opc.split('=')[-1])
+            cli_given.add('numMics')
+
         elif "-m=" in opc:
             numMeas = int(opc[3:])
+            cli_given.add('numMeas')
 
         elif "-c=" in opc:
             channels = [x for x in opc[3:]]
@@ -236,6 +350,47 @@ def read_command_line():
 
         elif "-e=" in opc:
             LS.N = 2**int(opc[3:])
+            cli_given.add('N')
+
+        elif "-avg=" in opc:
+            LS.numSweeps = int(opc.split('=')[-1])
+
+        elif "-profile=" in opc.lower():
+            profiler.enable( opc.split('=')[-1] )
+
+        elif "-savewav" in opc.lower():
+            saveWav = True
+
+        elif "-spatial=" in opc.lower():
+            avgMethod = opc.split('=')[-1].lower()
+            if avgMethod not in AVG_METHODS:
+                print( f'(!) -spatial must be one of: {" | ".join(AVG_METHODS)}' )
+                opcsOK = False
+
+        elif "-trim=" in opc.lower():
+            avgTrim = float(opc.split('=')[-1])
+
+        elif "-weights=" in opc.lower():
+            locWeights = [ float(w) for w in opc.split('=')[-1].split(',') ]
+
+        elif "-savetf" in opc.lower():
+            saveTF = True
+
+        elif "-interleave" in opc.lower():
+            interleave = True
+            cli_given.add('interleaved')
+
+        elif "-resume" in opc.lower():
+            resume = True
+
+        elif "-nostream" in opc.lower():
+            useStream = False
+
+        elif "-noworker" in opc.lower():
+            useWorker = False
+
+        elif "-arena" in opc.lower():
+            LS.useArena = True
 
         elif opc[:7].lower() == '-timer=':
             timer = int( opc[7:] )
@@ -265,6 +420,8 @@ def print_info():
     print(f'fs:                 {LS.fs}')
     print(f'channels:           {channels}')
     print(f'takes per ch:       {numMeas}')
+    if LS.numMics > 1:
+        print(f'mics per capture:   {LS.numMics}')
     print(f'Schroeder freq:     {Schro}')
     print(f'sweep length (N):   {LS.N}')
 
@@ -292,6 +449,7 @@ def set_sound_card(optional_device):
         tmp = optional_device.split(",")[2].strip()
         fs = int(tmp)
         LS.fs = fs
+        cli_given.add('fs')
     except:
         pass
 
@@ -314,11 +472,22 @@ def print_console_msg(msg):
 
 def do_beep(ch='C', times=1, blocking=True):
 
-    if ch in ('C', 'L'):
+    # (i) interleaved channels, e.g. 'LR', beep as the first one
+    if sstream:
+        cue = ('R' if ch[:1] == 'R' else 'L', times)
+        if cue not in sstream.cues:
+            sstream.add_cue( cue, np.tile(beepR if cue[0] == 'R' else beepL, times) )
+        try:
+            sstream.play_cue(cue, blocking=blocking)
+            return
+        except StreamTimeout as e:
+            stream_failed(e)
+
+    if ch[:1] in ('C', 'L'):
         Nbeep = np.tile(beepL, times)
         LS.sd.play(Nbeep, samplerate=LS.fs, blocking=blocking)
 
-    elif ch in ('R'):
+    elif ch[:1] in ('R'):
         Nbeep = np.tile(beepR, times)
         LS.sd.play(Nbeep, samplerate=LS.fs, blocking=blocking)
 
@@ -380,12 +549,237 @@ def gui_prompt(ch, seq, gui_trigger, gui_msg):
     gui_msg.set(f'computing location #{seq+1}  [ {ch} ] (please wait)')
 
 
+@profiler.profiled('LS_meas')
 def LS_meas(ch, seq):
 
+    profiler.info(ch=ch, seq=seq, N=LS.N, fs=LS.fs)
+
     # Order LS to do the measurement
-    LS.do_meas()
+    if saveWav:
+        LS.capturePath = f'{folder}/{ch}_{str(seq)}'
+    do_take( [(ch, seq)] )
+
+
+@profiler.profiled('LS_meas_mics')
+def LS_meas_mics(ch, takes):
+    """ Measures a channel from LS.numMics mics at once, every mic
+        being one of the given takes (location sequence numbers)
+    """
+    profiler.info(ch=ch, seq=takes[0], mics=LS.numMics, N=LS.N, fs=LS.fs)
+
+    if saveWav:
+        LS.capturePath = f'{folder}/{ch}_{str(takes[0])}'
+    do_take( [(ch, seq) for seq in takes] )
+
+
+@profiler.profiled('LS_meas_interleaved')
+def LS_meas_interleaved(seq):
+    """ Measures all channels in a single capture of interleaved sweeps
+    """
+    profiler.info(channels=channels, seq=seq, N=LS.N, fs=LS.fs)
+
+    if saveWav:
+        LS.capturePath = f'{folder}/{"".join(channels)}_{str(seq)}'
+
+    LS.interleaved = len(channels)
+    try:
+        do_take( [(ch, seq) for ch in channels] )
+    finally:
+        LS.interleaved = 1
+
+
+def open_session_stream():
+    """ Opens the full duplex stream for the whole session, then the beeps
+        are pre-rendered and LS captures through it (see useStream).
+    """
+    global sstream
+
+    # (i) a playrec_func replaces the sound card, e.g. a synthetic DUT
+    if not useStream or LS.playrec_func:
+        return
+
+    outs = len(channels) if interleave and len(channels) > 2 else 2
+    sstream = SessionStream( LS.fs, channels=(LS.numMics + 1, outs),
+                             blocksize=LS.streamBlocksize,
+                             stream_factory=LS.stream_factory )
+    sstream.open()
+
+    for times in range(1, numMeas + 2):
+        sstream.add_cue( ('L', times), np.tile(beepL, times) )
+        sstream.add_cue( ('R', times), np.tile(beepR, times) )
+
+    LS.session_stream = sstream
+    print( f'(rm) session stream opened in {round(sstream.open_time * 1e3, 1)} ms' )
+
+
+def close_session_stream():
+
+    global sstream
+
+    if sstream:
+        LS.session_stream = None
+        sstream.close()
+        if sstream.status_log:
+            print( f'(!) {len(sstream.status_log)} stream blocks with status flags, '
+                   f'CHECK YOUR SOUND CARD' )
+        sstream = None
+
 
-    f, mag = LS.DUT_FRD
+def stream_failed(e):
+    """ The session stream stopped, so it is closed and every beep and
+        sweep will open a new stream as usual.
+    """
+    print( f'(rm) (!) {e}, going on with a new stream per beep and sweep' )
+    close_session_stream()
+
+
+def capture(background=False):
+    """ LS.do_meas(), the take is captured again by a new stream if
+        the session stream stopped meanwhile
+    """
+    try:
+        return LS.do_meas(background=background)
+    except StreamTimeout as e:
+        stream_failed(e)
+        return LS.do_meas(background=background)
+
+
+def report_capture_overhead():
+    """ The time a take spent in the sound card beyond the sweep itself,
+        i.e. the stream setup and teardown
+    """
+    if LS.captureOverhead is None:
+        return
+    ms = round(LS.captureOverhead * 1e3, 1)
+    profiler.info(capture_overhead_ms=ms)
+    print( f'(rm) capture overhead: {ms} ms '
+           f'({"session stream" if sstream else "new stream"})' )
+
+
+def do_take(labels):
+    """ Captures a take, then its resulting FRDs are saved, plotted and
+        stacked as the given (ch, seq) labels, i.e. a label per mic
+        or per interleaved channel.
+
+        If <useWorker>, only the capture is done here, the processing is
+        queued to the worker thread, so the next location can be prompted
+        meanwhile.
+    """
+    if not useWorker:
+        capture()
+        profiler.lap('do_meas')
+        report_capture_overhead()
+        if LS.measAborted:
+            print( f'(rm) (!) take {labels} aborted, not saved' )
+            return
+        save_results(LS._meas, labels)
+        return
+
+    take = capture(background=True)
+    profiler.lap('capture')
+    report_capture_overhead()
+    if take is not None:
+        worker_submit(process_take, take, labels)
+
+
+@profiler.profiled('process_take')
+def process_take(take, labels):
+    """ Worker job: processes a take, then saves its results
+    """
+    save_results( LS.process_take(take), labels )
+
+
+def save_results(meas, labels):
+    """ Saves, plots and stacks the FRD of every (ch, seq) in labels,
+        from a processed LS.Measurement
+    """
+    # (i) the last mic array capture can have more mics than remaining takes
+    FRDS = meas.DUT_FRDS if meas.DUT_FRDS else [meas.DUT_FRD]
+    TFS  = meas.DUT_TFS  if meas.DUT_TFS  else [meas.DUT_TF]
+
+    for (ch, seq), (f, mag), tf in zip(labels, FRDS, TFS):  # (i) mag is given lineal
+
+        # (i) a resumed session can repeat a partially stored capture
+        if (ch, seq) in done_takes:
+            continue
+
+        save_take(ch, seq, f, mag)
+
+        store.append( ch, seq, f, mag, N=meas.config.N, fs=meas.config.fs,
+                      numSweeps=meas.config.numSweeps, offset=meas.offset,
+                      clearance=bool(meas.TimeClearanceOK) )
+        profiler.lap('store')
+        #
+        curves['freq'] = f
+        #
+        # (i) the stack is kept by the accumulator, growing without copies
+        if seq == 0 or ch not in stats:
+            stats[ch] = RunningStats(keep=True)
+            take_seqs[ch], take_tfs[ch] = [], []
+        stats[ch].add(mag)
+        curves[ch] = stats[ch].takes
+        take_seqs[ch].append(seq)
+        # (i) the arena reuses the TF arrays
+        if saveTF:
+            take_tfs[ch].append( np.array(tf, dtype='complex64') )
+
+        # the running average spread so far, within 20 Hz ~ 20 KHz
+        if stats[ch].count > 1:
+            band = (f >= 20) & (f <= 20000)
+            spread = 20 * np.log10( stats[ch].max[band] / stats[ch].min[band] )
+            print( f'(rm) {ch} running average of {stats[ch].count} takes, '
+                   f'median spread {round(float(np.median(spread)), 1)} dB' )
+
+
+def worker_submit(func, *args):
+    """ Queues func(*args) to the processing worker thread
+    """
+    global worker
+
+    if worker is None:
+        worker = threading.Thread( target=worker_loop, daemon=True )
+        worker.start()
+
+    jobs.put( (func, args) )
+
+
+def worker_loop():
+    """ Runs the queued jobs one by one, in the queued order so that
+        the curves are stacked as measured.
+    """
+    while True:
+        func, args = jobs.get()
+        try:
+            func(*args)
+        except Exception as e:
+            worker_errors.append( f'{func.__name__}{args[-1]}: {e}' )
+            print( f'(rm) (!) processing error: {e}' )
+        finally:
+            jobs.task_done()
+
+
+def wait_processing():
+    """ Waits for the worker to process all queued takes, then does
+        the plots that were deferred to this thread.
+    """
+    if jobs.unfinished_tasks:
+        print( f'(rm) waiting for {jobs.unfinished_tasks} takes being processed ...' )
+    jobs.join()
+
+    while deferred_plots:
+        func, args = deferred_plots.pop(0)
+        func(*args)
+
+    if worker_errors:
+        print( f'(rm) (!) {len(worker_errors)} takes failed:' )
+        for err in worker_errors:
+            print( f'    {err}' )
+        worker_errors.clear()
+
+
+def save_take(ch, seq, f, mag):
+    """ Saves and plots the measured FRD of a channel at a location
+    """
     magdB = 20 * np.log10( mag )
 
     # Saving the curve to a sequenced frd filename
@@ -396,8 +790,20 @@ def LS_meas(ch, seq):
                     comments= f'roommeasure.py ch:{ch} loc:{str(seq)}',
                     verbose = False
                   )
+    profiler.lap('save_frd')
+
+    # (i) A display backend must be used from the main thread only, then
+    #     plotting is deferred up to wait_processing(). The GUI uses 'Agg'.
+    if threading.current_thread() is not threading.main_thread() and \
+       LS.matplotlib.get_backend().lower() != 'agg':
+        deferred_plots.append( (plot_take, (ch, seq, f, magdB)) )
+    else:
+        plot_take(ch, seq, f, magdB)
+    profiler.lap(f'plot_{ch}')
+
+
+def plot_take(ch, seq, f, magdB):
 
-    # Plotting
     figIdx = 10
     chs = ('L', 'R', 'C')
     if ch in chs:
@@ -405,7 +811,7 @@ def LS_meas(ch, seq):
 
     # Will choose a color by selecting the CSS4 color sequence, from black (index 7)
     c = {   'magdB': magdB,
-            'color': css4_colors[(7 + seq) % 148],
+            'color': css4_color(7 + seq),
             'label': f'{ch}_{str(seq)}'             }
 
     LS.plot_FRDs( f, (c,),  title=f'{os.path.basename(folder)} ({ch})',
@@ -413,7 +819,68 @@ def LS_meas(ch, seq):
                              png_fname=f'{folder}/{ch}.png'
                 )
 
-    return f, mag  # LS.DUT_FRD is given in lineal magnitude not dB
+
+def resume_session():
+    """ Reloads the session store from <folder>, rebuilding the running
+        statistics from the takes already measured.
+        returns: True if a session was found
+    """
+    global store, channels, numMeas, interleave
+
+    store = SessionStore(folder)
+    if not store.exists():
+        print( f'(rm) (!) no session to resume at: {folder}' )
+        return False
+
+    f, header, index, mags = store.resume()
+
+    if header.get('channels') and header['channels'] != channels:
+        print( f'(rm) the resumed session channels are: {header["channels"]}' )
+        channels = header['channels']
+
+    # The session parameters are restored from its header, so that the new
+    # takes are comparable to the stored ones, unless given otherwise.
+    current = { 'N':            LS.N,
+                'fs':           LS.fs,
+                'numMeas':      numMeas,
+                'numMics':      LS.numMics,
+                'interleaved':  interleave }
+    conflicts = []
+    for name, value in current.items():
+        if name not in header:
+            continue
+        stored = header[name]
+        # (i) -interleave has no effect on a single channel session
+        if name == 'interleaved' and len(channels) < 2:
+            continue
+        if name in cli_given and value != stored:
+            conflicts.append( f'{name}: {value} (session: {stored})' )
+    if conflicts:
+        print( f'(rm) (!) the resumed session was measured with other '
+               f'parameters: {", ".join(conflicts)}' )
+        return False
+
+    LS.N        = header.get('N',       LS.N)
+    LS.fs       = header.get('fs',      LS.fs)
+    LS.numMics  = header.get('numMics', LS.numMics)
+    numMeas     = header.get('numMeas', numMeas)
+    interleave  = header.get('interleaved', interleave)
+
+    done_takes.clear()
+    stats.clear()
+    for e, mag in zip(index, mags):
+        ch = e['ch']
+        if ch not in stats:
+            stats[ch] = RunningStats(keep=True)
+            take_seqs[ch], take_tfs[ch] = [], []
+        stats[ch].add(mag)
+        take_seqs[ch].append( e['seq'] )
+        curves[ch] = stats[ch].takes
+        done_takes.add( (ch, e['seq']) )
+    curves['freq'] = f
+
+    print( f'(rm) resuming the session: {len(index)} takes already measured' )
+    return True
 
 
 def do_meas_loop(gui_trigger=None, gui_msg=None):
@@ -421,6 +888,18 @@ def do_meas_loop(gui_trigger=None, gui_msg=None):
         Optional:
             gui_trigger:    a GUI.threading.Event flag that trigger to meas.
             gui_msg:        a GUI.label_string_variable to prompt the user.
+
+        A single sound card stream is kept open meanwhile, if useStream.
+    """
+    open_session_stream()
+    try:
+        meas_locations(gui_trigger, gui_msg)
+    finally:
+        close_session_stream()
+
+
+def meas_locations(gui_trigger=None, gui_msg=None):
+    """ The measurement loop over the mic locations and channels
     """
 
     # 'curves' is a numpy stack of measurements per channel
@@ -438,17 +917,55 @@ def do_meas_loop(gui_trigger=None, gui_msg=None):
             do_beep('R')
     sleep(.5)
 
+    # (i) a remote JACK routes a single analog input to a loudspeaker channel
+    interleaved = interleave and len(channels) > 1 and not manageJack \
+                  and LS.numMics == 1
+    if interleave and not interleaved:
+        print( '(!) -interleave needs several channels, a single mic and '
+               'no remote JACK, measuring channels one by one' )
+
+    # Every capture covers <mics> locations if a mic array is used
+    mics = LS.numMics
 
-    for seq in range(numMeas):
+    # A new session store, unless resuming one
+    global store
+    if not done_takes:
+        store = SessionStore( folder, channels=channels, numMeas=numMeas,
+                              N=LS.N, fs=LS.fs, numMics=mics,
+                              interleaved=interleaved )
+
+    for seq in range(0, numMeas, mics):
+
+        takes = list( range(seq, min(seq + mics, numMeas)) )
+
+        # (i) locations already measured in a resumed session
+        if all( [ (ch, k) in done_takes for ch in channels for k in takes ] ):
+            continue
+        locs = str(seq+1) if len(takes) == 1 else f'{seq+1}-{takes[-1]+1}'
 
         if gui_trigger:
-            gui_msg.set(f'LOCATION: {str(seq+1)} / {str(numMeas)}')
+            gui_msg.set(f'LOCATION: {locs} / {str(numMeas)}')
             sleep(1)
         else:
-            print_console_msg(f'MIC LOCATION: {str(seq+1)}/{str(numMeas)}')
+            print_console_msg(f'MIC LOCATION: {locs}/{str(numMeas)}')
+
+        if interleaved:
+
+            chs = ''.join(channels)
+            if gui_trigger:
+                gui_prompt(chs, seq, gui_trigger, gui_msg)
+            else:
+                console_prompt(chs, seq)
+
+            # DO MEASURE ALL CHANNELS AND STACK RESULTS
+            LS_meas_interleaved(seq)
+            continue
 
         for ch in channels:
 
+            if all( [ (ch, k) in done_takes for k in takes ] ):
+                continue
+
             if manageJack:
                 rjack.select_channel(ch)
                 sleep(.2)
@@ -462,18 +979,18 @@ def do_meas_loop(gui_trigger=None, gui_msg=None):
                 console_prompt(ch, seq)
 
             # DO MEASURE AND STACK RESULTS
-            f, mag = LS_meas(ch, seq)       # (i) mag is given lineal
-            #
-            curves['freq'] = f
-            #
-            if seq == 0:
-                curves[ch] = mag
+            if mics > 1:
+                LS_meas_mics(ch, takes)
             else:
-                curves[ch] = np.vstack( ( curves[ch], mag ) )
+                LS_meas(ch, seq)
 
     if manageJack:
         rjack.select_channel('')
 
+    # Memory used by the session, e.g. to compare with LS.useArena
+    arena = f', arena: {LS._meas.arena.stats()}' if LS.useArena else ''
+    print( f'(rm) session peak RSS: {LS.peak_rss_MB()} MB{arena}' )
+
     if gui_msg:
         gui_msg.set('MEASURING COMPLETED.')
         sleep(1)
@@ -481,22 +998,34 @@ def do_meas_loop(gui_trigger=None, gui_msg=None):
         print_console_msg('MEASURING COMPLETED.')
 
 
+@profiler.profiled('do_averages')
 def do_averages():
     """ Compute the average from all raw measurements,
         saving to .frd and plotting
     """
 
-    # Computing averages if more than one measurement
+    profiler.info(channels=channels, numMeas=numMeas)
+
+    # The last takes can still be processed in background
+    wait_processing()
+    profiler.lap('wait_processing')
+
+    # The plain mean of all takes is already accumulated as they were
+    # measured, any other average is computed from the kept takes.
     for ch in channels:
-        print( "Computing average of channel: " + ch )
-        if numMeas > 1:
-            # All meas average
-            channels_avg[ch] = np.average( curves[ch], axis=0 )
+        print( f'Computing {avgMethod} average of channel: {ch}' )
+        if avgMethod == 'mean' and not locWeights:
+            channels_avg[ch] = stats[ch].mean
         else:
-            channels_avg[ch] = curves[ch]
+            channels_avg[ch] = spatial_average( stats[ch].takes,
+                                                method  = avgMethod,
+                                                weights = take_weights(ch),
+                                                trim    = avgTrim )
+    profiler.lap('average')
 
     f = curves['freq']
 
+    smoothed = {}
     figIdx = 0
     for ch in channels:
 
@@ -508,19 +1037,23 @@ def do_averages():
                         mag     = avg_mag_dB,
                         fs      = LS.fs,
                         comments= f'roommeasure.py ch:{ch} raw avg' )
+        profiler.lap(f'save_frd_{ch}')
 
         # Also a progressive smoothed version of average
         print( 'Smoothing average 1/' + str(Noct) + ' oct up to ' + \
                 str(Schro) + ' Hz, then changing towards 1/1 oct at Nyq' )
 
         avg_mag_progSmooth      = smooth(f, avg_mag, Noct, f0=Schro)
+        smoothed[ch]            = avg_mag_progSmooth
         avg_mag_progSmooth_dB   = 20 * np.log10(avg_mag_progSmooth)
+        profiler.lap(f'smoothing_{ch}')
 
         tools.saveFRD(  fname   = f'{folder}/{ch}_avg_smoothed.frd',
                         freq    = f,
                         mag     = avg_mag_progSmooth_dB,
                         fs      = LS.fs,
                         comments= f'roommeasure.py ch:{ch} smoothed avg' )
+        profiler.lap(f'save_smoothed_frd_{ch}')
 
         # Prepare the average curve ...
         c1 = {  'magdB': avg_mag_dB,
@@ -538,6 +1071,49 @@ def do_averages():
 
         figIdx += 1
 
+    save_session_file(smoothed)
+    profiler.lap('session_file')
+
+
+def take_weights(ch):
+    """ The weight of every stacked take of the channel, from the weight
+        of its mic location, or None if no weights were given
+    """
+    if not locWeights:
+        return None
+    return [ locWeights[seq] if seq < len(locWeights) else 1.0
+             for seq in take_seqs[ch] ]
+
+
+def save_session_file(smoothed):
+    """ Saves the freq vector, every take, the averages and the session
+        parameters into a single 'session.drc' file (see session_file.py)
+    """
+    arrays = { 'freq': curves['freq'] }
+
+    for ch in channels:
+        arrays[f'takes/{ch}']           = stats[ch].takes
+        arrays[f'seq/{ch}']             = np.array( take_seqs[ch] )
+        arrays[f'avg/{ch}']             = channels_avg[ch]
+        arrays[f'avg_smoothed/{ch}']    = smoothed[ch]
+        # (i) the TFs of a resumed session are not available
+        if saveTF and len(take_tfs[ch]) == stats[ch].count:
+            arrays[f'tf/{ch}'] = np.array( take_tfs[ch] )
+
+    meta = { 'channels':     channels,
+             'N':            LS.N,
+             'fs':           LS.fs,
+             'numSweeps':    LS.numSweeps,
+             'Schro':        Schro,
+             'Noct':         Noct,
+             'avgMethod':    avgMethod,
+             'avgTrim':      avgTrim,
+             'locWeights':   locWeights,
+             'date':         datetime.now().isoformat(timespec='seconds') }
+
+    write_session( f'{folder}/session.drc', arrays, meta )
+    print( f'(rm) session saved to: {folder}/session.drc' )
+
 
 def connect_to_remote_JACK(jackIP, jackUser, pwd=None):
 
@@ -589,8 +1165,11 @@ if __name__ == "__main__":
     #   - doBeep, numMeas, channels, Schro, timer, jackIP, jackUser
     read_command_line()
 
-    # - Prepare output FRD folder:
-    if not prepare_frd_folder():
+    # - Prepare output FRD folder, or reload the session to be resumed:
+    if resume:
+        if not resume_session():
+            sys.exit(1)
+    elif not prepare_frd_folder():
         print_console_msg('Please check your folders tree')
         sys.exit()
 
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Per bin running statistics of a stream of FRD magnitudes, e.g. the
+    takes from every mic location, updated at O(1) cost per take:
+
+        count, mean, pmean (mean of squares), var / std, min, max
+
+    and a median estimate by the P-square algorithm (Jain & Chlamtac, 1985),
+    exact up to 5 takes, without keeping the takes.
+
+    Optionally the takes are also kept (keep=True) in a buffer that grows
+    by doubling, so appending a take doesn't copy the whole stack.
+
+    Usage in a module:
+
+        from running_stats import RunningStats
+        stats = RunningStats()
+
+        for mag in takes:
+            stats.add(mag)
+            print( stats.count, stats.mean, stats.std )
+"""
+
+import numpy as np
+
+
+class RunningStats(object):
+
+    # P-square markers desired positions increments, for the median (p = 0.5)
+    _dn = np.array( [0.0, 0.25, 0.5, 0.75, 1.0] )[:, None]
+
+
+    def __init__(self, keep=False):
+
+        self.keep       = keep
+        self.count      = 0
+        self.mean       = None
+        self.pmean      = None          # mean power, i.e. the mean of squares
+        self.min        = None
+        self.max        = None
+        self._M2        = None          # Welford's sum of squared deviations
+
+        self._q         = None          # P-square marker heights  (5, bins)
+        self._n         = None          # marker positions         (5, bins)
+        self._np        = None          # marker desired positions (5, bins)
+
+        self._takes     = None
+        self._first     = []            # the first 5 takes, to init P-square
+
+
+    def add(self, x):
+        """ Accumulates a take, a vector of magnitudes
+        """
+        x = np.asarray(x, dtype='float64')
+
+        self.count += 1
+        k = self.count
+
+        if k == 1:
+            self.mean   = x.copy()
+            self.pmean  = x**2
+            self.min    = x.copy()
+            self.max    = x.copy()
+            self._M2    = np.zeros_like(x)
+        else:
+            delta       = x - self.mean
+            self.mean  += delta / k
+            self._M2   += delta * (x - self.mean)
+            self.pmean += (x**2 - self.pmean) / k
+            np.minimum(self.min, x, out=self.min)
+            np.maximum(self.max, x, out=self.max)
+
+        if k <= 5:
+            self._first.append( x.copy() )
+            if k == 5:
+                self._psquare_init()
+        else:
+            self._psquare_add(x)
+
+        if self.keep:
+            self._keep(x)
+
+
+    @property
+    def var(self):
+        """ Population variance (ddof=0, as numpy var)
+        """
+        if not self.count:
+            return None
+        return self._M2 / self.count
+
+
+    @property
+    def std(self):
+        if not self.count:
+            return None
+        return np.sqrt(self.var)
+
+
+    @property
+    def rms(self):
+        """ The power average, i.e. the square root of the mean power
+        """
+        if not self.count:
+            return None
+        return np.sqrt(self.pmean)
+
+
+    @property
+    def median(self):
+        """ Exact up to 5 takes, then the P-square estimate
+        """
+        if not self.count:
+            return None
+        if self.count <= 5:
+            return np.median( np.array(self._first), axis=0 )
+        return self._q[2].copy()
+
+
+    @property
+    def takes(self):
+        """ The (count, bins) stack of kept takes, None if not keep
+        """
+        if self._takes is None:
+            return None
+        return self._takes[ : self.count]
+
+
+    def _keep(self, x):
+        if self._takes is None:
+            self._takes = np.empty( (8, len(x)) )
+        elif self.count > len(self._takes):
+            grown = np.empty( (2 * len(self._takes), self._takes.shape[1]) )
+            grown[ : len(self._takes)] = self._takes
+            self._takes = grown
+        self._takes[self.count - 1] = x
+
+
+    def _psquare_init(self):
+
+        self._q  = np.sort( np.array(self._first), axis=0 )
+        bins     = self._q.shape[1]
+        self._n  = np.tile( np.arange(1.0, 6.0)[:, None], (1, bins) )
+        self._np = np.tile( np.array( [1.0, 2.0, 3.0, 4.0, 5.0] )[:, None],
+                            (1, bins) )
+
+
+    def _psquare_add(self, x):
+
+        q, n, np_ = self._q, self._n, self._np
+
+        # the cell k the take falls into, extreme markers are updated
+        k = np.minimum( (x >= q[1:]).sum(axis=0), 3 )
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+
+        # markers above the cell move one position up
+        n   += np.arange(5)[:, None] > k
+        np_ += self._dn
+
+        # adjusting the middle markers heights
+        for i in (1, 2, 3):
+
+            d = np_[i] - n[i]
+            move = ( (d >=  1) & (n[i+1] - n[i] >  1) ) | \
+                   ( (d <= -1) & (n[i-1] - n[i] < -1) )
+            if not move.any():
+                continue
+
+            s = np.sign(d)
+
+            # piecewise parabolic prediction
+            qp = q[i] + s / (n[i+1] - n[i-1]) * \
+                        ( (n[i] - n[i-1] + s) * (q[i+1] - q[i]) / (n[i+1] - n[i]) +
+                          (n[i+1] - n[i] - s) * (q[i] - q[i-1]) / (n[i] - n[i-1]) )
+
+            # or linear if the parabolic one is out of order
+            j  = np.where(s > 0, i + 1, i - 1)
+            cols = np.arange(q.shape[1])
+            ql = q[i] + s * (q[j, cols] - q[i]) / (n[j, cols] - n[i])
+
+            ok = (q[i-1] < qp) & (qp < q[i+1])
+            q[i] = np.where( move, np.where(ok, qp, ql), q[i] )
+            n[i] = np.where( move, n[i] + s, n[i] )
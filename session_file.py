@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    A single file container for a whole measurement session, 'session.drc',
+    holding named arrays plus metadata. The arrays are memory mapped when
+    reading, so opening the file doesn't read nor parse the data.
+
+    File layout:
+
+        b'DRCSESS1'                 magic
+        uint64 little endian        header length in bytes
+        JSON header                 {"meta": {...},
+                                     "arrays": {name: {"dtype", "shape", "offset"}}}
+        raw arrays                  C order, every one 64 bytes aligned
+
+    Arrays written by roommeasure.py (mags are linear, not dB):
+
+        freq                        the shared freq vector (points,)
+        takes/CH                    a magnitude row per take (takes, points)
+        seq/CH                      the mic location of every take row
+        avg/CH                      the average (as CH_avg.frd)
+        avg_smoothed/CH             (as CH_avg_smoothed.frd)
+        tf/CH                       optional complex TFs (takes, bins)
+
+    Usage in a module:
+
+        from session_file import SessionFile, write_session
+
+        write_session(path, {'freq': f, 'avg/L': mag}, meta={'fs': 48000})
+
+        sf = SessionFile(path)
+        mag = sf['avg/L']           # a read only memory mapped array
+        f, mag = sf.frd('L_avg')    # same, by its .frd file name
+
+    Usage:      session_file.py  path/session.drc
+
+        Prints the metadata and the arrays of a session file.
+"""
+
+import sys
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'DRCSESS1'
+ALIGN = 64
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_session(path, arrays, meta=None):
+    """ Writes the given {name: array} and the meta dict to <path>
+    """
+    arrays = { name: np.ascontiguousarray(a) for name, a in arrays.items() }
+
+    # The header size depends on the offsets, so they are computed relative
+    # to the data start, then the header is padded to an aligned size.
+    table, pos = {}, 0
+    for name, a in arrays.items():
+        table[name] = { 'dtype': a.dtype.str, 'shape': list(a.shape),
+                        'offset': pos }
+        pos = _align(pos + a.nbytes)
+
+    def header_bytes(start):
+        tab = { name: { **t, 'offset': t['offset'] + start }
+                for name, t in table.items() }
+        return json.dumps( {'meta': meta or {}, 'arrays': tab},
+                           default=str ).encode()
+
+    # (i) a wider start offset could need more digits, so iterate until stable
+    start = _align( len(MAGIC) + 8 + len(header_bytes(0)) )
+    while True:
+        hdr = header_bytes(start)
+        new = _align( len(MAGIC) + 8 + len(hdr) )
+        if new <= start:
+            break
+        start = new
+
+    with open(path, 'wb') as f:
+        f.write( MAGIC )
+        f.write( struct.pack('<Q', len(hdr)) )
+        f.write( hdr )
+        for name, a in arrays.items():
+            f.seek( table[name]['offset'] + start )
+            f.write( a.tobytes() )
+
+
+class SessionFile(object):
+    """ A session file opened for reading, its arrays are memory mapped
+        on request, e.g. sf['takes/L'], without copying the file data.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError( f'not a session file: {path}' )
+            size, = struct.unpack( '<Q', f.read(8) )
+            header = json.loads( f.read(size) )
+
+        self.meta   = header['meta']
+        self.arrays = header['arrays']
+        self._mm    = None
+
+
+    def names(self):
+        return list(self.arrays)
+
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+
+    def __getitem__(self, name):
+
+        if name not in self.arrays:
+            raise KeyError( f'{name} not in {self.path}' )
+
+        if self._mm is None:
+            self._mm = np.memmap(self.path, dtype='uint8', mode='r')
+
+        t     = self.arrays[name]
+        dtype = np.dtype(t['dtype'])
+        count = int( np.prod(t['shape']) )
+        return np.frombuffer( self._mm, dtype=dtype, count=count,
+                              offset=t['offset'] ).reshape(t['shape'])
+
+
+    def channels(self):
+        """ The channels having an average
+        """
+        return [ name.split('/')[1] for name in self.arrays
+                 if name.startswith('avg/') ]
+
+
+    def frd(self, item):
+        """ An FRD by the name of its .frd file counterpart, i.e.
+            'CH_avg', 'CH_avg_smoothed' or 'CH_N' (the take at location N)
+
+            returns: freq, mag (linear, memory mapped)
+        """
+        ch, _, what = item.partition('_')
+
+        if what in ('avg', 'avg_smoothed'):
+            return self['freq'], self[f'{what}/{ch}']
+
+        if what.isdigit() and f'seq/{ch}' in self:
+            rows = np.flatnonzero( self[f'seq/{ch}'] == int(what) )
+            if len(rows):
+                return self['freq'], self[f'takes/{ch}'][rows[-1]]
+
+        raise KeyError( f'{item} not in {self.path}' )
+
+
+if __name__ == '__main__':
+
+    if not sys.argv[1:] or sys.argv[1][0] == '-':
+        print( __doc__ )
+        sys.exit()
+
+    sf = SessionFile( sys.argv[1] )
+    for key, value in sf.meta.items():
+        print( f'    {key:<16} {value}' )
+    for name, t in sf.arrays.items():
+        print( f'    {name:<24} {t["dtype"]:<6} {tuple(t["shape"])}' )
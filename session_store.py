@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    An append only store of the measured takes of a roommeasure session,
+    so that a broken session can be resumed.
+
+    Two files in the session folder:
+
+        session.bin     float64 rows: the freq vector, then a magnitude
+                        row per take, in the order they were measured.
+
+        session.idx     JSON lines: a header, then a line per take having
+                        its channel, location, row, date and parameters.
+
+    Every take is written to disk (fsync) before the next one, the data row
+    first, so the index only refers to complete rows. A crash can leave at
+    most a trailing row or line, they are discarded when loading.
+
+    Usage in a module:
+
+        from session_store import SessionStore
+
+        store = SessionStore(folder, channels=['L', 'R'])  # header info
+        store.append('L', 0, f, mag, N=N, fs=fs)
+        ...
+        f, header, index, mags = store.load()  # mags[i] is the take index[i]
+
+    Usage:      session_store.py  folder
+
+        Prints the session takes.
+"""
+
+import os
+import sys
+import json
+import threading
+from datetime import datetime
+
+import numpy as np
+
+VERSION = 1
+
+
+class SessionStore(object):
+
+    def __init__(self, folder, name='session', **info):
+
+        self.bin_path   = f'{folder}/{name}.bin'
+        self.idx_path   = f'{folder}/{name}.idx'
+        self.info       = info          # for the header of a new session
+        self.points     = 0
+        self.rows       = 0             # freq row + takes
+        self._lock      = threading.Lock()
+
+
+    def exists(self):
+        return os.path.isfile(self.idx_path) and os.path.isfile(self.bin_path)
+
+
+    @staticmethod
+    def _write(f, data):
+        f.write(data)
+        f.flush()
+        os.fsync( f.fileno() )
+
+
+    def create(self, freq, **info):
+        """ Starts a new session, any previous one is discarded
+        """
+        info = { **self.info, **info }
+        freq = np.asarray(freq, dtype='float64')
+        with self._lock:
+            header = { 'session': VERSION, 'points': len(freq),
+                       'created': datetime.now().isoformat(timespec='seconds'),
+                       **info }
+            with open(self.bin_path, 'wb') as f:
+                self._write( f, freq.tobytes() )
+            with open(self.idx_path, 'w') as f:
+                self._write( f, json.dumps(header, default=str) + '\n' )
+            self.points = len(freq)
+            self.rows   = 1
+
+
+    def append(self, ch, seq, freq, mag, **info):
+        """ Appends a take, the session is created on the first one
+        """
+        if not self.rows:
+            self.create(freq)
+
+        mag = np.asarray(mag, dtype='float64')
+        if len(mag) != self.points:
+            raise ValueError( f'take having {len(mag)} points, '
+                              f'session has {self.points}' )
+
+        with self._lock:
+            entry = { 'ch': ch, 'seq': seq, 'row': self.rows,
+                      'date': datetime.now().isoformat(timespec='seconds'),
+                      **info }
+            with open(self.bin_path, 'ab') as f:
+                self._write( f, mag.tobytes() )
+            with open(self.idx_path, 'a') as f:
+                self._write( f, json.dumps(entry, default=str) + '\n' )
+            self.rows += 1
+
+
+    def load(self):
+        """ Reads the session, discarding any incomplete trailing take.
+
+            returns: freq, header, index, mags
+
+                index:  the list of take entries
+                mags:   (takes, points) array, a row per index entry
+        """
+        with self._lock:
+
+            with open(self.idx_path, 'r') as f:
+                lines = f.read().split('\n')
+
+            header = json.loads(lines[0])
+            index = []
+            for line in lines[1:]:
+                try:
+                    index.append( json.loads(line) )
+                except ValueError:
+                    break
+
+            P = header['points']
+            data = np.fromfile(self.bin_path, dtype='float64')
+            rows = len(data) // P
+            data = data[ : rows * P].reshape(rows, P)
+
+            # (i) the index only refers to rows written before it
+            index = [ e for e in index if e['row'] < rows ]
+
+            self.points = P
+            self.rows   = len(index) + 1
+
+        return data[0], header, index, data[ [e['row'] for e in index] ]
+
+
+    def resume(self):
+        """ Loads the session, then drops any incomplete trailing take from
+            the files, so that the next takes are appended after the last
+            complete one.
+
+            returns: same as load()
+        """
+        freq, header, index, mags = self.load()
+
+        with self._lock:
+            with open(self.bin_path, 'r+b') as f:
+                f.truncate( self.rows * self.points * 8 )
+            tmp = f'{self.idx_path}.tmp'
+            with open(tmp, 'w') as f:
+                f.write( '\n'.join( [ json.dumps(e, default=str)
+                                      for e in [header] + index ] ) + '\n' )
+            os.replace(tmp, self.idx_path)
+
+        return freq, header, index, mags
+
+
+if __name__ == '__main__':
+
+    if not sys.argv[1:] or sys.argv[1][0] == '-':
+        print( __doc__ )
+        sys.exit()
+
+    store = SessionStore( sys.argv[1] )
+    if not store.exists():
+        print( f'(session_store) no session found at {sys.argv[1]}' )
+        sys.exit()
+
+    freq, header, index, mags = store.load()
+    print( f'session created {header["created"]}, {len(index)} takes, '
+           f'{header["points"]} freq points' )
+    for e, mag in zip(index, mags):
+        maxdB = round( float( 20 * np.log10( np.max(mag) ) ), 1 )
+        print( f'    {e["ch"]}_{e["seq"]:<6} {e["date"]}  max: {maxdB:>6} dB' )
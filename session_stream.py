@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    A single full duplex stream kept open for a whole measurement session,
+    instead of opening a new sound card stream for every beep and sweep.
+
+    The stream plays silence until something is scheduled. Pre-rendered
+    cues (e.g. the beeps) and sweeps are queued, then played back to back
+    from the block boundary following the request, so a sweep starts at
+    most one block after it was asked for. While a sweep plays, the input
+    blocks are copied into its capture array.
+
+    If a scheduled job is not played in time (e.g. the sound card stopped
+    calling back), waiting for it closes the stream and raises StreamTimeout.
+
+    Usage in a module:
+
+        from session_stream import SessionStream
+
+        with SessionStream(fs, channels=(3, 2)) as ss:    # (inputs, outputs)
+            ss.add_cue('beep', beep)
+            ss.play_cue('beep')
+            z = ss.playrec(sweep)   # a sounddevice.playrec() look-alike
+
+    Usage:      session_stream.py
+
+        Runs a demo session through by a duplex_capture.FakeStream
+"""
+
+import sys
+import queue
+import threading
+from time import perf_counter
+import numpy as np
+
+
+class StreamTimeout(RuntimeError):
+    """ A scheduled job was not played in time, the stream was closed
+    """
+    pass
+
+
+class SessionStream(object):
+    """ fs:             sample rate
+        channels:       (inputs, outputs)
+        blocksize:      frames per stream callback
+        stream_factory: a sounddevice.Stream alike class or function,
+                        by default sounddevice.Stream
+        cue_tail:       seconds of silence rendered after every cue, so that
+                        its latency and echoes are gone before a next sweep
+        timeout_margin: seconds to wait for a job beyond its own length and
+                        the length of the jobs scheduled before it
+    """
+
+    def __init__(self, fs, channels=(2, 2), blocksize=1024,
+                       stream_factory=None, device=None, cue_tail=0.1,
+                       timeout_margin=2.0):
+
+        self.fs         = fs
+        self.ins, self.outs = channels
+        self.blocksize  = blocksize
+        self.device     = device
+        self.cue_tail   = int(cue_tail * fs)
+        self.timeout_margin = timeout_margin
+
+        if stream_factory is None:
+            import sounddevice as sd
+            stream_factory = sd.Stream
+        self.stream_factory = stream_factory
+
+        self.cues       = {}
+        self.status_log = []        # (frame_position, flags) for blocks having status flags
+        self.start_delay= None      # seconds from the last request to its first block
+        self.open_time  = None      # seconds to open and start the stream
+
+        self._stream    = None
+        self._jobs      = queue.Queue()
+        self._job       = None      # the job being played
+        self._frames    = 0         # total frames since the stream was opened
+
+
+    def open(self):
+
+        if self._stream is not None:
+            return
+
+        kwargs = dict( samplerate=self.fs, blocksize=self.blocksize,
+                       channels=(self.ins, self.outs), dtype='float32',
+                       callback=self._callback )
+        if self.device is not None:
+            kwargs['device'] = self.device
+
+        t0 = perf_counter()
+        self._stream = self.stream_factory(**kwargs)
+        self._stream.start()
+        self.open_time = perf_counter() - t0
+
+
+    def close(self):
+
+        if self._stream is None:
+            return
+        self._stream.stop()
+        self._stream.close()
+        self._stream = None
+
+        # (i) anyone still waiting is released
+        while True:
+            job = self._job or self._next_job()
+            if job is None:
+                break
+            job['done'].set()
+            self._job = None
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _next_job(self):
+        try:
+            return self._jobs.get_nowait()
+        except queue.Empty:
+            return None
+
+
+    def _callback(self, indata, outdata, frames, time, status):
+        """ (i) This runs in the audio thread, keep it light.
+        """
+        if status:
+            self.status_log.append( (self._frames, str(status)) )
+        self._frames += frames
+
+        job = self._job
+        if job is None:
+            job = self._job = self._next_job()
+            if job is not None:
+                job['started'] = perf_counter()
+
+        if job is None:
+            outdata[:] = 0
+            return
+
+        i, data, rec = job['pos'], job['data'], job['rec']
+        n = min(frames, len(data) - i)
+        outdata[:n] = data[i : i+n]
+        outdata[n:] = 0
+        if rec is not None:
+            rec[i : i+n] = indata[:n, : rec.shape[1]]
+        job['pos'] += n
+
+        if job['pos'] >= len(data):
+            self._job = None
+            job['done'].set()
+
+
+    def _render(self, data, tail=0):
+        """ A (frames, outs) float32 array to be played, from a mono signal
+            (first output only, as sounddevice.play does) or having a
+            channel per column, then <tail> frames of silence.
+        """
+        data = np.asarray(data, dtype='float32')
+        if data.ndim == 1:
+            data = data[:, None]
+        if data.shape[1] > self.outs:
+            raise ValueError( f'{data.shape[1]} channels to play, '
+                              f'the stream has {self.outs} outputs' )
+        out = np.zeros( (len(data) + tail, self.outs), dtype='float32' )
+        out[ : len(data), : data.shape[1]] = data
+        return out
+
+
+    def schedule(self, data, rec=None, rendered=False):
+        """ Queues <data> to be played after anything already scheduled,
+            capturing into <rec> if given.
+
+            returns: the job, to be waited for by wait()
+        """
+        if self._stream is None:
+            raise RuntimeError( 'the session stream is not open' )
+        data = data if rendered else self._render(data)
+
+        # the frames still to be played before this job
+        with self._jobs.mutex:
+            ahead = sum( [ len(j['data']) for j in self._jobs.queue ] )
+        current = self._job
+        if current is not None:
+            ahead += len(current['data']) - current['pos']
+
+        job = { 'data':     data,
+                'rec':      rec,
+                'pos':      0,
+                'asked':    perf_counter(),
+                'started':  None,
+                'timeout':  (ahead + len(data)) / self.fs + self.timeout_margin,
+                'done':     threading.Event() }
+        self._jobs.put(job)
+        return job
+
+
+    def wait(self, job, timeout=None):
+        """ Waits for a scheduled job to be played, then updates start_delay.
+
+            timeout:    seconds, by default the job and those before it
+                        to be played, plus <timeout_margin>
+
+            If the job is not played in time, the stream is closed and
+            StreamTimeout is raised.
+        """
+        if timeout is None:
+            timeout = job['timeout']
+        if not job['done'].wait(timeout):
+            played = job['pos']
+            self.close()
+            raise StreamTimeout( f'the session stream stopped, {played} of '
+                                 f'{len(job["data"])} frames played in '
+                                 f'{round(timeout, 1)} s' )
+        if job['started'] is not None:
+            self.start_delay = job['started'] - job['asked']
+        return True
+
+
+    def add_cue(self, name, data):
+        """ Pre-renders a cue to be played later by play_cue()
+        """
+        self.cues[name] = self._render(data, tail=self.cue_tail)
+
+
+    def play_cue(self, name, blocking=True):
+        job = self.schedule(self.cues[name], rendered=True)
+        if blocking:
+            self.wait(job)
+        return job
+
+
+    def play(self, data, blocking=True):
+        """ A sounddevice.play() look-alike
+        """
+        job = self.schedule(data)
+        if blocking:
+            self.wait(job)
+        return job
+
+
+    def playrec(self, data, samplerate=None, channels=None, blocking=True,
+                      out=None, **kwargs):
+        """ A sounddevice.playrec() look-alike, plays <data> (having a channel
+            per column) and returns the captured (frames, channels) array.
+
+            out:    an optional array to capture into
+        """
+        channels = channels or self.ins
+        if samplerate and samplerate != self.fs:
+            raise ValueError( f'fs {samplerate} differs from the stream fs {self.fs}' )
+        if channels > self.ins:
+            raise ValueError( f'{channels} channels to capture, '
+                              f'the stream has {self.ins} inputs' )
+
+        if out is None:
+            out = np.zeros( (len(data), channels), dtype='float32' )
+        else:
+            out[:] = 0.0
+
+        job = self.schedule(data, rec=out)
+        if blocking:
+            self.wait(job)
+        return out
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1:]:
+        print( __doc__ )
+        sys.exit()
+
+    from functools import partial
+    from duplex_capture import FakeStream
+
+    fs      = 48000
+    latency = 1500
+    beep    = np.sin( 2 * np.pi * 880 * np.arange(fs // 20) / fs ) / 2
+    x       = np.random.uniform(-.5, .5, size=(fs, 2)).astype('float32')
+    x[-latency:] = 0
+
+    print( f'--- Fake loopback session, latency {latency}' )
+    with SessionStream( fs, stream_factory=partial(FakeStream, latency=latency,
+                                                   speed=10) ) as ss:
+        ss.add_cue('beep', beep)
+        for take in range(3):
+            ss.play_cue('beep')
+            z = ss.playrec(x)
+            ok = np.array_equal( z[latency:], x[ : -latency] )
+            print( f'    take {take}: loopback matches the played signal: {ok}, '
+                   f'sweep start delay {round(ss.start_delay * 1e3, 2)} ms' )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    Spatial averaging of the FRD magnitudes measured at several mic
+    locations, a (takes, points) array of linear magnitudes.
+
+    Methods:
+
+        mean        arithmetic mean of the linear magnitudes (the former
+                    roommeasure average)
+        rms         power average, the square root of the mean power
+        db          mean of the dB magnitudes
+        trimmed     mean after discarding, at every freq point, the <trim>
+                    fraction of the lowest and of the highest takes
+                    (unweighted where the kept takes weigh zero)
+        median      median at every freq point
+
+    Every method accepts per take weights, e.g. to down-weight locations
+    close to the room boundaries. A weighted median is the lowest value
+    whose cumulative weight reaches half of the total weight.
+
+    Usage in a module:
+
+        from spatial_avg import spatial_average
+        avg = spatial_average(takes, 'rms', weights=[1, 1, 0.5])
+"""
+
+import numpy as np
+
+METHODS = ('mean', 'rms', 'db', 'trimmed', 'median')
+
+
+def spatial_average(takes, method='mean', weights=None, trim=0.1):
+    """ takes:      (takes, points) linear magnitudes
+        method:     see METHODS
+        weights:    optional per take weights
+        trim:       the fraction to discard at every end, for 'trimmed'
+
+        returns:    the (points,) linear average
+    """
+    takes = np.asarray(takes, dtype='float64')
+    if takes.ndim == 1:
+        return takes.copy()
+
+    n = len(takes)
+    if weights is None:
+        w = np.ones(n)
+    else:
+        w = np.asarray(weights, dtype='float64')
+        if len(w) != n:
+            raise ValueError( f'{len(w)} weights for {n} takes' )
+        if np.sum(w) <= 0:
+            raise ValueError( 'the weights sum must be positive' )
+
+    if method == 'mean':
+        return np.average(takes, axis=0, weights=w)
+
+    if method == 'rms':
+        return np.sqrt( np.average(takes**2, axis=0, weights=w) )
+
+    if method == 'db':
+        return 10 ** ( np.average( 20 * np.log10(takes), axis=0, weights=w ) / 20 )
+
+    if method == 'median' and weights is None:
+        return np.median(takes, axis=0)
+
+    if method in ('trimmed', 'median'):
+
+        # sorting every freq point (column) along with the take weights
+        order = np.argsort(takes, axis=0)
+        x  = np.take_along_axis(takes, order, axis=0)
+        ws = w[order]
+
+        if method == 'trimmed':
+            k = int( trim * n )
+            if 2 * k >= n:
+                raise ValueError( f'trim {trim} leaves no takes out of {n}' )
+            x, ws = x[k : n - k], ws[k : n - k]
+            # (i) the kept takes at a freq point may all have zero weight,
+            #     then their unweighted mean is used there
+            wsum = np.sum(ws, axis=0)
+            zero = wsum <= 0
+            ws[:, zero] = 1.0
+            wsum[zero]  = ws.shape[0]
+            return np.sum(x * ws, axis=0) / wsum
+
+        # weighted median
+        cum = np.cumsum(ws, axis=0)
+        idx = np.argmax( cum >= cum[-1] / 2, axis=0 )
+        return np.take_along_axis(x, idx[None, :], axis=0)[0]
+
+    raise ValueError( f'unknown spatial average method: {method}' )
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    A persistent on-disk cache for the arrays prepared by logsweep2TF,
+    so that the sweep synthesis is paid only once per set of parameters.
+
+    Every cache entry is a folder holding one .npy file per array,
+    which are loaded back as read only memory mapped arrays.
+
+    The cache is size bounded, the least recently used entries are evicted.
+
+    Usage:      sweep_cache.py  [ -clear ]
+
+        Prints the cache contents, or clears it.
+"""
+
+import os
+import sys
+import shutil
+import numpy as np
+
+UHOME = os.path.expanduser("~")
+
+
+class SweepCache(object):
+
+    def __init__(self, folder=f'{UHOME}/.cache/DRC/sweeps', max_MB=1024):
+
+        self.folder = folder
+        self.max_MB = max_MB
+        self.hits   = 0
+        self.misses = 0
+
+
+    def _entry_path(self, key):
+        """ key: a tuple of parameters, e.g. (N, fs, f_start, ...)
+        """
+        name = '_'.join( [str(x) for x in key] ).replace('/', '-')
+        return f'{self.folder}/{name}'
+
+
+    def get(self, key):
+        """ Returns a dictionary of memory mapped arrays, or None if not cached
+        """
+        path = self._entry_path(key)
+
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+
+        try:
+            arrays = {}
+            for fname in os.listdir(path):
+                if fname[-4:] == '.npy':
+                    arrays[fname[:-4]] = np.load(f'{path}/{fname}', mmap_mode='r')
+            # touching the entry as recently used
+            os.utime(path)
+
+        except Exception as e:
+            print( f'(sweep_cache) bad entry {os.path.basename(path)}: {e}' )
+            shutil.rmtree(path, ignore_errors=True)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return arrays
+
+
+    def put(self, key, **arrays):
+        """ Stores the given arrays under key, then evicts old entries if needed
+        """
+        path = self._entry_path(key)
+        tmp  = f'{path}.{os.getpid()}.tmp'
+
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            for name, arr in arrays.items():
+                np.save(f'{tmp}/{name}.npy', arr)
+            # (i) renaming makes the new entry visible atomically
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp, path)
+
+        except Exception as e:
+            print( f'(sweep_cache) unable to store {os.path.basename(path)}: {e}' )
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self.evict(keep=path)
+
+
+    def entries(self):
+        """ A list of (path, size_bytes, mtime), least recently used first
+        """
+        result = []
+
+        if not os.path.isdir(self.folder):
+            return result
+
+        for name in os.listdir(self.folder):
+            path = f'{self.folder}/{name}'
+            if not os.path.isdir(path) or name[-4:] == '.tmp':
+                continue
+            size = sum( [ os.path.getsize(f'{path}/{f}') for f in os.listdir(path) ] )
+            result.append( (path, size, os.path.getmtime(path)) )
+
+        result.sort(key=lambda x: x[2])
+        return result
+
+
+    def size_MB(self):
+        return sum( [ x[1] for x in self.entries() ] ) / 2**20
+
+
+    def evict(self, keep=''):
+        """ Removes the least recently used entries until the cache size
+            fits into max_MB. The <keep> entry is never removed.
+        """
+        entries = self.entries()
+        total   = sum( [ x[1] for x in entries ] )
+
+        for path, size, _ in entries:
+            if total <= self.max_MB * 2**20:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            print( f'(sweep_cache) evicted {os.path.basename(path)}' )
+
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+    def stats(self):
+        return f'hits: {self.hits}  misses: {self.misses}  ' \
+               f'size: {round(self.size_MB(), 1)}/{self.max_MB} MB'
+
+
+if __name__ == '__main__':
+
+    cache = SweepCache()
+
+    if sys.argv[1:] and sys.argv[1] == '-clear':
+        cache.clear()
+        print( f'(sweep_cache) cleared {cache.folder}' )
+        sys.exit()
+
+    elif sys.argv[1:]:
+        print( __doc__ )
+        sys.exit()
+
+    for path, size, _ in cache.entries():
+        print( f'{round(size / 2**20, 1):>8} MB  {os.path.basename(path)}' )
+    print( f'total {round(cache.size_MB(), 1)} MB at {cache.folder}' )
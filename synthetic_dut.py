@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019 Rafael Sánchez
+# This file is part of 'Rsantct.DRC', yet another DRC FIR toolkit.
+#
+# 'Rsantct.DRC' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# 'Rsantct.DRC' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with 'Rsantct.DRC'.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+    A synthetic Device Under Test, so that logsweep2TF.do_meas() can run
+    without a sound card, e.g. for benchmarks and regression checks.
+
+    SyntheticDUT.playrec() is a sounddevice.playrec() look-alike, wired as
+    described in logsweep2TF.py:
+
+        out L --> room impulse response + noise --> in L    (DUT)
+        out R -------------------------- + noise --> in R    (REF)
+
+    both inputs delayed by the same play/rec latency, and optionally having
+    some dropouts (lost blocks captured as silence).
+
+    If a list of impulse responses is given, every output channel feeds its
+    own loudspeaker, all of them summed at the mic (in L), e.g. to measure
+    interleaved sweeps. Then there is no REF loop.
+
+    If a list of mic impulse responses is given (mic_rirs), the DUT is
+    captured by every mic on inputs 1 ... M, then REF on input M+1.
+
+    The known impulse response provides the ground truth to check the
+    measured FRD against (see truth_FRD).
+
+    Usage in a module:
+
+        import logsweep2TF as LS
+        from synthetic_dut import SyntheticDUT
+
+        dut = SyntheticDUT( LS.fs, rir=room_ir(LS.fs, 0.3), latency=480 )
+        LS.playrec_func = dut.playrec
+        LS.do_meas()
+
+    Usage:      synthetic_dut.py
+
+        Runs a demo measurement on a synthetic room.
+"""
+
+import numpy as np
+
+import lazyimport
+sp_signal = lazyimport.load('scipy.signal')
+
+
+def room_ir(fs, rt60=0.3, length=0, reflections=6, drr_dB=6.0, seed=0):
+    """ A synthetic room impulse response: the direct sound, some discrete
+        early reflections, then an exponentially decaying diffuse tail.
+
+        rt60:       seconds for a 60 dB decay
+        length:     samples, by default the rt60 duration
+        drr_dB:     direct to diffuse tail energy ratio
+
+        returns:    the impulse response, its direct sound at index 0
+    """
+    rng = np.random.default_rng(seed)
+
+    if not length:
+        length = int(rt60 * fs)
+    length = max(length, 16)
+
+    t     = np.arange(length) / fs
+    decay = 10 ** ( -3 * t / rt60 )       # -60 dB at rt60
+
+    h = np.zeros(length)
+    h[0] = 1.0
+
+    # early reflections within the first 20 ms, or the first quarter
+    last = max( 2, min( int(0.020 * fs), length // 4 ) )
+    for i in rng.integers(1, last, reflections):
+        h[i] += rng.uniform(-0.6, 0.6) * decay[i]
+
+    # diffuse tail from the end of the early reflections
+    tail = rng.standard_normal(length) * decay
+    tail[:last] = 0.0
+    energy = np.sum(tail**2)
+    if energy:
+        h += tail * 10 ** (-drr_dB / 20) / np.sqrt(energy)
+
+    return h
+
+
+class SyntheticDUT(object):
+    """ fs:         sample rate
+        rir:        the DUT impulse response, by default a unit impulse,
+                    or a list of them, one per output channel
+        mic_rirs:   optional list of impulse responses, one per mic, to
+                    capture the DUT from several locations at once
+        latency:    play/rec delay in samples, for both channels
+        noise_dB:   white noise level in dBFS (RMS) added to every input
+        dut_gain:   DUT channel gain in addition to the impulse response
+        dropouts:   number of lost blocks, placed at random in the capture
+        dropout_len: samples per lost block
+        seed:       for repeatable noise and dropouts
+    """
+
+    def __init__(self, fs, rir=None, latency=0, noise_dB=-90.0, dut_gain=1.0,
+                       dropouts=0, dropout_len=1024, seed=0, mic_rirs=None):
+
+        self.fs          = fs
+        if isinstance(rir, (list, tuple)):
+            self.rirs    = [ np.asarray(h) for h in rir ]
+        else:
+            self.rirs    = [ np.array([1.0]) if rir is None else np.asarray(rir) ]
+        self.rir         = self.rirs[0]
+        self.mic_rirs    = [ np.asarray(h) for h in mic_rirs ] if mic_rirs else []
+        self.latency     = int(latency)
+        self.noise_dB    = noise_dB
+        self.dut_gain    = dut_gain
+        self.dropouts    = dropouts
+        self.dropout_len = dropout_len
+        self.seed        = seed
+
+        # (start, length) of the last capture dropouts
+        self.dropout_log = []
+
+
+    def playrec(self, data, samplerate=None, channels=2, blocking=True,
+                      out=None, **kwargs):
+        """ Plays <data> (having a channel per column) through the synthetic
+            DUT, returns the (frames, channels) captured array.
+
+            out:    an optional array to write the capture into, as
+                    sounddevice.playrec() does.
+        """
+        data = np.asarray(data, dtype='float64')
+        n    = len(data)
+        rng  = np.random.default_rng(self.seed)
+
+        mics = max(len(self.mic_rirs), 1)
+        z = np.zeros( (n, mics + 1), dtype='float32' )
+
+        if self.mic_rirs:
+            # DUT: out L through by every mic impulse response
+            dut = np.column_stack( [ sp_signal.oaconvolve(data[:, 0], h)[:n]
+                                     for h in self.mic_rirs ] ) * self.dut_gain
+            ref = data[:, 1] if data.shape[1] > 1 else data[:, 0]
+        elif len(self.rirs) == 1:
+            # DUT: out L through by the impulse response
+            dut = sp_signal.oaconvolve(data[:, 0], self.rir)[:n] * self.dut_gain
+            # REF: out R looped back
+            ref = data[:, 1] if data.shape[1] > 1 else data[:, 0]
+        else:
+            # every output through by its own impulse response, no REF loop
+            dut = np.zeros(n)
+            for k, h in enumerate( self.rirs[ : data.shape[1] ] ):
+                dut += sp_signal.oaconvolve(data[:, k], h)[:n] * self.dut_gain
+            ref = np.zeros(n)
+
+        L = min(self.latency, n)
+        z[L:, :mics] = dut[ : n - L].reshape(n - L, -1)
+        z[L:, mics]  = ref[ : n - L]
+
+        if self.noise_dB is not None:
+            z += ( 10 ** (self.noise_dB / 20) *
+                   rng.standard_normal( z.shape ) ).astype('float32')
+
+        self.dropout_log = []
+        if self.dropouts:
+            for start in np.sort( rng.integers(0, max(n - self.dropout_len, 1),
+                                               self.dropouts) ):
+                z[start : start + self.dropout_len] = 0.0
+                self.dropout_log.append( (int(start), self.dropout_len) )
+
+        if out is not None:
+            out[:] = z[:, :out.shape[1]]
+            return out
+
+        return z[:, :channels]
+
+
+    def truth_FRD(self, meas, smooth_Noct=0, channel=0):
+        """ The ground truth FRD of the DUT (or of the given output channel,
+            or mic if mic_rirs), as a logsweep2TF.Measurement would render
+            it from an ideal N length capture.
+
+            returns: f, mag
+        """
+        c = meas.config
+        h = self.mic_rirs[channel] if self.mic_rirs else self.rirs[channel]
+        H = np.fft.rfft(h * self.dut_gain, c.N)
+        return meas.fft_to_FRD(H, smooth_Noct=smooth_Noct)
+
+
+def compare_FRD(f, mag, ftruth, magtruth, fmin=20.0, fmax=20000.0):
+    """ Deviation in dB of a measured FRD from the ground truth, within
+        the given band and over the freqs of both.
+
+        returns: (max_dev_dB, rms_dev_dB)
+    """
+    band = (f >= fmin) & (f <= fmax)
+    dB      = 20 * np.log10( np.abs(mag[band]) )
+    truedB  = 20 * np.log10( np.abs( np.interp(f[band], ftruth, magtruth) ) )
+    dev     = dB - truedB
+    return float( np.max(np.abs(dev)) ), float( np.sqrt(np.mean(dev**2)) )
+
+
+if __name__ == '__main__':
+
+    import logsweep2TF as LS
+
+    LS.N = 2**16
+    LS.prepare_sweep()
+
+    dut = SyntheticDUT( LS.fs, rir=room_ir(LS.fs, rt60=0.2, length=LS.N // 8),
+                        latency=480, noise_dB=-90, dut_gain=0.5 )
+    LS.playrec_func = dut.playrec
+    LS.do_meas()
+
+    f, mag = dut.truth_FRD(LS._meas, smooth_Noct=LS.Noct)
+    maxdev, rmsdev = compare_FRD( *LS.DUT_FRD, f, mag,
+                                  fmax=min(20000, 0.9 * LS.f2_frac * LS.fs / 2) )
+    print( f'--- Synthetic DUT: latency {dut.latency}, found offset {LS._meas.offset}' )
+    print( f'    FRD deviation from the ground truth: '
+           f'max {maxdev:.3f} dB, rms {rmsdev:.3f} dB' )